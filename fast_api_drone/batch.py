@@ -0,0 +1,189 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from fanout import Limits, run_limited
+
+
+class BatchStep(BaseModel):
+    id: str
+    op: str
+    drones: Optional[List[str]] = None  # Drone IDs; every drone in the config when omitted
+    params: Dict[str, Any] = {}
+    depends_on: List[str] = []
+
+
+class BatchRequest(BaseModel):
+    steps: List[BatchStep]
+
+
+def execution_order(steps: List[BatchStep]) -> List[List[str]]:
+    """Group step ids into levels where every step only depends on earlier levels.
+
+    Raises HTTPException (400) for duplicate ids, unknown dependencies and cycles.
+    """
+    dependencies: Dict[str, List[str]] = {}
+    for step in steps:
+        if step.id in dependencies:
+            raise HTTPException(status_code=400, detail=f"Duplicate batch step id '{step.id}'")
+        dependencies[step.id] = list(dict.fromkeys(step.depends_on))
+    for step_id, depends_on in dependencies.items():
+        for dependency in depends_on:
+            if dependency not in dependencies:
+                raise HTTPException(status_code=400, detail=f"Step '{step_id}' depends on unknown step '{dependency}'")
+
+    order = []
+    placed = set()
+    while len(placed) < len(dependencies):
+        level = [step_id for step_id, depends_on in dependencies.items()
+                 if step_id not in placed and all(dependency in placed for dependency in depends_on)]
+        if not level:
+            cycle = sorted(step_id for step_id in dependencies if step_id not in placed)
+            raise HTTPException(status_code=400, detail=f"Batch steps depend on each other in a cycle: {', '.join(cycle)}")
+        order.append(level)
+        placed.update(level)
+    return order
+
+
+class BatchRun:
+    """Runs a validated batch as one task per (step, drone).
+
+    A step's operation on a drone starts as soon as its dependencies are
+    done for that drone, or for every drone of a dependency that does not
+    target it, so drones never wait for each other unless a step says so
+    and independent steps on the same drone (e.g. fence and rally) run at
+    the same time. Operations that cannot overlap on a vehicle are kept
+    apart by the link locks they already take. If a dependency failed the
+    operation is skipped. ``limits`` caps how many operations run at once
+    and abandons each one after its timeout; an operation marked with
+    ``runs_own_steps`` applies them to its own steps instead (set_mission
+    waits for its launch slot outside them). A record's start offset is
+    when its dependencies were done, so it includes any wait for a slot.
+    """
+
+    # Runs continue when a streaming client disconnects; keep them referenced until they finish
+    _running = set()
+
+    def __init__(self, steps: List[BatchStep], order: List[List[str]], targets: Dict[str, List[str]],
+                 operations: Dict[str, Callable[[str], Awaitable[Any]]], limits: Limits):
+        self.steps = {step.id: step for step in steps}
+        self.order = order
+        self.targets = targets
+        self.operations = operations
+        self.limits = limits
+        # Per step and drone: status (ok, failed or skipped), start offset, elapsed and result or error
+        self.records: Dict[str, Dict[str, Dict]] = {step_id: {} for step_id in self.steps}
+        self.elapsed: Optional[float] = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._done: Dict[tuple, asyncio.Future] = {}
+        self._start = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            BatchRun._running.add(self._task)
+            self._task.add_done_callback(BatchRun._running.discard)
+        return self._task
+
+    async def events(self) -> AsyncIterator[Dict]:
+        """Progress events as the run goes, ending with the report."""
+        self.start()
+        yield {"event": "plan", "order": self.order, "targets": self.targets}
+        while True:
+            event = await self._queue.get()
+            if event is None:
+                break
+            yield event
+        yield {"event": "report", **self.report()}
+
+    async def wait(self) -> Dict:
+        """Run to completion and return the report."""
+        await self.start()
+        return self.report()
+
+    def _offset(self) -> float:
+        return round(time.perf_counter() - self._start, 3)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._start = time.perf_counter()
+        for step_id, drones in self.targets.items():
+            for drone_id in drones:
+                self._done[(step_id, drone_id)] = loop.create_future()
+        try:
+            await asyncio.gather(*(self._run_one(step_id, drone_id)
+                                   for level in self.order for step_id in level for drone_id in self.targets[step_id]))
+        finally:
+            self.elapsed = time.perf_counter() - self._start
+            self._queue.put_nowait(None)
+
+    async def _dependencies_ok(self, step_id: str, drone_id: str) -> Optional[str]:
+        """Wait for this operation's dependencies; the first failed dependency, or None."""
+        for dependency in self.steps[step_id].depends_on:
+            drones = [drone_id] if drone_id in self.targets[dependency] else self.targets[dependency]
+            for other in drones:
+                if not await self._done[(dependency, other)]:
+                    return dependency if other == drone_id else f"{dependency} on {other}"
+        return None
+
+    def _finish(self, step_id: str, drone_id: str, record: Dict):
+        self.records[step_id][drone_id] = record
+        self._done[(step_id, drone_id)].set_result(record["status"] == "ok")
+        self._queue.put_nowait({"event": record["status"], "step": step_id, "drone_id": drone_id,
+                                **{key: value for key, value in record.items() if key != "status"}})
+
+    async def _run_one(self, step_id: str, drone_id: str):
+        failed_dependency = await self._dependencies_ok(step_id, drone_id)
+        if failed_dependency is not None:
+            self._finish(step_id, drone_id, {"status": "skipped", "started": None, "elapsed": 0.0,
+                                             "error": f"Dependency {failed_dependency} did not succeed"})
+            return
+
+        started = self._offset()
+        self._queue.put_nowait({"event": "started", "step": step_id, "drone_id": drone_id, "started": started})
+        start = time.perf_counter()
+        try:
+            result = await run_limited(self.limits, self.operations[step_id], drone_id)
+            record = {"status": "ok", "result": result}
+        except asyncio.TimeoutError:
+            record = {"status": "failed", "error": f"Timed out after {self.limits.timeout} seconds"}
+        except HTTPException as e:
+            record = {"status": "failed", "error": str(e.detail)}
+        except Exception as e:
+            record = {"status": "failed", "error": str(e) or type(e).__name__}
+        self._finish(step_id, drone_id, {**record, "started": started,
+                                         "elapsed": round(time.perf_counter() - start, 3)})
+
+    def report(self) -> Dict:
+        """Per-step outcome and timing: first start and last finish (seconds into the batch) and per-drone times."""
+        steps = {}
+        for step_id, step in self.steps.items():
+            records = self.records[step_id]
+            ran = [record for record in records.values() if record["started"] is not None]
+            started = min((record["started"] for record in ran), default=None)
+            finished = max((record["started"] + record["elapsed"] for record in ran), default=None)
+            steps[step_id] = {
+                "op": step.op,
+                "depends_on": step.depends_on,
+                "started": started,
+                "finished": round(finished, 3) if finished is not None else None,
+                "elapsed": round(finished - started, 3) if ran else None,
+                "successful_drones": [drone_id for drone_id, record in records.items() if record["status"] == "ok"],
+                "failed_drones": [{"drone_id": drone_id, "error": record["error"]}
+                                  for drone_id, record in records.items() if record["status"] == "failed"],
+                "skipped_drones": [drone_id for drone_id, record in records.items() if record["status"] == "skipped"],
+                "results": {drone_id: record["result"] for drone_id, record in records.items()
+                            if record["status"] == "ok" and record["result"] is not None},
+                "timings": {drone_id: record["elapsed"] for drone_id, record in records.items()
+                            if record["status"] != "skipped"}
+            }
+        complete = all(not step["failed_drones"] and not step["skipped_drones"] for step in steps.values())
+        return {
+            "status": "Batch completed successfully" if complete else "Some batch steps failed",
+            "elapsed": round(self.elapsed, 3) if self.elapsed is not None else None,
+            "steps": steps
+        }
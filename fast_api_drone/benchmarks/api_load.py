@@ -0,0 +1,359 @@
+"""Load test the drone control endpoints against a simulated swarm.
+
+Starts a SimulatedSwarm of N vehicles in this process, the API in a child
+process (in a scratch directory with a config.yaml pointing at the swarm)
+and drives connect_all_drones, get_all_telemetry polling,
+set_mode_all_drones, set_fence_all_drones and set_mission_all_drones.
+For every operation it reports latency percentiles, requests per second,
+the API's event-loop lag while it ran (sampled inside the API process) and
+the MAVLink messages the API sent per drone per request. Results are written
+as JSON so runs on different commits can be compared. Requires httpx.
+
+    cd fast_api_drone
+    python benchmarks/api_load.py --drones 50 --telemetry-seconds 10 --clients 8
+    python benchmarks/api_load.py --drones 50 --compare benchmarks/results/api_load-<commit>.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml  # noqa: E402
+
+from simulator import SimulatedSwarm, config_section  # noqa: E402
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(APP_DIR, "benchmarks", "results")
+LAG_INTERVAL = 0.01
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def latency_summary(values: List[float]) -> Dict:
+    """Percentiles of a list of durations in seconds, in milliseconds."""
+    return {
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+        "max_ms": round(max(values) * 1000, 2) if values else None
+    }
+
+
+def serve(port: int):
+    """Run the API (from the current directory's config.yaml) with an event-loop lag probe."""
+    import uvicorn
+    import main
+
+    samples: List[float] = []
+
+    async def sample_lag():
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            samples.append(max(0.0, loop.time() - expected))
+
+    @main.app.on_event("startup")
+    async def start_lag_probe():
+        asyncio.get_running_loop().create_task(sample_lag())
+
+    @main.app.get("/benchmark/loop_lag")
+    async def loop_lag(reset: bool = False):
+        result = {**latency_summary(samples), "samples": len(samples)}
+        if reset:
+            samples.clear()
+        return result
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def write_config(directory: str, swarm: SimulatedSwarm, record: bool, link_workers: int, launch_stagger: float):
+    """config.yaml for the swarm, with the repo's missions, fence and rally points."""
+    with open(os.path.join(APP_DIR, "config.yaml")) as config_file:
+        config = yaml.safe_load(config_file)
+    config.pop("drones", None)
+    # By default every drone launches as soon as its mission is uploaded; the stagger would dominate the timing
+    config["settings"] = {**config.get("settings", {}), "launch_stagger": launch_stagger, "recording_enabled": record,
+                          "link_workers": link_workers}
+    with open(os.path.join(directory, "config.yaml"), "w") as config_file:
+        config_file.write(config_section(swarm) + "\n")
+        yaml.safe_dump(config, config_file, sort_keys=False)
+    os.symlink(os.path.join(APP_DIR, "static"), os.path.join(directory, "static"))
+
+
+class SwarmThread:
+    """Runs the swarm on its own event loop so it does not share one with the HTTP clients."""
+
+    def __init__(self, swarm: SimulatedSwarm):
+        self.swarm = swarm
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="simulated-swarm", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.swarm.start(), self.loop).result()
+
+    def uplink(self) -> int:
+        """MAVLink messages the vehicles have received from the API."""
+        return sum(vehicle.received for vehicle in self.swarm.vehicles)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.swarm.close(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+class Benchmark:
+    def __init__(self, client, swarm: SwarmThread, drones: int):
+        self.client = client
+        self.swarm = swarm
+        self.drones = drones
+
+    async def loop_lag(self, reset: bool = False) -> Dict:
+        response = await self.client.get("/benchmark/loop_lag", params={"reset": reset})
+        return response.json()
+
+    async def measure(self, name: str, requests) -> Dict:
+        """Run ``requests`` (an async function returning per-request durations and errors) and summarise it."""
+        await self.loop_lag(reset=True)
+        uplink = self.swarm.uplink()
+        start = time.perf_counter()
+        durations, errors = await requests()
+        elapsed = time.perf_counter() - start
+        sent = self.swarm.uplink() - uplink
+        lag = await self.loop_lag(reset=True)
+
+        result = {
+            "requests": len(durations),
+            "errors": errors,
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_second": round(len(durations) / elapsed, 2) if elapsed else None,
+            "latency": latency_summary(durations),
+            "loop_lag": lag,
+            "mavlink_per_drone_per_request": round(sent / (self.drones * len(durations)), 2) if durations else None
+        }
+        print(f"{name}: {len(durations)} requests, {errors} errors, p50 {result['latency']['p50_ms']} ms, "
+              f"p99 {result['latency']['p99_ms']} ms, {result['requests_per_second']} req/s, "
+              f"loop lag p99 {lag['p99_ms']} ms, {result['mavlink_per_drone_per_request']} MAVLink msgs/drone")
+        return result
+
+    async def repeat(self, method: str, paths: List[str], check=None):
+        """Send the requests one after another; fleet-wide operations must not overlap on the same drones."""
+        durations, errors = [], 0
+        for path in paths:
+            start = time.perf_counter()
+            response = await self.client.request(method, path)
+            durations.append(time.perf_counter() - start)
+            if response.status_code != 200 or (check is not None and not check(response.json())):
+                errors += 1
+        return durations, errors
+
+    async def connect_all(self, attempts: int) -> Dict:
+        """Connect every drone, retrying the drones that missed the heartbeat timeout."""
+        tries = []
+
+        async def requests():
+            for _ in range(attempts):
+                durations, errors = await self.repeat("POST", ["/connect_all_drones"],
+                                                      lambda body: not body.get("failed_drones"))
+                tries.append(durations[0])
+                if not errors:
+                    return tries, 0
+            return tries, 1
+
+        result = await self.measure("connect_all_drones", requests)
+        result["attempts"] = len(tries)
+        return result
+
+    async def telemetry(self, seconds: float, clients: int) -> Dict:
+        async def requests():
+            durations, errors = [], 0
+            deadline = time.perf_counter() + seconds
+
+            async def poll():
+                nonlocal errors
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = await self.client.get("/get_all_telemetry")
+                    durations.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            await asyncio.gather(*(poll() for _ in range(clients)))
+            return durations, errors
+
+        result = await self.measure("get_all_telemetry", requests)
+        result["clients"] = clients
+        return result
+
+    async def fleet(self, name: str, paths: List[str]) -> Dict:
+        return await self.measure(name, lambda: self.repeat("POST", paths, lambda body: not body.get("failed_drones")
+                                                            and "Error" not in json.dumps(body.get("status", ""))))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def wait_for_api(client, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The API exited with code {process.returncode}")
+        try:
+            if (await client.get("/connection_pool")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("The API did not start")
+
+
+async def run(args) -> Dict:
+    swarm = SwarmThread(SimulatedSwarm(args.drones, base_port=args.base_port, udp=args.udp, rate=args.rate,
+                                       drop=args.drop, delay=args.delay, jitter=args.jitter,
+                                       columns=max(1, math.ceil(math.sqrt(args.drones))), seed=1))
+    swarm.start()
+    directory = tempfile.mkdtemp(prefix="api_load-")
+    write_config(directory, swarm.swarm, args.record, args.link_workers, args.launch_stagger)
+    port = free_port()
+    log = open(os.path.join(directory, "api.log"), "w")
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)], cwd=directory,
+                               stdout=log, stderr=subprocess.STDOUT)
+    timeout = httpx.Timeout(args.request_timeout)
+    limits = httpx.Limits(max_connections=max(args.clients, 1) + 2)
+    scenarios = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout, limits=limits) as client:
+            await wait_for_api(client, process)
+            benchmark = Benchmark(client, swarm, args.drones)
+            scenarios["connect_all_drones"] = await benchmark.connect_all(args.connect_attempts)
+            # Let every link finish its stream requests before polling
+            await asyncio.sleep(2.0)
+            scenarios["get_all_telemetry"] = await benchmark.telemetry(args.telemetry_seconds, args.clients)
+            modes = ["GUIDED", "LOITER"]
+            scenarios["set_mode_all_drones"] = await benchmark.fleet(
+                "set_mode_all_drones", [f"/set_mode_all_drones/{modes[i % 2]}" for i in range(args.repeat)])
+            scenarios["set_fence_all_drones"] = await benchmark.fleet(
+                "set_fence_all_drones", ["/set_fence_all_drones"] * args.repeat)
+            scenarios["set_mission_all_drones"] = await benchmark.fleet(
+                "set_mission_all_drones", [f"/set_mission_all_drones/{args.mission}"] * args.repeat)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        swarm.close()
+        if args.keep:
+            print(f"API directory and log kept in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "parameters": {
+            "drones": args.drones, "clients": args.clients, "repeat": args.repeat, "mission": args.mission,
+            "telemetry_seconds": args.telemetry_seconds, "udp": args.udp, "rate": args.rate, "drop": args.drop,
+            "delay": args.delay, "jitter": args.jitter, "record": args.record,
+            "link_workers": args.link_workers, "launch_stagger": args.launch_stagger, "cpus": os.cpu_count()
+        },
+        "scenarios": scenarios
+    }
+
+
+def compare(result: Dict, baseline: Dict):
+    """Print the change in the headline numbers against an earlier run."""
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for name, scenario in result["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for label, now, then in (("p50", scenario["latency"]["p50_ms"], before["latency"]["p50_ms"]),
+                                 ("p99", scenario["latency"]["p99_ms"], before["latency"]["p99_ms"]),
+                                 ("req/s", scenario["requests_per_second"], before["requests_per_second"]),
+                                 ("lag p99", scenario["loop_lag"]["p99_ms"], before["loop_lag"]["p99_ms"])):
+            if now is not None and then:
+                changes.append(f"{label} {then} -> {now} ({100 * (now - then) / then:+.0f}%)")
+        print(f"  {name}: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drones", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent get_all_telemetry pollers")
+    parser.add_argument("--telemetry-seconds", type=float, default=10.0)
+    parser.add_argument("--repeat", type=int, default=3, help="requests per fleet-wide operation")
+    parser.add_argument("--mission", default="mission_1")
+    parser.add_argument("--launch-stagger", type=float, default=0.0,
+                        help="seconds between mission launches in set_mission_all_drones")
+    parser.add_argument("--connect-attempts", type=int, default=5)
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--base-port", type=int, default=25760, help="first simulated vehicle port")
+    parser.add_argument("--udp", action="store_true")
+    parser.add_argument("--rate", type=float, default=None, help="fixed telemetry rate in Hz")
+    parser.add_argument("--drop", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--record", action="store_true", help="leave the flight recorder on")
+    parser.add_argument("--link-workers", type=int, default=0, help="settings.link_workers for the API (sharded mode)")
+    parser.add_argument("--output", default=None, help="JSON file (default: benchmarks/results/api_load-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="earlier JSON result to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the API's scratch directory and log")
+    parser.add_argument("--serve", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve)
+        return
+    if httpx is None:
+        sys.exit("The API benchmark requires httpx (pip install httpx)")
+
+    result = asyncio.run(run(args))
+    output = args.output or os.path.join(RESULTS_DIR, f"api_load-{result['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(result, output_file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(result, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Measure the CPU cost of the flight recorder and the speed of tlog replay.
+
+Feeds real encoded MAVLink frames to a FlightRecorder at a fixed rate per
+drone, as the link reader threads would, and reports the recorder's CPU time
+as a share of one core (the reader-side append plus the writer thread),
+followed by how fast the resulting files replay through TlogReader.
+
+    cd fast_api_drone
+    python benchmarks/recorder_overhead.py --drones 20 --rate 50 --seconds 10
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymavlink.dialects.v20.all as dialect  # noqa: E402
+
+from recorder import FlightRecorder, TlogReader  # noqa: E402
+
+
+def sample_frames(drone: int):
+    """One second's worth of typical telemetry frame types from one vehicle."""
+    mav = dialect.MAVLink(None, srcSystem=drone, srcComponent=1)
+    messages = [
+        dialect.MAVLink_global_position_int_message(0, -353600000, 1491600000, 584000, 20000, 100, 0, 0, 9000),
+        dialect.MAVLink_attitude_message(0, 0.01, 0.02, 1.5, 0.0, 0.0, 0.0),
+        dialect.MAVLink_vfr_hud_message(1.0, 1.0, 90, 50, 584.0, 0.0),
+        dialect.MAVLink_gps_raw_int_message(0, 3, -353600000, 1491600000, 584000, 100, 100, 500, 0, 10),
+        dialect.MAVLink_sys_status_message(0, 0, 0, 500, 12000, 0, 88, 0, 0, 0, 0, 0, 0),
+    ]
+    return [bytes(message.pack(mav)) for message in messages]
+
+
+def run(drones: int, rate: float, seconds: float, directory: str):
+    frames = [sample_frames(drone + 1) for drone in range(drones)]
+    drone_ids = [f"drone_{drone + 1}" for drone in range(drones)]
+    recorder = FlightRecorder(directory)
+    recorder.start()
+
+    interval = 1.0 / rate
+    ticks = int(seconds * rate)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    for tick in range(ticks):
+        now = time.time()
+        for drone, drone_id in enumerate(drone_ids):
+            recorder.record(drone_id, now, frames[drone][tick % len(frames[drone])])
+        remaining = start_wall + (tick + 1) * interval - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+    recorder.close()
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    replay_start = time.perf_counter()
+    replayed = 0
+    for recording in recorder.recordings():
+        with TlogReader(os.path.join(directory, recording["name"])) as reader:
+            for _ in reader.frames():
+                replayed += 1
+    replay = time.perf_counter() - replay_start
+
+    return {
+        "drones": drones,
+        "rate": rate,
+        "frames_recorded": recorder.frames_written,
+        "frames_dropped": recorder.dropped,
+        "bytes_written": recorder.bytes_written,
+        "cpu_percent": round(100 * cpu / wall, 2),
+        "frames_replayed": replayed,
+        "replay_frames_per_second": round(replayed / replay) if replay else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drones", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=50.0, help="frames per second per drone")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        result = run(args.drones, args.rate, args.seconds, directory)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['drones']} drones x {result['rate']:g} Hz: {result['frames_recorded']} frames "
+          f"({result['bytes_written'] / 1024:.0f} KiB), {result['frames_dropped']} dropped")
+    print(f"Recorder CPU: {result['cpu_percent']}% of one core (includes the driving loop)")
+    print(f"Replay: {result['frames_replayed']} frames at {result['replay_frames_per_second']} frames/s")
+
+
+if __name__ == "__main__":
+    main()
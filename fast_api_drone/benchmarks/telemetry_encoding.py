@@ -0,0 +1,114 @@
+"""Compare JSON telemetry with the compact binary encoding.
+
+Simulates a swarm flying for a number of frames and reports bytes per frame
+and encode/decode time for the JSON the API sends today, compact key frames
+(what the HTTP endpoints return) and compact delta frames (what a WebSocket
+stream sends after the first frame).
+
+    cd fast_api_drone
+    python benchmarks/telemetry_encoding.py --drones 50 --frames 500
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact import CompactDecoder, CompactEncoder  # noqa: E402
+
+
+def simulate(drones: int, frames: int, rate: float, hovering: float, seed: int = 1):
+    """Telemetry frames for a swarm where a ``hovering`` fraction of drones stand still."""
+    rng = random.Random(seed)
+    state = []
+    for i in range(drones):
+        state.append({
+            "latitude": -35.36 + rng.uniform(-0.01, 0.01),
+            "longitude": 149.16 + rng.uniform(-0.01, 0.01),
+            "altitude": 584.0 + rng.uniform(0, 50),
+            "relative_altitude": rng.uniform(20, 60),
+            "velocity": 0.0 if i < drones * hovering else rng.uniform(5, 15),
+            "heading": rng.uniform(0, 360),
+            "battery_remaining": rng.randint(40, 100),
+            "gps_fix": 3,
+            "last_update": 0.0
+        })
+
+    for frame in range(frames):
+        entries = []
+        for i, telemetry in enumerate(state):
+            if telemetry["velocity"] > 0:
+                distance = telemetry["velocity"] / rate
+                heading = math.radians(telemetry["heading"])
+                telemetry["latitude"] += distance * math.cos(heading) / 111_320
+                telemetry["longitude"] += distance * math.sin(heading) / (111_320 * math.cos(math.radians(telemetry["latitude"])))
+                telemetry["heading"] = (telemetry["heading"] + rng.uniform(-2, 2)) % 360
+                telemetry["relative_altitude"] += rng.uniform(-0.05, 0.05)
+            telemetry["last_update"] = round(rng.uniform(0, 1 / rate), 3)
+            if frame % 600 == 599:
+                telemetry["battery_remaining"] -= 1
+            entries.append({"drone_id": f"drone_{i + 1}", "telemetry": dict(telemetry)})
+        yield frame / rate, entries
+
+
+def measure(name, frames, encode, decode):
+    encoded = []
+    start = time.perf_counter()
+    for timestamp, entries in frames:
+        encoded.append(encode(entries, timestamp))
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for payload in encoded:
+        decode(payload)
+    decode_time = time.perf_counter() - start
+
+    sizes = [len(payload) for payload in encoded]
+    return {
+        "format": name,
+        "bytes_per_frame": sum(sizes) / len(sizes),
+        "max_bytes": max(sizes),
+        "encode_us": encode_time / len(frames) * 1e6,
+        "decode_us": decode_time / len(frames) * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drones", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=4.0, help="Stream rate in Hz, sets how far drones move per frame")
+    parser.add_argument("--hovering", type=float, default=0.2, help="Fraction of drones standing still")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    frames = list(simulate(args.drones, args.frames, args.rate, args.hovering))
+
+    key_encoder = CompactEncoder(keyframes_only=True)
+    delta_encoder, delta_decoder = CompactEncoder(), CompactDecoder()
+    results = [
+        measure("json", frames,
+                lambda entries, timestamp: json.dumps({"timestamp": timestamp, "telemetry": entries}).encode(),
+                json.loads),
+        measure("compact key frames", frames, key_encoder.encode, lambda payload: CompactDecoder().decode(payload)),
+        measure("compact deltas", frames, delta_encoder.encode, delta_decoder.decode)
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    baseline = results[0]["bytes_per_frame"]
+    print(f"{args.drones} drones, {args.frames} frames at {args.rate} Hz, {args.hovering:.0%} hovering")
+    print(f"{'format':<20}{'bytes/frame':>12}{'max bytes':>11}{'vs json':>9}{'encode us':>11}{'decode us':>11}")
+    for result in results:
+        print(f"{result['format']:<20}{result['bytes_per_frame']:>12.0f}{result['max_bytes']:>11}"
+              f"{result['bytes_per_frame'] / baseline:>9.1%}{result['encode_us']:>11.0f}{result['decode_us']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
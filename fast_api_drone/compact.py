@@ -0,0 +1,208 @@
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Media type clients put in their Accept header to receive compact telemetry
+COMPACT_MEDIA_TYPE = "application/x-drone-telemetry"
+
+VERSION = 2
+KEY_FRAME = 0
+DELTA_FRAME = 1
+
+OK = 0
+ERROR = 1
+
+# Telemetry field, scale to an integer, the integer stored when the value is None, and the range
+# real values are clamped to; the marker is always outside that range so no reading decodes as None
+FIELDS: Tuple[Tuple[str, float, int, int, int], ...] = (
+    ("latitude", 1e7, -2 ** 31, -2 ** 31 + 1, 2 ** 31 - 1),           # degrees * 1e7, as in GLOBAL_POSITION_INT
+    ("longitude", 1e7, -2 ** 31, -2 ** 31 + 1, 2 ** 31 - 1),          # degrees * 1e7
+    ("altitude", 1e3, -2 ** 31, -2 ** 31 + 1, 2 ** 31 - 1),           # millimetres
+    ("relative_altitude", 1e3, -2 ** 31, -2 ** 31 + 1, 2 ** 31 - 1),
+    ("velocity", 1e2, 0xFFFF, 0, 0xFFFE),                             # cm/s
+    ("heading", 1e2, 0xFFFF, 0, 0xFFFE),                              # centidegrees
+    ("battery_remaining", 1, -128, -127, 127),                        # percent, -1 is "unknown" as sent by the vehicle
+    ("gps_fix", 1, 0xFF, 0, 0xFE),
+    ("last_update", 1e3, 0xFFFF, 0, 0xFFFE),                          # milliseconds, saturated
+)
+
+HEADER = struct.Struct("<BBd")           # version, frame kind, timestamp
+RECORD = struct.Struct("<iiiiHHbBH")     # one key-frame telemetry record, 24 bytes
+
+
+def wants_compact(accept: Optional[str]) -> bool:
+    """True if an Accept header asks for the compact encoding (and does not refuse it with q=0)."""
+    if not accept:
+        return False
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if media_type.lower() == COMPACT_MEDIA_TYPE:
+            return not any(param.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for param in params)
+    return False
+
+
+def quantize(telemetry: Dict) -> Tuple[int, ...]:
+    values = []
+    for name, scale, missing, low, high in FIELDS:
+        value = telemetry.get(name)
+        values.append(missing if value is None else max(low, min(high, round(value * scale))))
+    return tuple(values)
+
+
+def dequantize(values: Sequence[int]) -> Dict:
+    return {name: None if value == missing else (value / scale if scale != 1 else value)
+            for (name, scale, missing, low, high), value in zip(FIELDS, values)}
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_str(out: bytearray, text: str):
+    encoded = text.encode("utf-8")
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+class CompactEncoder:
+    """Encodes ``DroneTelemetryResponse``-shaped entries for one client.
+
+    The first frame is a key frame: drone IDs followed by a fixed 24-byte
+    record per drone (int32 lat/lon scaled by 1e7, altitudes in mm, speed
+    and heading in hundredths). Later frames are deltas against what this
+    client was last sent: only drones with changed fields, each as a field
+    bitmask and zigzag varint differences, so a hovering drone costs a couple
+    of bytes or nothing at all. A key frame is sent again whenever the set of
+    drones or an error state changes. Use a fresh encoder (or ``keyframes_only``)
+    for stateless responses.
+    """
+
+    def __init__(self, keyframes_only: bool = False):
+        self.keyframes_only = keyframes_only
+        self._drone_ids: Optional[List[str]] = None
+        self._previous: List = []
+
+    def encode(self, entries: Sequence[Dict], timestamp: float) -> bytes:
+        drone_ids = [entry["drone_id"] for entry in entries]
+        # Quantized record per drone, or the error string for drones without telemetry
+        current = [(entry.get("error") or "") if entry.get("telemetry") is None else quantize(_as_dict(entry["telemetry"]))
+                   for entry in entries]
+
+        error_changed = any(old != new and (isinstance(old, str) or isinstance(new, str))
+                            for old, new in zip(self._previous, current))
+        if self.keyframes_only or drone_ids != self._drone_ids or error_changed:
+            frame = self._key_frame(drone_ids, current, timestamp)
+        else:
+            frame = self._delta_frame(current, timestamp)
+
+        self._drone_ids = drone_ids
+        self._previous = current
+        return bytes(frame)
+
+    def _key_frame(self, drone_ids: List[str], current: List, timestamp: float) -> bytearray:
+        out = bytearray(HEADER.pack(VERSION, KEY_FRAME, timestamp))
+        _write_varint(out, len(drone_ids))
+        for drone_id, values in zip(drone_ids, current):
+            _write_str(out, drone_id)
+            if isinstance(values, str):
+                out.append(ERROR)
+                _write_str(out, values)
+            else:
+                out.append(OK)
+                out += RECORD.pack(*values)
+        return out
+
+    def _delta_frame(self, current: List, timestamp: float) -> bytearray:
+        body = bytearray()
+        changed = 0
+        for index, (old, new) in enumerate(zip(self._previous, current)):
+            if old == new:
+                continue
+            mask = 0
+            deltas = bytearray()
+            for bit, (before, after) in enumerate(zip(old, new)):
+                if before != after:
+                    mask |= 1 << bit
+                    _write_varint(deltas, _zigzag(after - before))
+            _write_varint(body, index)
+            _write_varint(body, mask)
+            body += deltas
+            changed += 1
+
+        out = bytearray(HEADER.pack(VERSION, DELTA_FRAME, timestamp))
+        _write_varint(out, changed)
+        return out + body
+
+
+class CompactDecoder:
+    """Client side of ``CompactEncoder``; keeps the state deltas apply to."""
+
+    def __init__(self):
+        self._drone_ids: List[str] = []
+        self._values: List = []
+
+    def decode(self, data: bytes) -> Dict:
+        version, kind, timestamp = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"Unsupported compact telemetry version {version}")
+        count, pos = _read_varint(data, HEADER.size)
+
+        if kind == KEY_FRAME:
+            self._drone_ids, self._values = [], []
+            for _ in range(count):
+                drone_id, pos = _read_str(data, pos)
+                status = data[pos]
+                pos += 1
+                if status == ERROR:
+                    error, pos = _read_str(data, pos)
+                    self._values.append(error)
+                else:
+                    self._values.append(list(RECORD.unpack_from(data, pos)))
+                    pos += RECORD.size
+                self._drone_ids.append(drone_id)
+        elif kind == DELTA_FRAME:
+            for _ in range(count):
+                index, pos = _read_varint(data, pos)
+                mask, pos = _read_varint(data, pos)
+                values = self._values[index]
+                for bit in range(len(FIELDS)):
+                    if mask & (1 << bit):
+                        delta, pos = _read_varint(data, pos)
+                        values[bit] += _unzigzag(delta)
+        else:
+            raise ValueError(f"Unknown compact telemetry frame kind {kind}")
+
+        telemetry = [{"drone_id": drone_id, "error": values} if isinstance(values, str)
+                     else {"drone_id": drone_id, "telemetry": dequantize(values)}
+                     for drone_id, values in zip(self._drone_ids, self._values)]
+        return {"timestamp": timestamp, "telemetry": telemetry}
+
+
+def _as_dict(telemetry) -> Dict:
+    return telemetry if isinstance(telemetry, dict) else telemetry.dict()
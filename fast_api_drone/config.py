@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from typing import Dict, Literal, Optional, Tuple
+
+import yaml
+from pydantic import BaseModel, validator
+
+
+class FrozenModel(BaseModel):
+    class Config:
+        frozen = True
+
+
+class DroneConfig(FrozenModel):
+    connection_string: str
+    system_id: Optional[int] = None
+
+
+class Waypoint(FrozenModel):
+    latitude: float
+    longitude: float
+    altitude: float
+    command: int  # MAVLink command (e.g., MAV_CMD_NAV_WAYPOINT, MAV_CMD_NAV_TAKEOFF)
+
+
+class FencePolygon(FrozenModel):
+    coordinates: Tuple[Tuple[float, float], ...]  # [latitude, longitude]
+    inclusion: bool = True  # False for a keep-out area
+
+    @validator("coordinates")
+    def check_vertices(cls, coordinates):
+        if len(coordinates) < 3:
+            raise ValueError("a fence polygon needs at least 3 vertices")
+        return coordinates
+
+
+class FenceCircle(FrozenModel):
+    latitude: float
+    longitude: float
+    radius: float  # metres
+    inclusion: bool = True
+
+
+class FenceConfig(FrozenModel):
+    coordinates: Tuple[Tuple[float, float], ...] = ()  # [latitude, longitude] of the inclusion polygon
+    polygons: Tuple[FencePolygon, ...] = ()
+    circles: Tuple[FenceCircle, ...] = ()
+
+    @validator("coordinates")
+    def check_vertices(cls, coordinates):
+        if coordinates and len(coordinates) < 3:
+            raise ValueError("a fence polygon needs at least 3 vertices")
+        return coordinates
+
+    @property
+    def legacy_layout(self) -> bool:
+        """``coordinates`` in the ArduPilot FENCE_POINT layout: return point first, and the
+        last point repeating the first vertex to close the polygon."""
+        return len(self.coordinates) >= 5 and self.coordinates[1] == self.coordinates[-1]
+
+    @property
+    def return_point(self) -> Optional[Tuple[float, float]]:
+        return self.coordinates[0] if self.legacy_layout else None
+
+    def all_polygons(self) -> Tuple[FencePolygon, ...]:
+        """``coordinates`` as the first inclusion polygon, followed by ``polygons``."""
+        if not self.coordinates:
+            return self.polygons
+        vertices = self.coordinates[1:-1] if self.legacy_layout else self.coordinates
+        return (FencePolygon(coordinates=vertices),) + self.polygons
+
+    @property
+    def legacy_compatible(self) -> bool:
+        """The legacy FENCE_POINT protocol only supports the single ``coordinates`` polygon."""
+        return not self.polygons and not self.circles
+
+
+class RallyConfig(FrozenModel):
+    coordinates: Tuple[Tuple[float, float, float], ...]  # [latitude, longitude, altitude]
+
+
+class Settings(FrozenModel):
+    separation_time: float = 5.0
+    launch_stagger: Optional[float] = None
+    fanout_concurrency: int = 16
+    drone_timeout: float = 120.0
+    history_size: int = 18000  # Telemetry history samples kept per drone (30 minutes at 10 Hz)
+    separation_distance: float = 10.0  # Metres two drones may not come closer than
+    separation_horizon: float = 10.0  # Seconds ahead to predict conflicts from current velocities
+    fence_margin: float = 20.0  # Metres from a fence boundary that count as a near breach
+    recording_enabled: bool = True  # Record every received MAVLink frame to recordings/*.tlog
+    link_workers: int = 0  # Worker processes that own the drone links; 0 keeps them in the API process (read at startup)
+    telemetry_table: Optional[str] = None  # Shared-memory telemetry table name; needed for uvicorn --workers (read at startup)
+    profiling_enabled: bool = False  # Allow request profiling (sampled, or with an X-Profile: 1 header)
+    profiling_sample_rate: float = 0.0  # Fraction of requests profiled when profiling is enabled
+    fence_protocol: Literal["auto", "mission", "legacy"] = "auto"  # MAV_MISSION_TYPE_FENCE, FENCE_POINT, or mission with legacy fallback
+    llm_base_url: Optional[str] = None  # OpenAI-compatible endpoint for /trigger_command, e.g. llm_stub.py; OpenAI when unset
+    llm_model: str = "gpt-4"
+    llm_timeout: float = 10.0  # Seconds /trigger_command waits for the LLM
+    intent_cache_size: int = 1024  # LLM answers kept per normalized command (read at startup)
+    intent_cache_ttl: float = 3600.0  # Seconds an LLM answer is reused (read at startup)
+
+
+class AppConfig(FrozenModel):
+    """Validated contents of config.yaml.
+
+    Snapshots are shared between requests and must be treated as read-only;
+    ``version`` increases every time the file is reloaded.
+    """
+    version: int = 0
+    drones: Dict[str, DroneConfig]
+    settings: Settings = Settings()
+    waypoints: Dict[str, Tuple[Waypoint, ...]] = {}
+    fence: Optional[FenceConfig] = None
+    rally: Optional[RallyConfig] = None
+
+
+class ConfigService:
+    """Parses config.yaml once and reloads it only when the file changes.
+
+    The file's mtime is checked at most every ``check_interval`` seconds. A new
+    snapshot is validated completely before it replaces the old one, so readers
+    always see either the old or the new config, never a partial one. If an
+    edited file fails to parse or validate, the previous snapshot is kept.
+    """
+
+    def __init__(self, path: str = "config.yaml", check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot: Optional[AppConfig] = None
+        self._mtime: Optional[int] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> AppConfig:
+        now = time.monotonic()
+        if self._snapshot is None or now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._reload_if_changed()
+        return self._snapshot
+
+    def _reload_if_changed(self):
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime and self._snapshot is not None:
+                return
+
+            try:
+                with open(self.path, "r") as config_file:
+                    raw = yaml.safe_load(config_file) or {}
+                version = self._snapshot.version + 1 if self._snapshot is not None else 1
+                snapshot = AppConfig(**{**raw, "version": version})
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                print(f"Ignoring invalid {self.path}, keeping version {self._snapshot.version}: {e}")
+                self._mtime = mtime
+                return
+
+            self._snapshot = snapshot
+            self._mtime = mtime
@@ -0,0 +1,43 @@
+import asyncio
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+
+class EventBus:
+    """Recent safety events (geofence breaches, conflicts, ...) and their live subscribers.
+
+    Events are plain dicts with an increasing ``id``, a ``type`` and a
+    ``timestamp``. The last ``history`` events are kept for polling with
+    ``since``; stream subscribers get a bounded queue that drops its oldest
+    event rather than growing when the client falls behind.
+    """
+
+    def __init__(self, history: int = 1000):
+        self.events: deque = deque(maxlen=history)
+        self._next_id = 1
+        self._subscribers: List[asyncio.Queue] = []
+
+    def publish(self, event_type: str, **fields) -> Dict:
+        event = {"id": self._next_id, "type": event_type, "timestamp": time.time(), **fields}
+        self._next_id += 1
+        self.events.append(event)
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+        return event
+
+    def since(self, event_id: int = 0, types: Optional[Set[str]] = None) -> List[Dict]:
+        """Stored events newer than ``event_id``, optionally only of the given types."""
+        return [event for event in self.events
+                if event["id"] > event_id and (types is None or event["type"] in types)]
+
+    def subscribe(self, maxsize: int = 100) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
@@ -0,0 +1,235 @@
+"""Convert .tlog flight recordings into one columnar table per MAVLink message type.
+
+    cd fast_api_drone
+    python export.py recordings/*.tlog --output exports --format parquet
+
+Each message type becomes ``<output>/<MESSAGE_TYPE>/<recording>.parquet`` (or
+``.arrow``), so a whole session loads with e.g.
+``pandas.read_parquet("exports/GLOBAL_POSITION_INT")``. Requires pyarrow.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+from recorder import TIMESTAMP, TlogReader, recording_drone_id
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = ("parquet", "arrow")
+
+# struct format characters used by pymavlink, as little-endian NumPy types
+NUMPY_TYPES = {"b": "i1", "B": "u1", "h": "<i2", "H": "<u2", "i": "<i4", "I": "<u4",
+               "q": "<i8", "Q": "<u8", "f": "<f4", "d": "<f8"}
+
+
+class ExportError(Exception):
+    pass
+
+
+def payload_dtype(cls) -> np.dtype:
+    """Structured dtype matching the wire layout of a message's payload, extensions included."""
+    tokens = re.findall(r"(\d*)([a-zA-Z])", cls.unpacker.format[1:])
+    fields = []
+    for name, (count, code) in zip(cls.ordered_fieldnames, tokens):
+        count = int(count or 1)
+        if code in ("s", "c"):
+            fields.append((name, f"S{count}"))
+        elif count > 1:
+            fields.append((name, NUMPY_TYPES[code], (count,)))
+        else:
+            fields.append((name, NUMPY_TYPES[code]))
+    dtype = np.dtype(fields)
+    if dtype.itemsize != cls.unpacker.size:
+        raise ExportError(f"Payload layout of {cls.msgname} does not match its format")
+    return dtype
+
+
+class MessageTable:
+    """Decoded rows of one message type, written out a row group at a time.
+
+    Batches of rows are kept as NumPy arrays until ``row_group_size`` rows
+    have accumulated, then converted to Arrow columns and written as one row
+    group, so memory stays bounded however long the recording is.
+    """
+
+    def __init__(self, cls, drone_id: str, path: str, file_format: str, row_group_size: int):
+        self.cls = cls
+        self.dtype = payload_dtype(cls)
+        self.drone_id = drone_id
+        self.path = path
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.batches = []
+        self.rows = 0
+        self.written = 0
+        self._writer = None
+
+    def add(self, received: np.ndarray, system_ids: np.ndarray, component_ids: np.ndarray, payloads: np.ndarray):
+        self.batches.append((received, system_ids, component_ids, payloads))
+        self.rows += len(received)
+        if self.rows >= self.row_group_size:
+            self.flush()
+
+    def _column(self, values: np.ndarray):
+        if values.dtype.kind == "S":
+            # Fixed-size char fields are NUL terminated when shorter than the field
+            return pa.array([value.split(b"\0", 1)[0].decode("utf-8", "replace") for value in values.tolist()],
+                            type=pa.string())
+        if values.ndim == 2:
+            return pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(values).reshape(-1)), values.shape[1])
+        return pa.array(np.ascontiguousarray(values))
+
+    def flush(self):
+        if self.rows == 0:
+            return
+        received, system_ids, component_ids, payloads = (np.concatenate(parts) for parts in zip(*self.batches))
+        columns = {
+            "received": pa.array(received).cast(pa.timestamp("us", tz="UTC")),
+            "drone_id": pa.DictionaryArray.from_arrays(pa.array(np.zeros(self.rows, dtype=np.int32)), pa.array([self.drone_id])),
+            "system_id": pa.array(system_ids),
+            "component_id": pa.array(component_ids),
+        }
+        for name in self.cls.fieldnames:
+            columns[name] = self._column(payloads[name])
+        table = pa.table(columns)
+
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self.file_format == "parquet":
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            else:
+                self._writer = pa.ipc.new_file(self.path, table.schema)
+        if self.file_format == "parquet":
+            self._writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            self._writer.write_table(table, max_chunksize=self.row_group_size)
+
+        self.written += self.rows
+        self.rows = 0
+        self.batches = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def gather(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray, width: int) -> np.ndarray:
+    """Bytes ``data[start:start + length]`` of every frame, zero-padded to ``width``, as an (n, width) array.
+
+    MAVLink 2 trims trailing zero bytes from payloads and MAVLink 1 frames
+    have no extension fields, so short payloads are padded back to the full
+    layout.
+    """
+    columns = np.arange(width)
+    index = np.minimum(starts[:, None] + columns, len(data) - 1)
+    return np.where(columns < lengths[:, None], data[index], 0).astype(np.uint8)
+
+
+def export_file(path: str, output: str, file_format: str = "parquet", row_group_size: int = 65536) -> Dict:
+    """Convert one recording, decoding ``row_group_size`` frames at a time with NumPy.
+
+    At most about two row groups per message type are held in memory.
+    """
+    if pa is None:
+        raise ExportError("Exporting recordings requires pyarrow (pip install pyarrow)")
+    if file_format not in FORMATS:
+        raise ExportError(f"Unknown export format {file_format}, expected one of {', '.join(FORMATS)}")
+
+    start = time.perf_counter()
+    name = os.path.basename(path)
+    stem = name[:-len(".tlog")] if name.endswith(".tlog") else name
+    drone_id = recording_drone_id(name)
+    tables: Dict[int, MessageTable] = {}
+    unknown = 0
+    frames = 0
+
+    with TlogReader(path) as reader:
+        data = reader.as_array()
+        for offsets in reader.frame_offsets(row_group_size):
+            frames += len(offsets)
+            v2 = data[offsets] == dialect.PROTOCOL_MARKER_V2
+            lengths = data[offsets + 1].astype(np.intp)
+            # Header fields sit at different offsets in MAVLink 1 and 2 frames
+            msg_ids = np.where(v2, data[offsets + 7] | data[offsets + 8].astype(np.int32) << 8 | data[offsets + 9].astype(np.int32) << 16,
+                               data[offsets + 5])
+            system_ids = np.where(v2, data[offsets + 5], data[offsets + 3])
+            component_ids = np.where(v2, data[offsets + 6], data[offsets + 4])
+            payload_starts = offsets + np.where(v2, 10, 6)
+            received = gather(data, offsets - TIMESTAMP.size, np.full(len(offsets), TIMESTAMP.size), TIMESTAMP.size) \
+                .view(">u8").ravel().astype(np.int64)
+
+            order = np.argsort(msg_ids, kind="stable")
+            boundaries = np.flatnonzero(np.diff(msg_ids[order])) + 1
+            for rows in np.split(order, boundaries):
+                msg_id = int(msg_ids[rows[0]])
+                table = tables.get(msg_id)
+                if table is None:
+                    cls = dialect.mavlink_map.get(msg_id)
+                    if cls is None:
+                        unknown += len(rows)
+                        continue
+                    table = tables[msg_id] = MessageTable(cls, drone_id, os.path.join(output, cls.msgname, f"{stem}.{file_format}"),
+                                                          file_format, row_group_size)
+                payloads = gather(data, payload_starts[rows], lengths[rows], table.dtype.itemsize)
+                table.add(received[rows], system_ids[rows], component_ids[rows], payloads.view(table.dtype).ravel())
+        truncated = reader.truncated_at is not None
+        del data
+
+    for table in tables.values():
+        table.close()
+
+    return {
+        "recording": name,
+        "drone_id": drone_id,
+        "frames": frames,
+        "unknown_messages": unknown,
+        "truncated": truncated,
+        "tables": {table.cls.msgname: table.written for table in tables.values()},
+        "elapsed": round(time.perf_counter() - start, 3)
+    }
+
+
+def export_recordings(paths: List[str], output: str, file_format: str = "parquet", row_group_size: int = 65536,
+                      workers: Optional[int] = None) -> List[Dict]:
+    """Convert several recordings in parallel, one file per worker process at a time."""
+    if len(paths) <= 1 or workers == 1:
+        return [export_file(path, output, file_format, row_group_size) for path in paths]
+    # Spawned rather than forked: the server process has reader threads that must not be copied mid-operation
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(paths)),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(export_file, path, output, file_format, row_group_size) for path in paths]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .tlog recordings to Parquet or Arrow tables per message type")
+    parser.add_argument("recordings", nargs="+", help=".tlog files")
+    parser.add_argument("--output", default="exports")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--row-group-size", type=int, default=65536)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = export_recordings(args.recordings, args.output, args.format, args.row_group_size, args.workers)
+    for result in results:
+        print(f"{result['recording']}: {result['frames']} frames into {len(result['tables'])} tables in {result['elapsed']}s")
+    print(f"Exported {sum(result['frames'] for result in results)} frames from {len(results)} recordings "
+          f"to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+
+class FanOutResult:
+    """Outcome of one per-drone operation run by ``fan_out``."""
+
+    def __init__(self, drone_id: str, ok: bool, elapsed: float, result: Any = None, error: Optional[str] = None):
+        self.drone_id = drone_id
+        self.ok = ok
+        self.elapsed = elapsed
+        self.result = result
+        self.error = error
+
+
+class Limits:
+    """Concurrency slots and per-step timeout shared by every drone of one fan-out or batch.
+
+    ``run`` holds a slot and applies the timeout to one step. Runners put a
+    whole operation through ``run`` unless it is marked with
+    ``runs_own_steps``: those operations call ``run`` for their timed steps
+    themselves, so an untimed wait in between (e.g. for a ``Stagger`` launch
+    slot) holds no slot and does not count against the timeout.
+    """
+
+    def __init__(self, concurrency: int = 16, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(self, step: Awaitable[Any]) -> Any:
+        async with self._semaphore:
+            return await asyncio.wait_for(step, self.timeout)
+
+
+def runs_own_steps(operation: Callable) -> Callable:
+    """Mark an operation that puts its own timed steps through ``Limits.run``."""
+    operation.runs_own_steps = True
+    return operation
+
+
+async def run_limited(limits: Limits, operation: Callable[..., Awaitable[Any]], *args) -> Any:
+    """``operation(*args)`` within ``limits``, unless it applies them to its own steps."""
+    if getattr(operation, "runs_own_steps", False):
+        return await operation(*args)
+    return await limits.run(operation(*args))
+
+
+async def fan_out(links: Dict[str, Any], operation: Callable[[str, Any], Awaitable[Any]],
+                  concurrency: int = 16, timeout: Optional[float] = None,
+                  limits: Optional[Limits] = None) -> Dict[str, FanOutResult]:
+    """Run ``operation(drone_id, link)`` for every drone at the same time.
+
+    At most ``concurrency`` operations are in flight at once and each one is
+    cancelled after ``timeout`` seconds (or as given by ``limits``, which a
+    ``runs_own_steps`` operation also uses). Failures are captured per drone
+    so one bad link never fails the whole swarm request.
+    """
+    limits = limits or Limits(concurrency, timeout)
+
+    async def run_one(drone_id: str, link: Any) -> FanOutResult:
+        start = time.perf_counter()
+        try:
+            result = await run_limited(limits, operation, drone_id, link)
+            return FanOutResult(drone_id, True, time.perf_counter() - start, result=result)
+        except asyncio.TimeoutError:
+            error = f"Timed out after {limits.timeout} seconds"
+        except HTTPException as e:
+            error = str(e.detail)
+        except Exception as e:
+            error = str(e)
+        return FanOutResult(drone_id, False, time.perf_counter() - start, error=error)
+
+    results = await asyncio.gather(*(run_one(drone_id, link) for drone_id, link in list(links.items())))
+    return {result.drone_id: result for result in results}
+
+
+def summarize(results: Dict[str, FanOutResult]) -> Dict[str, Any]:
+    """Split fan-out results into the successful/failed lists the endpoints return."""
+    return {
+        "successful_drones": [drone_id for drone_id, result in results.items() if result.ok],
+        "failed_drones": [{"drone_id": drone_id, "error": result.error} for drone_id, result in results.items() if not result.ok],
+        "timings": {drone_id: round(result.elapsed, 3) for drone_id, result in results.items()}
+    }
+
+
+class Stagger:
+    """Hands out start slots at least ``interval`` seconds apart.
+
+    Each caller reserves the next free slot and sleeps until it, so launches
+    are spaced out in the order drones become ready while everything before
+    the launch (e.g. the mission upload) still runs concurrently.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_slot = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
@@ -0,0 +1,15 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000.0  # metres
+
+
+def local_xy(latitude, longitude, origin_latitude: float, origin_longitude: float):
+    """Equirectangular projection to metres east (x) and north (y) of an origin.
+
+    Accurate to well under a metre over the few kilometres a swarm operates
+    in, and works element-wise on NumPy arrays.
+    """
+    scale = np.pi / 180.0 * EARTH_RADIUS
+    x = (np.asarray(longitude, dtype=float) - origin_longitude) * scale * np.cos(np.radians(origin_latitude))
+    y = (np.asarray(latitude, dtype=float) - origin_latitude) * scale
+    return x, y
@@ -0,0 +1,213 @@
+import asyncio
+from typing import Callable, Dict, Optional, Set
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+from config import AppConfig, FenceConfig
+from events import EventBus
+from geo import local_xy
+from link import DroneLink
+
+
+class CompiledFence:
+    """Fence zones pre-processed into flat NumPy arrays for batched checks.
+
+    All polygon edges are stored as contiguous (start, end) coordinate arrays
+    in metres around the fence's centre, grouped by polygon, so one
+    vectorised ray-casting pass decides inside/outside for N drones against
+    every polygon and ``reduceat`` folds the edges back per polygon. Circles
+    are centre/radius arrays.
+    """
+
+    def __init__(self, fence: FenceConfig, version: int):
+        self.version = version
+        polygons = fence.all_polygons()
+        circles = fence.circles
+
+        latitudes = [lat for polygon in polygons for lat, _ in polygon.coordinates] + [circle.latitude for circle in circles]
+        longitudes = [lon for polygon in polygons for _, lon in polygon.coordinates] + [circle.longitude for circle in circles]
+        self.origin = (float(np.mean(latitudes)), float(np.mean(longitudes))) if latitudes else (0.0, 0.0)
+
+        starts, ax, ay, bx, by = [], [], [], [], []
+        edge_count = 0
+        for polygon in polygons:
+            vertices = np.array(polygon.coordinates, dtype=float)
+            x, y = local_xy(vertices[:, 0], vertices[:, 1], *self.origin)
+            starts.append(edge_count)
+            edge_count += len(x)
+            ax.append(x)
+            ay.append(y)
+            bx.append(np.roll(x, -1))
+            by.append(np.roll(y, -1))
+
+        self.polygon_starts = np.array(starts, dtype=np.intp)
+        self.ax = np.concatenate(ax) if ax else np.zeros(0)
+        self.ay = np.concatenate(ay) if ay else np.zeros(0)
+        self.bx = np.concatenate(bx) if bx else np.zeros(0)
+        self.by = np.concatenate(by) if by else np.zeros(0)
+
+        # Per-edge constants used on every check
+        self.ex = self.bx - self.ax
+        self.ey = self.by - self.ay
+        self.length_squared = np.maximum(self.ex * self.ex + self.ey * self.ey, 1e-12)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.inverse_slope = self.ex / self.ey  # x step per metre north; horizontal edges never straddle
+
+        cx, cy = local_xy([circle.latitude for circle in circles], [circle.longitude for circle in circles], *self.origin)
+        self.circle_x = np.atleast_1d(cx)
+        self.circle_y = np.atleast_1d(cy)
+        self.circle_radius = np.array([circle.radius for circle in circles], dtype=float)
+
+        self.inclusion = np.array([polygon.inclusion for polygon in polygons] + [circle.inclusion for circle in circles], dtype=bool)
+        self.zone_names = [f"{'inclusion' if polygon.inclusion else 'exclusion'} polygon {i}" for i, polygon in enumerate(polygons)] + \
+                          [f"{'inclusion' if circle.inclusion else 'exclusion'} circle {i}" for i, circle in enumerate(circles)]
+
+    @property
+    def zone_count(self) -> int:
+        return len(self.inclusion)
+
+    def evaluate(self, latitude: np.ndarray, longitude: np.ndarray):
+        """Inside flags and distance to the boundary (metres), both shaped (drones, zones)."""
+        px, py = local_xy(latitude, longitude, *self.origin)
+        px = px[:, None]
+        py = py[:, None]
+        inside_parts, distance_parts = [], []
+
+        if len(self.polygon_starts):
+            # Ray casting: count edges crossed by a ray running east of each drone
+            straddles = (self.ay > py) != (self.by > py)
+            with np.errstate(invalid="ignore"):
+                crossings = straddles & (px < self.ax + (py - self.ay) * self.inverse_slope)
+            inside_parts.append(np.add.reduceat(crossings, self.polygon_starts, axis=1) % 2 == 1)
+
+            # Distance to the nearest edge of each polygon
+            dx = px - self.ax
+            dy = py - self.ay
+            t = np.clip((dx * self.ex + dy * self.ey) / self.length_squared, 0.0, 1.0)
+            edge_distance = np.hypot(dx - t * self.ex, dy - t * self.ey)
+            distance_parts.append(np.minimum.reduceat(edge_distance, self.polygon_starts, axis=1))
+
+        if len(self.circle_radius):
+            centre_distance = np.hypot(px - self.circle_x, py - self.circle_y)
+            inside_parts.append(centre_distance <= self.circle_radius)
+            distance_parts.append(np.abs(centre_distance - self.circle_radius))
+
+        return np.hstack(inside_parts), np.hstack(distance_parts)
+
+
+class GeofenceMonitor:
+    """Checks every drone's latest position against the configured fence.
+
+    Drones are marked dirty by each GLOBAL_POSITION_INT and all dirty drones
+    are evaluated together once per ``interval``. A drone breaches when it is
+    outside any inclusion zone or inside any exclusion zone (ArduPilot's
+    default, where inclusion zones intersect), and is near a breach when it is
+    within ``margin`` metres of crossing a zone boundary. State changes are
+    published as geofence_breach, geofence_near_breach and geofence_clear
+    events. The fence is recompiled whenever the config version changes.
+    """
+
+    def __init__(self, links: Dict[str, DroneLink], get_config: Callable[[], AppConfig], events: EventBus,
+                 interval: float = 0.25):
+        self.links = links
+        self.get_config = get_config
+        self.events = events
+        self.interval = interval
+        self.fence: Optional[CompiledFence] = None
+        self.states: Dict[str, Dict] = {}
+        self._dirty: Set[str] = set()
+        self._tracked: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, link: DroneLink):
+        if link.drone_id in self._tracked:
+            return
+        self._tracked.add(link.drone_id)
+        drone_id = link.drone_id
+        link.add_listener(dialect.MAVLink_global_position_int_message.msgname, lambda message: self._dirty.add(drone_id))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Geofence check failed: {e}")
+
+    def _compiled_fence(self) -> Optional[CompiledFence]:
+        config = self.get_config()
+        if config.fence is None:
+            self.fence = None
+        elif self.fence is None or self.fence.version != config.version:
+            self.fence = CompiledFence(config.fence, config.version)
+        return self.fence
+
+    def check(self):
+        fence = self._compiled_fence()
+        if fence is None or fence.zone_count == 0 or not self._dirty:
+            return
+        margin = self.get_config().settings.fence_margin
+
+        drone_ids, latitudes, longitudes = [], [], []
+        for drone_id in self._dirty:
+            link = self.links.get(drone_id)
+            position = link.latest(dialect.MAVLink_global_position_int_message.msgname) if link else None
+            if position is None or (position.lat == 0 and position.lon == 0):
+                continue  # No position fix yet
+            drone_ids.append(drone_id)
+            latitudes.append(position.lat / 1e7)
+            longitudes.append(position.lon / 1e7)
+        self._dirty.clear()
+        if not drone_ids:
+            return
+
+        latitudes = np.array(latitudes)
+        longitudes = np.array(longitudes)
+        inside, distance = fence.evaluate(latitudes, longitudes)
+        violated = inside != fence.inclusion
+        near = ~violated & (distance < margin)
+
+        # Report the violated zone, otherwise the nearest zone boundary
+        relevant = np.where(violated.any(axis=1)[:, None], np.where(violated, distance, np.inf), distance)
+        nearest = np.argmin(relevant, axis=1)
+
+        for row, drone_id in enumerate(drone_ids):
+            if violated[row].any():
+                state = "breach"
+            elif near[row].any():
+                state = "near_breach"
+            else:
+                state = "ok"
+            zone = int(nearest[row])
+            current = {
+                "state": state,
+                "zone": fence.zone_names[zone],
+                "distance": round(float(distance[row, zone]), 1),
+                "latitude": float(latitudes[row]),
+                "longitude": float(longitudes[row])
+            }
+
+            previous = self.states.get(drone_id)
+            self.states[drone_id] = current
+            if previous is None and state == "ok":
+                continue
+            if previous is None or previous["state"] != state:
+                event_type = "geofence_clear" if state == "ok" else f"geofence_{state}"
+                self.events.publish(event_type, drone_id=drone_id, **{key: value for key, value in current.items() if key != "state"})
+
+    def status(self) -> Dict:
+        return {
+            "fence_version": self.fence.version if self.fence else None,
+            "zones": self.fence.zone_names if self.fence else [],
+            "drones": self.states
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
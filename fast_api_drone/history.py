@@ -0,0 +1,128 @@
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+from link import DroneLink
+
+# One sample per GLOBAL_POSITION_INT, 46 bytes each
+SAMPLE = np.dtype([
+    ("timestamp", "f8"),         # Unix time the sample was received
+    ("lat", "i4"),               # degrees * 1e7, as sent by the vehicle
+    ("lon", "i4"),
+    ("altitude", "f4"),          # metres AMSL
+    ("relative_altitude", "f4"),
+    ("heading", "f4"),           # degrees, NaN when unknown
+    ("vx", "f4"),                # m/s north
+    ("vy", "f4"),                # m/s east
+    ("vz", "f4"),                # m/s down
+    ("velocity", "f4"),          # GPS ground speed, m/s
+    ("battery_remaining", "i1"), # percent, -1 when unknown
+    ("gps_fix", "u1")
+])
+
+
+class TelemetryRing:
+    """Fixed-size, time-ordered telemetry history for one drone.
+
+    Samples live in a preallocated structured NumPy array that wraps around
+    once full, so memory stays at ``capacity * SAMPLE.itemsize`` bytes however
+    long the drone flies. Queries binary-search the (at most two) chronological
+    segments of the ring and slice them, without building Python objects per
+    sample.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=SAMPLE)
+        self.head = 0      # index the next sample is written to
+        self.count = 0
+        self._last_timestamp = 0.0
+
+    def append(self, timestamp: float, lat: int, lon: int, altitude: float, relative_altitude: float,
+               heading: float, vx: float, vy: float, vz: float, velocity: float,
+               battery_remaining: int, gps_fix: int):
+        # Keep the ring sorted even if the wall clock steps backwards
+        timestamp = max(timestamp, self._last_timestamp)
+        self._last_timestamp = timestamp
+        self.data[self.head] = (timestamp, lat, lon, altitude, relative_altitude, heading,
+                                vx, vy, vz, velocity, battery_remaining, gps_fix)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _segments(self) -> List[np.ndarray]:
+        if self.count < self.capacity:
+            return [self.data[:self.count]]
+        return [self.data[self.head:], self.data[:self.head]]
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None, downsample: int = 1) -> np.ndarray:
+        """Samples with ``since <= timestamp <= until``, keeping every ``downsample``-th one."""
+        parts = []
+        for segment in self._segments():
+            timestamps = segment["timestamp"]
+            start = np.searchsorted(timestamps, since, side="left") if since is not None else 0
+            stop = np.searchsorted(timestamps, until, side="right") if until is not None else len(segment)
+            if stop > start:
+                parts.append(segment[start:stop])
+
+        if not parts:
+            return np.zeros(0, dtype=SAMPLE)
+        samples = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        return samples[::max(1, downsample)].copy()
+
+
+class TelemetryHistory:
+    """Records every drone's GLOBAL_POSITION_INT stream into a ``TelemetryRing``.
+
+    Battery and GPS fix are taken from the link's latest BATTERY_STATUS and
+    GPS_RAW_INT at the time of each position sample.
+    """
+
+    def __init__(self, capacity: int = 18000):
+        self.capacity = capacity
+        self.rings: Dict[str, TelemetryRing] = {}
+
+    def track(self, link: DroneLink, capacity: Optional[int] = None):
+        """Start recording a link; links keep their history across reconnects."""
+        if link.drone_id in self.rings:
+            return
+        ring = self.rings[link.drone_id] = TelemetryRing(capacity or self.capacity)
+
+        def record(message):
+            battery = link.latest(dialect.MAVLink_battery_status_message.msgname)
+            gps = link.latest(dialect.MAVLink_gps_raw_int_message.msgname)
+            ring.append(time.time(),
+                        message.lat,
+                        message.lon,
+                        message.alt / 1000.0,
+                        message.relative_alt / 1000.0,
+                        message.hdg / 100.0 if message.hdg != 65535 else np.nan,
+                        message.vx / 100.0,
+                        message.vy / 100.0,
+                        message.vz / 100.0,
+                        gps.vel / 100.0 if gps is not None else np.nan,
+                        battery.battery_remaining if battery is not None else -1,
+                        gps.fix_type if gps is not None else 0)
+
+        link.add_listener(dialect.MAVLink_global_position_int_message.msgname, record)
+
+    def query(self, drone_id: str, since: Optional[float] = None, until: Optional[float] = None,
+              downsample: int = 1) -> Dict[str, List]:
+        """Column-oriented history for the API: one list per field plus ``timestamp``."""
+        samples = self.rings[drone_id].query(since, until, downsample)
+        columns = {
+            "timestamp": samples["timestamp"].tolist(),
+            "latitude": (samples["lat"] / 1e7).tolist(),
+            "longitude": (samples["lon"] / 1e7).tolist()
+        }
+        for name in ("altitude", "relative_altitude", "heading", "vx", "vy", "vz", "velocity"):
+            column = samples[name].astype("f8").round(3)
+            if np.isnan(column).any():
+                # JSON has no NaN; unknown values become null
+                columns[name] = [None if value != value else value for value in column.tolist()]
+            else:
+                columns[name] = column.tolist()
+        columns["battery_remaining"] = samples["battery_remaining"].tolist()
+        columns["gps_fix"] = samples["gps_fix"].tolist()
+        return columns
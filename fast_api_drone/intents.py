@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+# Predefined API command templates (curl commands)
+API_COMMANDS = {
+    "connect_all_drones": "curl -X POST 'http://localhost:8000/connect_all_drones'",
+    "connect_drone": "curl -X POST 'http://localhost:8000/connect_drone' -H 'Content-Type: application/json' -d '{{\"drone_id\": \"{drone_id}\"}}'",
+    "get_all_telemetry": "curl -X GET 'http://localhost:8000/get_all_telemetry'",
+    "get_telemetry": "curl -X GET 'http://localhost:8000/get_telemetry/{drone_id}'",
+    "set_mode": "curl -X POST 'http://localhost:8000/set_mode/{drone_id}/{flight_mode}' -H 'Content-Type: application/json'",
+    "set_mode_all_drones": "curl -X POST 'http://localhost:8000/set_mode_all_drones/{flight_mode}' -H 'Content-Type: application/json'",
+    "set_mission": "curl -X POST 'http://localhost:8000/set_mission/{drone_id}?mission_name={mission_name}'",
+    "set_mission_all_drones": "curl -X POST 'http://localhost:8000/set_mission_all_drones/{mission_name}'",
+    "set_fence": "curl -X POST 'http://localhost:8000/set_fence/{drone_id}'",
+    "set_fence_all_drones": "curl -X POST 'http://localhost:8000/set_fence_all_drones'",
+    "enable_fence": "curl -X POST 'http://localhost:8000/enable_fence/{drone_id}' -H 'Content-Type: application/json' -d '{{\"fence_enable\": \"{fence_enable}\"}}'",
+    "enable_fence_all_drones": "curl -X POST 'http://localhost:8000/enable_fence_all_drones' -H 'Content-Type: application/json' -d '{{\"fence_enable\": \"{fence_enable}\"}}'",
+    "set_rally": "curl -X POST 'http://localhost:8000/set_rally/{drone_id}'",
+    "set_rally_all_drones": "curl -X POST 'http://localhost:8000/set_rally_all_drones'"
+}
+
+# The instructions and command list only change with the code, so the prompt is built once
+LLM_SYSTEM_PROMPT = f"""You are a drone assistant. Based on the user command, output the appropriate API command.
+
+API Commands: {json.dumps(API_COMMANDS, indent=2)}
+
+Your task is to determine which API command is the closest match and fill in any necessary parameters such as drone_id or mode.
+
+Respond with the exact curl command or an error message if you can't interpret the command.
+
+Make it a concise user-friendly response."""
+
+# Spoken numbers, as voice recognition often writes them
+NUMBER_WORDS = {"zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+                "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10"}
+NUMBER_WORD_PATTERN = re.compile(r"(?<![a-z])(" + "|".join(NUMBER_WORDS) + r")(?![a-z])")
+NAME_NUMBER_PATTERN = re.compile(r"\b(drone|mission)[\s_]*(\d+)\b")
+
+DRONE = r"(?:drone )?(?P<drone_id>drone_\w+)"
+ALL_DRONES = r"(?:all|every)(?: the)? drones"
+MISSION = r"(?:mission )?(?P<mission_name>mission_\w+)"
+
+# Commands the fast path understands, matched against the whole normalized command
+INTENT_PATTERNS = [
+    (r"connect(?: to)? {all}", "connect_all_drones"),
+    (r"connect(?: to)? {drone}", "connect_drone"),
+    (r"(?:get |show |fetch )?(?:the )?telemetry (?:for|of|from) {all}|(?:get |show |fetch )all(?: the)? telemetry", "get_all_telemetry"),
+    (r"(?:get |show |fetch )?(?:the )?telemetry (?:for|of|from) {drone}", "get_telemetry"),
+    (r"(?:set|change|switch)(?: the)?(?: flight)? mode(?: to)? (?P<flight_mode>\w+) (?:for|on) {all}", "set_mode_all_drones"),
+    (r"(?:set|change|switch)(?: the)?(?: flight)? mode(?: to)? (?P<flight_mode>\w+) (?:for|on) {drone}", "set_mode"),
+    (r"(?:start|set|run)(?: the)? {mission} (?:for|on) {all}", "set_mission_all_drones"),
+    (r"(?:start|set|run)(?: the)? {mission} (?:for|on) {drone}", "set_mission"),
+    (r"(?P<fence_enable>enable|disable)(?: the)? fence (?:for|on) {all}", "enable_fence_all_drones"),
+    (r"(?P<fence_enable>enable|disable)(?: the)? fence (?:for|on) {drone}", "enable_fence"),
+    (r"(?:set|upload)(?: the)? fence (?:for|on|to) {all}", "set_fence_all_drones"),
+    (r"(?:set|upload)(?: the)? fence (?:for|on|to) {drone}", "set_fence"),
+    (r"(?:set|upload)(?: the)? rally(?: points?)? (?:for|on|to) {all}", "set_rally_all_drones"),
+    (r"(?:set|upload)(?: the)? rally(?: points?)? (?:for|on|to) {drone}", "set_rally"),
+]
+INTENT_RULES = [(re.compile(pattern.format(all=ALL_DRONES, drone=DRONE, mission=MISSION)), name)
+                for pattern, name in INTENT_PATTERNS]
+
+
+def normalize_command(command: str) -> str:
+    """Lower-case a typed or spoken command and smooth over voice recognition quirks,
+    so equivalent phrasings ("Connect drone one.", "connect drone_1") compare equal."""
+    command = command.lower().replace("underscore", "_")
+    command = NUMBER_WORD_PATTERN.sub(lambda match: NUMBER_WORDS[match.group(1)], command)
+    command = " ".join(re.sub(r"[^\w\s]", " ", command).split())
+    command = NAME_NUMBER_PATTERN.sub(r"\1_\2", command)
+    command = re.sub(r"^(?:please |can you |could you )|( please)$", "", command)
+    return command
+
+
+def match_command(command: str) -> Optional[Tuple[str, Dict[str, str]]]:
+    """``(command name, parameters)`` for a normalized command the fast path understands, or None."""
+    for pattern, name in INTENT_RULES:
+        match = pattern.fullmatch(command)
+        if match:
+            params = {key: value for key, value in match.groupdict().items() if value is not None}
+            for key in ("flight_mode", "fence_enable"):
+                if key in params:
+                    params[key] = params[key].upper()
+            return name, params
+    return None
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire ``ttl`` seconds after they were stored."""
+
+    def __init__(self, size: int = 1024, ttl: float = 3600.0):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored, value = entry
+        if time.monotonic() - stored > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        if self.size <= 0:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+
+class IntentEngine:
+    """Turns a chat or voice command into the API call that carries it out.
+
+    Commands are tried against the compiled ``INTENT_RULES`` first, then
+    against a cache of earlier LLM answers keyed by the normalized command,
+    and only then sent to the LLM, asynchronously and with a timeout.
+    Identical commands that arrive while the LLM is still answering share
+    one request. The LLM endpoint and model are read from the config on
+    every call, so ``llm_base_url`` can point at ``llm_stub.py``.
+    """
+
+    def __init__(self, cache_size: int = 1024, cache_ttl: float = 3600.0):
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.counts = {"pattern": 0, "cache": 0, "llm": 0, "llm_errors": 0}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._clients: Dict[Optional[str], AsyncOpenAI] = {}
+
+    async def resolve(self, command: str, settings) -> Dict:
+        """The API call for ``command`` with where it came from (pattern, cache or llm).
+
+        Raises asyncio.TimeoutError if the LLM does not answer within
+        ``settings.llm_timeout`` seconds, and the client's errors if it fails.
+        """
+        start = time.perf_counter()
+        normalized = normalize_command(command)
+
+        matched = match_command(normalized)
+        if matched is not None:
+            name, params = matched
+            self.counts["pattern"] += 1
+            resolution = {"source": "pattern", "command": name, "params": params,
+                          "api_call": API_COMMANDS[name].format(**params)}
+        else:
+            cached = self.cache.get(normalized)
+            if cached is not None:
+                self.counts["cache"] += 1
+                resolution = {"source": "cache", **cached}
+            else:
+                resolution = {"source": "llm", **await self._ask_once(normalized, settings)}
+
+        resolution["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return resolution
+
+    async def _ask_once(self, normalized: str, settings) -> Dict:
+        pending = self._pending.get(normalized)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = self._pending[normalized] = asyncio.get_running_loop().create_future()
+        try:
+            self.counts["llm"] += 1
+            answer = await asyncio.wait_for(self._ask_llm(normalized, settings), settings.llm_timeout)
+            resolution = {"command": None, "params": {}, "api_call": answer}
+            self.cache.put(normalized, resolution)
+            future.set_result(resolution)
+            return resolution
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.counts["llm_errors"] += 1
+            future.set_exception(e)
+            # Nobody else may be waiting; keep the loop from logging an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._pending[normalized]
+
+    def _client(self, settings) -> AsyncOpenAI:
+        client = self._clients.get(settings.llm_base_url)
+        if client is None:
+            # One HTTP client per endpoint so connections are reused between commands
+            client = self._clients[settings.llm_base_url] = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY", "not-set"), base_url=settings.llm_base_url,
+                max_retries=0, http_client=httpx.AsyncClient())
+        return client
+
+    async def _ask_llm(self, command: str, settings) -> str:
+        response = await self._client(settings).chat.completions.create(
+            model=settings.llm_model,
+            messages=[
+                {"role": "system", "content": LLM_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Command: {command}"}
+            ],
+            max_tokens=100,
+            temperature=0.2,
+            timeout=settings.llm_timeout,
+        )
+        return response.choices[0].message.content.strip()
+
+    def status(self) -> Dict:
+        return {**self.counts, "cached": len(self.cache), "cache_size": self.cache.size, "cache_ttl": self.cache.ttl}
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients = {}
@@ -0,0 +1,328 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from pymavlink import mavutil
+import pymavlink.dialects.v20.all as dialect
+
+from metrics import LinkStats
+from transport import MavlinkConnection
+
+
+class Subscription:
+    """Receives every message of the subscribed types whose fields match.
+
+    ``match`` maps message field names to the values they must equal, e.g.
+    ``{"command": dialect.MAV_CMD_DO_SET_MODE}`` or ``{"param_id": "FENCE_ACTION"}``.
+    """
+
+    def __init__(self, link: "DroneLink", msg_types: List[str], match: Dict[str, Any]):
+        self.link = link
+        self.msg_types = msg_types
+        self.match = match
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def matches(self, message: dialect.MAVLink_message) -> bool:
+        for field, value in self.match.items():
+            if getattr(message, field, None) != value:
+                return False
+        return True
+
+    async def get(self, timeout: Optional[float] = None) -> dialect.MAVLink_message:
+        """Wait for the next matching message; raises asyncio.TimeoutError."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.link._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DroneLink:
+    """Owns a MAVLink connection and is the only code that reads from it.
+
+    Messages from an asyncio ``MavlinkConnection`` arrive on the event loop
+    directly; a plain mavutil connection (e.g. serial without
+    pyserial-asyncio) gets a background reader thread that drains it and
+    hands every message to the loop. Either way each message is stored in a
+    per-type latest-message table, and telemetry is served from that table.
+
+    The reader also routes each message to every subscription whose message
+    type and field match accept it, so concurrent operations on the same
+    vehicle (a mode change, a parameter read, a mission upload) each receive
+    their own replies instead of racing for them.
+    """
+
+    def __init__(self, drone_id: str, master: Union[MavlinkConnection, mavutil.mavfile], stream_rate: int = 4):
+        self.drone_id = drone_id
+        self.stream_rate = stream_rate
+        # Counters read by /metrics; kept across reconnects
+        self.stats = LinkStats()
+        # Subscriptions currently waiting for replies
+        self.in_flight = 0
+        self.master: Optional[Union[MavlinkConnection, mavutil.mavfile]] = None
+        self.attach(master)
+
+        # Latest message and receive time (time.monotonic) per message type
+        self.messages: Dict[str, dialect.MAVLink_message] = {}
+        self.timestamps: Dict[str, float] = {}
+
+        self._subscriptions: Dict[str, List[Subscription]] = {}
+        self._listeners: Dict[str, List[Callable[[dialect.MAVLink_message], None]]] = {}
+        self._frame_listeners: List[Callable[[float, dialect.MAVLink_message], None]] = []
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    # Pass-throughs so command code can treat a link like the raw connection
+    @property
+    def target_system(self) -> int:
+        return self.master.target_system
+
+    @property
+    def target_component(self) -> int:
+        return self.master.target_component
+
+    @property
+    def mav(self):
+        return self.master.mav
+
+    def mode_mapping(self) -> Dict[str, int]:
+        return self.master.mode_mapping()
+
+    def write(self, buf: bytes):
+        """Send an already-encoded MAVLink frame."""
+        self.master.write(buf)
+
+    @property
+    def threaded(self) -> bool:
+        """Whether this link needs a reader thread (a mavutil connection rather than an asyncio one)."""
+        return not isinstance(self.master, MavlinkConnection)
+
+    def attach(self, master: Union[MavlinkConnection, mavutil.mavfile]):
+        """Use a new connection, e.g. after a reconnect. The reader must be stopped."""
+        if self.master is not None:
+            self.stats.lost_before += self.master.mav_loss
+        self.master = master
+        self.reader_alive = False
+        if isinstance(master, MavlinkConnection):
+            # A stand-in for a link parsed elsewhere delivers messages already counted there
+            master.on_message = self._receive if master.parses_stream else self._dispatch
+            master.on_lost = self._transport_lost
+        elif isinstance(master, mavutil.mavtcp):
+            # pymavlink only prints on TCP EOF/reset unless autoreconnect is set, which
+            # would leave the reader spinning on a dead socket; stop the reader instead
+            master.handle_eof = master.handle_disconnect = self._connection_lost
+
+    def _connection_lost(self):
+        raise ConnectionError(f"TCP connection to {self.drone_id} closed by peer")
+
+    def _transport_lost(self, exc: Optional[Exception]):
+        if self._running:
+            print(f"Connection to {self.drone_id} lost: {exc or 'closed by peer'}")
+        self.reader_alive = False
+
+    def start(self):
+        """Start receiving (a reader thread for mavutil connections) and ask the vehicle to stream telemetry."""
+        if self._running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+        if self.threaded:
+            self.reader_alive = True
+            self._thread = threading.Thread(target=self._read_loop, name=f"mavlink-reader-{self.drone_id}", daemon=True)
+            self._thread.start()
+        else:
+            self.reader_alive = not self.master.closed
+
+        # The heartbeat consumed while connecting counts as the first one
+        heartbeat = self.master.messages.get("HEARTBEAT")
+        if heartbeat is not None:
+            self._dispatch(heartbeat)
+
+        self.mav.send(dialect.MAVLink_request_data_stream_message(target_system=self.target_system,
+                                                                  target_component=self.target_component,
+                                                                  req_stream_id=dialect.MAV_DATA_STREAM_ALL,
+                                                                  req_message_rate=self.stream_rate,
+                                                                  start_stop=1))
+
+    def stop(self):
+        """Stop the reader thread and close the underlying connection.
+
+        Blocks while the reader thread exits; use ``close()`` from the event loop.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self.reader_alive = False
+        try:
+            self.master.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        """``stop()`` without blocking the event loop."""
+        if self.threaded:
+            await asyncio.to_thread(self.stop)
+        else:
+            self.stop()
+
+    def _received(self, message: dialect.MAVLink_message) -> bool:
+        """Count a message and pass it to the frame listeners; False for undecodable data."""
+        stats = self.stats
+        if message.get_type() == "BAD_DATA":
+            stats.bad_data += 1
+            return False
+        msg_id = message.get_msgId()
+        stats.received[msg_id] = stats.received.get(msg_id, 0) + 1
+
+        if self._frame_listeners:
+            received = time.time()
+            for listener in self._frame_listeners:
+                try:
+                    listener(received, message)
+                except Exception as e:
+                    print(f"Frame listener on {self.drone_id} failed: {e}")
+        return True
+
+    def _receive(self, message: dialect.MAVLink_message):
+        """Handle a message from an asyncio connection (already on the event loop)."""
+        if self._received(message):
+            self._dispatch(message)
+
+    def _read_loop(self):
+        stats = self.stats
+        while self._running:
+            waiting = time.perf_counter()
+            try:
+                message = self.master.recv_match(blocking=True, timeout=0.5)
+            except ConnectionError as e:
+                print(f"Reader stopped on {self.drone_id}: {e}")
+                self.reader_alive = False
+                break
+            except Exception as e:
+                if self._running:
+                    print(f"Reader error on {self.drone_id}: {e}")
+                    time.sleep(0.5)
+                continue
+
+            if message is None:
+                continue
+            stats.recv_wait.observe(time.perf_counter() - waiting)
+            if not self._received(message):
+                continue
+
+            try:
+                self._loop.call_soon_threadsafe(self._dispatch, message)
+            except RuntimeError:
+                # Event loop closed underneath us (server shutdown)
+                break
+
+    def _dispatch(self, message: dialect.MAVLink_message):
+        msg_type = message.get_type()
+        self.messages[msg_type] = message
+        self.timestamps[msg_type] = time.monotonic()
+
+        for listener in self._listeners.get(msg_type, ()):
+            try:
+                listener(message)
+            except Exception as e:
+                print(f"Listener for {msg_type} on {self.drone_id} failed: {e}")
+
+        subscriptions = self._subscriptions.get(msg_type)
+        if subscriptions:
+            for subscription in subscriptions:
+                if subscription.matches(message):
+                    subscription.queue.put_nowait(message)
+
+    def latest(self, msg_type: str) -> Optional[dialect.MAVLink_message]:
+        """Return the most recent message of the given type, if any."""
+        return self.messages.get(msg_type)
+
+    def age(self, msg_type: str) -> Optional[float]:
+        """Seconds since the last message of the given type was received."""
+        timestamp = self.timestamps.get(msg_type)
+        if timestamp is None:
+            return None
+        return time.monotonic() - timestamp
+
+    def add_listener(self, msg_type: str, callback: Callable[[dialect.MAVLink_message], None]):
+        """Call ``callback(message)`` on the event loop for every message of this type,
+        for the lifetime of the link (including across reconnects)."""
+        self._listeners.setdefault(msg_type, []).append(callback)
+        if not self.threaded:
+            self.master.want([msg_type])
+
+    def add_frame_listener(self, callback: Callable[[float, dialect.MAVLink_message], None]):
+        """Call ``callback(received, message)`` for every message, with its receive time
+        (time.time), as soon as it is decoded: on the reader thread for mavutil
+        connections, so callbacks must be quick and thread-safe, and before the
+        message reaches the latest-message table and subscriptions."""
+        self._frame_listeners.append(callback)
+
+    def subscribe(self, msg_type: Union[str, List[str]], **match) -> Subscription:
+        """Subscribe to messages of the given type(s) whose fields equal ``match``.
+
+        Use as a context manager so the subscription is removed when done.
+        """
+        msg_types = [msg_type] if isinstance(msg_type, str) else list(msg_type)
+        subscription = Subscription(self, msg_types, match)
+        for name in msg_types:
+            self._subscriptions.setdefault(name, []).append(subscription)
+        if not self.threaded:
+            self.master.want(msg_types)
+        self.in_flight += 1
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        removed = False
+        for name in subscription.msg_types:
+            subscriptions = self._subscriptions.get(name)
+            if subscriptions and subscription in subscriptions:
+                subscriptions.remove(subscription)
+                removed = True
+                if not subscriptions:
+                    del self._subscriptions[name]
+        if removed:
+            self.in_flight -= 1
+
+    async def wait_for(self, msg_type: Union[str, List[str]], timeout: Optional[float] = None, **match) -> dialect.MAVLink_message:
+        """Wait for the next message of the given type(s) matching ``match``."""
+        with self.subscribe(msg_type, **match) as subscription:
+            return await subscription.get(timeout)
+
+    async def request(self, message: Union[dialect.MAVLink_message, bytes], reply_type: Union[str, List[str]],
+                      timeout: float = 3.0, retries: int = 3, **match) -> dialect.MAVLink_message:
+        """Send ``message`` (or an already-encoded frame) and wait for its matching
+        reply, resending on timeout.
+
+        The subscription is registered before sending so a fast reply cannot
+        be missed. Raises asyncio.TimeoutError once all attempts time out.
+        """
+        with self.subscribe(reply_type, **match) as subscription:
+            for attempt in range(retries + 1):
+                if isinstance(message, bytes):
+                    self.write(message)
+                else:
+                    self.mav.send(message)
+                try:
+                    return await subscription.get(timeout)
+                except asyncio.TimeoutError:
+                    if attempt == retries:
+                        raise
+                    print(f"No {reply_type} reply from {self.drone_id}, resending request")
+
+    def lock(self, name: str) -> asyncio.Lock:
+        """Per-link lock for protocols the vehicle can only run one at a time,
+        such as the mission upload handshake."""
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = self._locks[name] = asyncio.Lock()
+        return lock
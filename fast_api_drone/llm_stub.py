@@ -0,0 +1,62 @@
+"""Local stand-in for the OpenAI chat completions API, for testing /trigger_command without an API key.
+
+Every request is answered with the same reply after ``--delay`` seconds, so
+the LLM tier's latency, timeout and caching can be checked; ``GET /stats``
+returns how many completions were requested.
+
+    cd fast_api_drone
+    python llm_stub.py --port 8001 --delay 0.5
+
+then set ``llm_base_url: http://127.0.0.1:8001/v1`` in the config settings.
+"""
+import argparse
+import asyncio
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+
+def create_app(reply: str, delay: float) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(delay)
+        return {
+            "id": f"chatcmpl-stub-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds before each reply, like a real LLM")
+    parser.add_argument("--reply", default="curl -X GET 'http://localhost:8000/get_all_telemetry'",
+                        help="content of every reply")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.reply, args.delay), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
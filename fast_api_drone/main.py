@@ -1,39 +1,116 @@
-from fastapi import FastAPI, HTTPException, Depends, Response
+from fastapi import FastAPI, HTTPException, Depends, Response, Request, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from pymavlink import mavutil
 import time
 import asyncio
-import yaml
-from typing import List, Optional, Dict
+import os
+from typing import Awaitable, Callable, List, Optional, Dict
 import pymavlink.dialects.v20.all as dialect
 # import speech_recognition as sr
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 import re
-import openai
 import json
 import requests
+from link import DroneLink
+from fanout import Limits, fan_out, runs_own_steps, summarize, Stagger
+from intents import IntentEngine
+from batch import BatchRequest, BatchRun, BatchStep, execution_order
+from pool import ConnectionPool
+from shards import ShardedPool
+from replicas import OwnerProxyMiddleware, Ownership, TelemetryPublisher, TelemetryReplica
+from config import AppConfig, ConfigService
+from mission import MissionTypeUnsupportedError, UploadReport, upload_frames
+from plans import CompiledPlan, PlanCache
+from stream import TelemetryBroadcaster, parse_csv
+from compact import COMPACT_MEDIA_TYPE, CompactEncoder, wants_compact
+from history import TelemetryHistory
+from params import ParamManager
+from events import EventBus
+from geofence import GeofenceMonitor
+from separation import SeparationMonitor
+from recorder import FlightRecorder, TlogReader
+from export import FORMATS, ExportError, export_recordings
+from metrics import Metrics, MetricsMiddleware
+from profiling import ProfilingMiddleware, RequestProfiler
 
 app = FastAPI()
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Dependency to load and provide the configuration
-def get_config():
-    with open("config.yaml", "r") as config_file:
-        return yaml.safe_load(config_file)
-
-# Dependency to manage drone connections
-drone_connections: Dict[str, mavutil.mavlink_connection] = {}
+# Dependency to provide the configuration; parsed once and reloaded only when the file changes
+config_service = ConfigService("config.yaml")
+
+def get_config() -> AppConfig:
+    return config_service.get()
+
+# Dependency to manage drone connections; the pool owns the links and reconnects them.
+# With settings.link_workers the links are owned and parsed by that many worker processes
+startup_config = config_service.get()
+link_capacity = max(1024, 2 * len(startup_config.drones))
+if startup_config.settings.link_workers > 0:
+    pool = ShardedPool(startup_config.settings.link_workers, capacity=link_capacity,
+                       recording_directory="recordings" if startup_config.settings.recording_enabled else None)
+else:
+    pool = ConnectionPool()
+drone_connections: Dict[str, DroneLink] = pool.links
+
+# With settings.telemetry_table, `uvicorn --workers N` works: one worker owns the links and publishes
+# telemetry to shared memory, and the others serve telemetry from it and forward other requests to the owner
+ownership = Ownership(startup_config.settings.telemetry_table) if startup_config.settings.telemetry_table else None
+telemetry_publisher = TelemetryPublisher(ownership, link_capacity) if ownership and ownership.owner else None
+telemetry_replica = TelemetryReplica(ownership) if ownership and not ownership.owner else None
+if telemetry_publisher is not None:
+    pool.connect_hooks.append(telemetry_publisher.track)
 
 def get_drone_connections():
     return drone_connections
 
-class Waypoint(BaseModel):
-    latitude: float
-    longitude: float
-    altitude: float
-    command: int  # MAVLink command (e.g., MAV_CMD_NAV_WAYPOINT, MAV_CMD_NAV_TAKEOFF)
+# Mission, fence and rally frames compiled once per config version and target vehicle
+plan_cache = PlanCache()
+
+# Full-rate position history of every connected drone
+telemetry_history = TelemetryHistory()
+
+# Parameter table of every drone, pulled once per connection and kept current from PARAM_VALUE
+param_manager = ParamManager()
+pool.connect_hooks.append(param_manager.on_connect)
+
+# Safety events (geofence breaches, ...) for polling and streaming
+event_bus = EventBus()
+
+# Server-side check of every drone's position against the configured fence
+geofence_monitor = GeofenceMonitor(drone_connections, get_config, event_bus)
+pool.connect_hooks.append(geofence_monitor.track)
+
+# Server-side check of drone-to-drone separation, current and predicted
+separation_monitor = SeparationMonitor(drone_connections, get_config, event_bus)
+
+# Every received MAVLink frame written to rotating per-drone .tlog files (by the link workers in sharded mode)
+flight_recorder = FlightRecorder("recordings")
+pool.connect_hooks.append(flight_recorder.track)
+
+# Prometheus metrics: request latency, event-loop lag, executor queue and per-drone link counters
+metrics = Metrics(drone_connections)
+pool.connect_hooks.append(metrics.track)
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+# Chat and voice commands: regex fast path, then cached LLM answers, then the LLM
+intent_engine = IntentEngine(startup_config.settings.intent_cache_size, startup_config.settings.intent_cache_ttl)
+
+# Opt-in request profiling (settings.profiling_enabled); the slowest traces are kept under profiles/
+request_profiler = RequestProfiler(get_config, "profiles")
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+
+if telemetry_replica is not None:
+    app.add_middleware(OwnerProxyMiddleware, replica=telemetry_replica,
+                       local_paths=("/get_all_telemetry", "/get_telemetry/", "/stream/telemetry", "/static/", "/chatbot"))
+
+def fan_out_settings(config: AppConfig) -> Dict:
+    """Concurrency limit and per-drone timeout for the *_all_drones endpoints."""
+    return {
+        "concurrency": config.settings.fanout_concurrency,
+        "timeout": config.settings.drone_timeout
+    }
 
 class Telemetry(BaseModel):
     latitude: float
@@ -44,6 +121,7 @@ class Telemetry(BaseModel):
     heading: Optional[float] = None
     battery_remaining: Optional[float] = None
     gps_fix: Optional[int] = None
+    last_update: Optional[float] = None  # Seconds since the telemetry was last refreshed by the drone
 
 class DroneTelemetryResponse(BaseModel):
     drone_id: str
@@ -56,61 +134,80 @@ class ConnectDroneRequest(BaseModel):
 class FenceEnableRequest(BaseModel):
     fence_enable: str
 
+class ExportRecordingsRequest(BaseModel):
+    names: Optional[List[str]] = None  # Recording file names; all recordings when omitted
+    drone_id: Optional[str] = None
+    format: str = "parquet"
+
 class ChatCommand(BaseModel):
     command: str
 
-def is_authorized_system_id(drone_id: str, system_id: int, config: Dict) -> bool:
-    """Check if the system ID matches the one in the config."""
-    expected_system_id = config["drones"][drone_id].get("system_id")
-    return system_id == expected_system_id
-
-def connect_drone_by_id(drone_id: str, config: Dict, drone_connections: Dict):
+@app.on_event("startup")
+async def start_connection_pool():
+    if telemetry_replica is not None:
+        # The owner worker runs the links, monitors and recorder
+        return
+    pool.start()
+    metrics.start()
+    geofence_monitor.start()
+    separation_monitor.start()
+    if get_config().settings.recording_enabled and not isinstance(pool, ShardedPool):
+        flight_recorder.start()
+    if telemetry_publisher is not None:
+        await telemetry_publisher.start(app)
+
+@app.on_event("shutdown")
+async def close_connection_pool():
+    if telemetry_replica is not None:
+        await telemetry_replica.close()
+    if telemetry_publisher is not None:
+        await telemetry_publisher.close()
+    await geofence_monitor.close()
+    await separation_monitor.close()
+    await telemetry_broadcaster.close()
+    await metrics.close()
+    await intent_engine.close()
+    await pool.close()
+    await asyncio.get_running_loop().run_in_executor(None, flight_recorder.close)
+
+async def connect_drone_by_id(drone_id: str, config: AppConfig, drone_connections: Dict):
     """Function to connect to a drone by its ID."""
-    try:
-        drone_config = config["drones"].get(drone_id)
-        if drone_config is None:
-            raise HTTPException(status_code=404, detail=f"Drone ID {drone_id} not found in config")
-
-        connection_string = drone_config.get("connection_string")
-        if connection_string is None:
-            raise HTTPException(status_code=400, detail=f"Connection string for drone {drone_id} is missing")
-
-        if drone_id not in drone_connections:
-            master = mavutil.mavlink_connection(connection_string)
-            master.wait_heartbeat()
+    drone_config = config.drones.get(drone_id)
+    if drone_config is None:
+        raise HTTPException(status_code=404, detail=f"Drone ID {drone_id} not found in config")
 
-            system_id = master.target_system
-            if not is_authorized_system_id(drone_id, system_id, config):
-                raise HTTPException(status_code=403, detail="Unauthorized system ID for this drone")
+    try:
+        # Connects off the event loop with a heartbeat timeout and checks the system ID
+        link = await pool.connect(drone_id, drone_config.connection_string, drone_config.system_id)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e) or type(e).__name__)
 
-            # Store the connection if successful
-            drone_connections[drone_id] = master
+    telemetry_history.track(link, config.settings.history_size)
 
-        return {"status": f"Drone {drone_id} connected successfully"}
-
-    except KeyError:
-        raise HTTPException(status_code=404, detail=f"Drone ID {drone_id} not found in config")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": f"Drone {drone_id} connected successfully"}
 
 @app.post("/connect_drone")
-async def connect_drone_endpoint(request: ConnectDroneRequest, config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+async def connect_drone_endpoint(request: ConnectDroneRequest, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
     """Endpoint to connect to a single drone by ID."""
-    return connect_drone_by_id(request.drone_id, config, drone_connections)
+    return await connect_drone_by_id(request.drone_id, config, drone_connections)
 
 @app.post("/connect_all_drones")
-async def connect_all_drones_endpoint(config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+async def connect_all_drones_endpoint(config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
     """Endpoint to connect to all drones specified in the config."""
     connected_drones = []
     failed_drones = []
 
-    # Iterate through each drone in the config
-    for drone_id in config["drones"]:
-        try:
-            response = connect_drone_by_id(drone_id, config, drone_connections)
+    # Open every link in the config at the same time
+    results = await asyncio.gather(*(connect_drone_by_id(drone_id, config, drone_connections) for drone_id in config.drones),
+                                   return_exceptions=True)
+
+    for drone_id, result in zip(config.drones, results):
+        if isinstance(result, Exception):
+            failed_drones.append({"drone_id": drone_id, "error": str(getattr(result, "detail", result))})
+        else:
             connected_drones.append(drone_id)
-        except HTTPException as e:
-            failed_drones.append({"drone_id": drone_id, "error": str(e)})
 
     if failed_drones:
         return {
@@ -121,17 +218,22 @@ async def connect_all_drones_endpoint(config: Dict = Depends(get_config), drone_
     else:
         return {"status": "All drones connected successfully", "connected_drones": connected_drones}
 
-async def set_mode(master, flight_mode: str):
+@app.get("/connection_pool")
+async def connection_pool_status():
+    """Connection state, heartbeat age and reconnect history of every drone link."""
+    return pool.status()
+
+async def set_mode(link: DroneLink, flight_mode: str):
     # Get supported flight modes
-    flight_modes = master.mode_mapping()
+    flight_modes = link.mode_mapping()
 
     if flight_mode not in flight_modes:
         raise RuntimeError(f"{flight_mode} is not supported")
 
     # Create change mode message
     set_mode_message = dialect.MAVLink_command_long_message(
-        target_system=master.target_system,
-        target_component=master.target_component,
+        target_system=link.target_system,
+        target_component=link.target_component,
         command=dialect.MAV_CMD_DO_SET_MODE,
         confirmation=0,
         param1=dialect.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
@@ -143,14 +245,10 @@ async def set_mode(master, flight_mode: str):
         param7=0
     )
 
-    # Send the mode change message
-    master.mav.send(set_mode_message)
-
     try:
-        # Use asyncio.to_thread to run the blocking recv_match call in a non-blocking way
-        mav_message = await asyncio.to_thread(
-            master.recv_match, type=dialect.MAVLink_command_ack_message.msgname, blocking=True
-        )
+        # Send the mode change message and wait for the COMMAND_ACK for this command only
+        mav_message = await link.request(set_mode_message, dialect.MAVLink_command_ack_message.msgname,
+                                         command=dialect.MAV_CMD_DO_SET_MODE)
 
         # Convert the MAVLink message to a dictionary
         message = mav_message.to_dict()
@@ -169,12 +267,12 @@ async def set_mode(master, flight_mode: str):
 
 @app.post("/set_mode/{drone_id}/{flight_mode}")
 async def set_mode_endpoint(drone_id: str, flight_mode: str, drone_connections: Dict = Depends(get_drone_connections)):
-    master = drone_connections.get(drone_id)
-    if not master:
+    link = drone_connections.get(drone_id)
+    if not link:
         raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
     
     try:
-        result = await set_mode(master, flight_mode.upper())
+        result = await set_mode(link, flight_mode.upper())
         if result == "accepted":
             return {
                 "status": f"Mode change to {flight_mode.upper()} successful for drone {drone_id}"
@@ -191,123 +289,69 @@ async def set_mode_endpoint(drone_id: str, flight_mode: str, drone_connections:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/set_mode_all_drones/{flight_mode}")
-async def set_mode_all_drones(flight_mode: str, drone_connections: Dict = Depends(get_drone_connections)):
-    results = {}
-    
-    for drone_id, master in drone_connections.items():
-        try:
-            # Call the set_mode function for each drone
-            result = await set_mode(master, flight_mode.upper())
-            if result == "accepted":
-                results[drone_id] = f"Mode change to {flight_mode.upper()} successful"
-            elif result == "timeout":
-                results[drone_id] = f"Timeout while changing mode to {flight_mode.upper()}"
-            else:
-                results[drone_id] = f"Mode change to {flight_mode.upper()} failed"
-        except Exception as e:
-            # If any exception occurs, log the error for that specific drone
-            results[drone_id] = f"Error: {str(e)}"
+async def set_mode_all_drones(flight_mode: str, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+    async def set_mode_for_drone(drone_id: str, link: DroneLink):
+        # Call the set_mode function for each drone
+        result = await set_mode(link, flight_mode.upper())
+        if result == "accepted":
+            return f"Mode change to {flight_mode.upper()} successful"
+        elif result == "timeout":
+            return f"Timeout while changing mode to {flight_mode.upper()}"
+        else:
+            return f"Mode change to {flight_mode.upper()} failed"
+
+    # Change mode on every drone at the same time
+    results = await fan_out(drone_connections, set_mode_for_drone, **fan_out_settings(config))
 
     # Return a dictionary with the results for each drone
     return {
-        "status": results
+        "status": {drone_id: result.result if result.ok else f"Error: {result.error}" for drone_id, result in results.items()},
+        "timings": summarize(results)["timings"]
     }
 
-async def set_mission_and_start(master, target_locations: List[Waypoint]):
-    # Send the mission count message asynchronously
-    await asyncio.to_thread(master.mav.send, dialect.MAVLink_mission_count_message(
-        target_system=master.target_system,
-        target_component=master.target_component,
-        count=len(target_locations) + 2,
-        mission_type=dialect.MAV_MISSION_TYPE_MISSION
-    ))
+async def set_mission_and_start(link: DroneLink, mission: CompiledPlan) -> UploadReport:
+    # Only one mission upload can run against a vehicle at a time
+    async with link.lock("mission"):
+        report = await upload_mission(link, mission)
+        await start_mission(link)
+        return report
 
-    # Loop until we receive a valid MISSION_ACK message
-    while True:
-        message = await asyncio.to_thread(master.recv_match, blocking=True)
-        message = message.to_dict()
-
-        if message["mavpackettype"] == dialect.MAVLink_mission_request_message.msgname:
-            if message["mission_type"] == dialect.MAV_MISSION_TYPE_MISSION:
-                seq = message["seq"]
-
-                # Create the appropriate mission item message
-                if seq == 0:
-                    mission_item_message = dialect.MAVLink_mission_item_int_message(
-                        target_system=master.target_system,
-                        target_component=master.target_component,
-                        seq=seq,
-                        frame=dialect.MAV_FRAME_GLOBAL,
-                        command=dialect.MAV_CMD_NAV_WAYPOINT,
-                        current=0,
-                        autocontinue=0,
-                        param1=0,
-                        param2=0,
-                        param3=0,
-                        param4=0,
-                        x=0,
-                        y=0,
-                        z=0,
-                        mission_type=dialect.MAV_MISSION_TYPE_MISSION
-                    )
-                elif seq == 1:
-                    mission_item_message = dialect.MAVLink_mission_item_int_message(
-                        target_system=master.target_system,
-                        target_component=master.target_component,
-                        seq=seq,
-                        frame=dialect.MAV_FRAME_GLOBAL_RELATIVE_ALT,
-                        command=dialect.MAV_CMD_NAV_TAKEOFF,
-                        current=0,
-                        autocontinue=0,
-                        param1=0,
-                        param2=0,
-                        param3=0,
-                        param4=0,
-                        x=0,
-                        y=0,
-                        z=target_locations[0].altitude,
-                        mission_type=dialect.MAV_MISSION_TYPE_MISSION
-                    )
-                else:
-                    waypoint = target_locations[seq - 2]  # Adjust for home and takeoff locations
-                    mission_item_message = dialect.MAVLink_mission_item_int_message(
-                        target_system=master.target_system,
-                        target_component=master.target_component,
-                        seq=seq,
-                        frame=dialect.MAV_FRAME_GLOBAL_RELATIVE_ALT,
-                        command=dialect.MAV_CMD_NAV_WAYPOINT,
-                        current=0,
-                        autocontinue=0,
-                        param1=0,
-                        param2=0,
-                        param3=0,
-                        param4=0,
-                        x=max(min(int(waypoint.latitude * 1e7), 2147483647), -2147483648),
-                        y=max(min(int(waypoint.longitude * 1e7), 2147483647), -2147483648),
-                        z=waypoint.altitude,
-                        mission_type=dialect.MAV_MISSION_TYPE_MISSION
-                    )
-
-                # Send the mission item message asynchronously
-                await asyncio.to_thread(master.mav.send, mission_item_message)
-
-        # Check if the message is MISSION_ACK
-        elif message["mavpackettype"] == dialect.MAVLink_mission_ack_message.msgname:
-            if message["mission_type"] == dialect.MAV_MISSION_TYPE_MISSION and message["type"] == dialect.MAV_MISSION_ACCEPTED:
-                print("Mission upload is successful")
-                break
+def mission_launch_stagger(config: AppConfig) -> Stagger:
+    settings = config.settings
+    return Stagger(settings.launch_stagger if settings.launch_stagger is not None else settings.separation_time)
 
+async def set_mission_staggered(link: DroneLink, mission: CompiledPlan, launch_stagger: Stagger, limits: Limits) -> UploadReport:
+    """Upload and start a mission as one drone of a swarm, launching in the next free stagger slot.
+
+    The upload and the start each take a concurrency slot and the timeout from ``limits``;
+    waiting for the launch slot takes neither, so queued launches never hold up other
+    drones' uploads or time out.
+    """
+    # Only one mission upload can run against a vehicle at a time; the lock is kept until launch
+    async with link.lock("mission"):
+        report = await limits.run(upload_mission(link, mission))
+        await launch_stagger.wait()
+        await limits.run(start_mission(link))
+        return report
+
+async def upload_mission(link: DroneLink, mission: CompiledPlan) -> UploadReport:
+    # Each MISSION_REQUEST_INT is answered with the cached frame for that item, with retransmits on timeout
+    report = await upload_frames(link, mission.frames)
+    print(f"Mission upload is successful ({report.count} items in {report.elapsed:.2f}s)")
+    return report
+
+async def start_mission(link: DroneLink):
     # Set flight mode to AUTO
     FLIGHT_MODE = "AUTO"
-    flight_modes = master.mode_mapping()
+    flight_modes = link.mode_mapping()
 
     if FLIGHT_MODE not in flight_modes:
         raise RuntimeError(f"{FLIGHT_MODE} is not supported")
 
     # Create and send the change mode message
     set_mode_message = dialect.MAVLink_command_long_message(
-        target_system=master.target_system,
-        target_component=master.target_component,
+        target_system=link.target_system,
+        target_component=link.target_component,
         command=dialect.MAV_CMD_DO_SET_MODE,
         confirmation=0,
         param1=dialect.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
@@ -319,23 +363,18 @@ async def set_mission_and_start(master, target_locations: List[Waypoint]):
         param7=0
     )
 
-    await asyncio.to_thread(master.mav.send, set_mode_message)
-
-    # Wait for mode change acknowledgment
-    while True:
-        message = await asyncio.to_thread(master.recv_match, type=dialect.MAVLink_command_ack_message.msgname, blocking=True)
-        message = message.to_dict()
-        if message["command"] == dialect.MAV_CMD_DO_SET_MODE:
-            if message["result"] == dialect.MAV_RESULT_ACCEPTED:
-                print(f"Changing mode to {FLIGHT_MODE} accepted by the vehicle")
-            else:
-                print(f"Changing mode to {FLIGHT_MODE} failed")
-            break
+    # Send the mode change and wait for its acknowledgment
+    message = await link.request(set_mode_message, dialect.MAVLink_command_ack_message.msgname,
+                                 command=dialect.MAV_CMD_DO_SET_MODE)
+    if message.result == dialect.MAV_RESULT_ACCEPTED:
+        print(f"Changing mode to {FLIGHT_MODE} accepted by the vehicle")
+    else:
+        print(f"Changing mode to {FLIGHT_MODE} failed")
 
     # Arm the vehicle
     vehicle_arm_message = dialect.MAVLink_command_long_message(
-        target_system=master.target_system,
-        target_component=master.target_component,
+        target_system=link.target_system,
+        target_component=link.target_component,
         command=dialect.MAV_CMD_COMPONENT_ARM_DISARM,
         confirmation=0,
         param1=1,  # VEHICLE_ARM
@@ -350,17 +389,16 @@ async def set_mission_and_start(master, target_locations: List[Waypoint]):
     # Attempt to arm the vehicle
     while True:
         print("Attempting to arm the vehicle...")
-        await asyncio.to_thread(master.mav.send, vehicle_arm_message)
-        ack_message = await asyncio.to_thread(master.recv_match, type=dialect.MAVLink_command_ack_message.msgname, blocking=True)
-        ack_message = ack_message.to_dict()
+        ack_message = await link.request(vehicle_arm_message, dialect.MAVLink_command_ack_message.msgname,
+                                         command=dialect.MAV_CMD_COMPONENT_ARM_DISARM)
 
         # Check if the arm command was accepted
-        if ack_message["result"] == dialect.MAV_RESULT_ACCEPTED and ack_message["command"] == dialect.MAV_CMD_COMPONENT_ARM_DISARM:
+        if ack_message.result == dialect.MAV_RESULT_ACCEPTED:
             print("Arm command accepted, waiting for the vehicle to be armed...")
 
             # Monitor the heartbeat for arming status
             while True:
-                heartbeat = await asyncio.to_thread(master.recv_match, type=dialect.MAVLink_heartbeat_message.msgname, blocking=True)
+                heartbeat = await link.wait_for(dialect.MAVLink_heartbeat_message.msgname)
                 heartbeat = heartbeat.to_dict()
 
                 # Check if the vehicle is armed
@@ -374,393 +412,245 @@ async def set_mission_and_start(master, target_locations: List[Waypoint]):
         await asyncio.sleep(10)  # Sleep for a while before retrying
 
 @app.post("/set_mission/{drone_id}")
-async def set_mission_endpoint(drone_id: str, mission_name: str, config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+async def set_mission_endpoint(drone_id: str, mission_name: str, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
     try:
-        if mission_name not in config["waypoints"]:
+        if mission_name not in config.waypoints:
             raise HTTPException(status_code=404, detail=f"Mission '{mission_name}' not found in config")
         
-        mission_waypoints = [Waypoint(**wp) for wp in config["waypoints"][mission_name]]
-        master = drone_connections.get(drone_id)
-        if not master:
+        link = drone_connections.get(drone_id)
+        if not link:
             raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
 
         # This is correct, assuming set_mission_and_start is async
-        await set_mission_and_start(master, mission_waypoints)
+        report = await set_mission_and_start(link, plan_cache.mission(config, mission_name, link))
 
-        return {"status": f"Mission '{mission_name}' auto mode set successfully for drone '{drone_id}' and is armed"}
+        return {
+            "status": f"Mission '{mission_name}' auto mode set successfully for drone '{drone_id}' and is armed",
+            "upload": report.as_dict()
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to set mission auto mode: {str(e)}")
 
 @app.post("/set_mission_all_drones/{mission_name}")
-async def set_mission_all_drones_endpoint(mission_name: str, config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
-    successful_drones = []
-    failed_drones = []
-
-    for drone_id, master in drone_connections.items():
-        try:
-            # Load the waypoints for the specified mission from the config
-            if mission_name not in config["waypoints"]:
-                raise HTTPException(status_code=404, detail=f"Mission '{mission_name}' not found in config")
-            
-            mission_waypoints = [Waypoint(**wp) for wp in config["waypoints"][mission_name]]
-            
-            # Await the mission setting for each drone
-            await set_mission_and_start(master, mission_waypoints)
-            successful_drones.append(drone_id)
-
-            # Add a delay between missions
-            await asyncio.sleep(config["settings"]["separation_time"])
-
-        except Exception as e:
-            failed_drones.append({"drone_id": drone_id, "error": str(e)})
-
-    if failed_drones:
-        return {
-            "status": "Some drones failed to set the mission",
-            "successful_drones": successful_drones,
-            "failed_drones": failed_drones
-        }
+async def set_mission_all_drones_endpoint(mission_name: str, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+    # Load the waypoints for the specified mission from the config
+    if mission_name not in config.waypoints:
+        raise HTTPException(status_code=404, detail=f"Mission '{mission_name}' not found in config")
+
+    # Missions upload to every drone concurrently; only the launches are spaced out
+    limits = Limits(**fan_out_settings(config))
+    launch_stagger = mission_launch_stagger(config)
+
+    @runs_own_steps
+    async def set_mission_for_drone(drone_id: str, link: DroneLink):
+        report = await set_mission_staggered(link, plan_cache.mission(config, mission_name, link), launch_stagger, limits)
+        return report.as_dict()
+
+    fan_out_results = await fan_out(drone_connections, set_mission_for_drone, limits=limits)
+    results = summarize(fan_out_results)
+    results["uploads"] = {drone_id: result.result for drone_id, result in fan_out_results.items() if result.ok}
+
+    if results["failed_drones"]:
+        return {"status": "Some drones failed to set the mission", **results}
     else:
-        return {"status": "Mission set successfully for all drones", "successful_drones": successful_drones}
+        return {"status": "Mission set successfully for all drones", **results}
+
+# Drones whose firmware rejected the MAV_MISSION_TYPE_FENCE upload and need the legacy protocol
+legacy_fence_drones = set()
+
+async def set_fence(link: DroneLink, config: AppConfig) -> str:
+    """Upload the configured fence and return the protocol used ("mission" or "legacy")."""
+    fence_protocol = config.settings.fence_protocol
+
+    # Fence parameters and points must not be interleaved with another fence upload
+    async with link.lock("fence"):
+        if fence_protocol == "mission" or (fence_protocol == "auto" and link.drone_id not in legacy_fence_drones):
+            try:
+                report = await upload_frames(link, plan_cache.fence_mission(config, link).frames,
+                                             mission_type=dialect.MAV_MISSION_TYPE_FENCE)
+                print(f"Fence upload is successful ({report.count} items in {report.elapsed:.2f}s)")
+                return "mission"
+            except MissionTypeUnsupportedError as e:
+                if fence_protocol == "mission":
+                    raise
+                print(f"{e}; falling back to the legacy fence protocol for {link.drone_id}")
+                legacy_fence_drones.add(link.drone_id)
+
+        if not config.fence.legacy_compatible:
+            raise RuntimeError("The legacy fence protocol only supports a single inclusion polygon (fence.coordinates)")
+        await upload_fence(link, plan_cache.fence(config, link))
+        return "legacy"
+
+async def upload_fence(link: DroneLink, fence: CompiledPlan):
+    params = param_manager.table(link)
+
+    # FENCE_ACTION is served from the parameter cache when it has been synced
+    fence_action_original = int(await params.read("FENCE_ACTION"))
 
-async def set_fence(master, fence_coordinates: List[List[float]]):
-    # introduce FENCE_TOTAL and FENCE_ACTION as byte arrays
-    FENCE_TOTAL = "FENCE_TOTAL".encode(encoding="utf-8")
-    FENCE_ACTION = "FENCE_ACTION".encode(encoding="utf8")
-    PARAM_INDEX = -1
+    print("FENCE_ACTION parameter original:", fence_action_original)
 
-    # Request FENCE_ACTION parameter
-    message = dialect.MAVLink_param_request_read_message(target_system=master.target_system,
-                                                         target_component=master.target_component,
-                                                         param_id=FENCE_ACTION,
-                                                         param_index=PARAM_INDEX)
-    master.mav.send(message)
+    # Set FENCE_ACTION to none and reset FENCE_TOTAL to 0 in one batch
+    await params.set_params({"FENCE_ACTION": dialect.FENCE_ACTION_NONE, "FENCE_TOTAL": 0})
+    print("FENCE_ACTION and FENCE_TOTAL reset to 0 successfully")
 
-    while True:
-        message = master.recv_match(type=dialect.MAVLink_param_value_message.msgname,
-                                    blocking=True)
-        message = message.to_dict()
-        if message["param_id"] == "FENCE_ACTION":
-            fence_action_original = int(message["param_value"])
-            break
-
-    print("FENCE_ACTION parameter original:", fence_action_original)
+    # Set FENCE_TOTAL to the number of fence coordinates
+    await params.set_params({"FENCE_TOTAL": fence.count})
+    print(f"FENCE_TOTAL set to {fence.count} successfully")
 
-    # Set FENCE_ACTION to none
-    while True:
-        message = dialect.MAVLink_param_set_message(target_system=master.target_system,
-                                                    target_component=master.target_component,
-                                                    param_id=FENCE_ACTION,
-                                                    param_value=dialect.FENCE_ACTION_NONE,
-                                                    param_type=dialect.MAV_PARAM_TYPE_REAL32)
-        master.mav.send(message)
-        message = master.recv_match(type=dialect.MAVLink_param_value_message.msgname,
-                                    blocking=True)
-        message = message.to_dict()
-        if message["param_id"] == "FENCE_ACTION":
-            if int(message["param_value"]) == dialect.FENCE_ACTION_NONE:
-                print("FENCE_ACTION reset to 0 successfully")
-                break
-            else:
-                print("Failed to reset FENCE_ACTION to 0, trying again")
+    # Upload fence points from the compiled FENCE_POINT frames
+    for idx in range(fence.count):
+        for attempt in range(5):
+            link.write(fence.frames[idx])
 
-    # Reset FENCE_TOTAL to 0
-    while True:
-        message = dialect.MAVLink_param_set_message(target_system=master.target_system,
-                                                    target_component=master.target_component,
-                                                    param_id=FENCE_TOTAL,
-                                                    param_value=0,
-                                                    param_type=dialect.MAV_PARAM_TYPE_REAL32)
-        master.mav.send(message)
-        message = master.recv_match(type=dialect.MAVLink_param_value_message.msgname,
-                                    blocking=True)
-        message = message.to_dict()
-        if message["param_id"] == "FENCE_TOTAL":
-            if int(message["param_value"]) == 0:
-                print("FENCE_TOTAL reset to 0 successfully")
-                break
-            else:
-                print("Failed to reset FENCE_TOTAL to 0")
+            # Read the point back; only the echo for this index is accepted
+            message = await link.request(fence.fetch_frames[idx], dialect.MAVLink_fence_point_message.msgname, idx=idx)
 
-    # Set FENCE_TOTAL to the number of fence coordinates
-    while True:
-        message = dialect.MAVLink_param_set_message(target_system=master.target_system,
-                                                    target_component=master.target_component,
-                                                    param_id=FENCE_TOTAL,
-                                                    param_value=len(fence_coordinates),
-                                                    param_type=dialect.MAV_PARAM_TYPE_REAL32)
-        master.mav.send(message)
-        message = master.recv_match(type=dialect.MAVLink_param_value_message.msgname,
-                                    blocking=True)
-        message = message.to_dict()
-        if message["param_id"] == "FENCE_TOTAL":
-            if int(message["param_value"]) == len(fence_coordinates):
-                print(f"FENCE_TOTAL set to {len(fence_coordinates)} successfully")
+            # FENCE_POINT carries float32 coordinates, so compare with a float32 tolerance
+            latitude, longitude = fence.points[idx]
+            if abs(message.lat - latitude) < 1e-5 and abs(message.lng - longitude) < 1e-5:
                 break
-            else:
-                print(f"Failed to set FENCE_TOTAL to {len(fence_coordinates)}")
-
-    # Upload fence points
-    idx = 0
-    while idx < len(fence_coordinates):
-        message = dialect.MAVLink_fence_point_message(target_system=master.target_system,
-                                                      target_component=master.target_component,
-                                                      idx=idx,
-                                                      count=len(fence_coordinates),
-                                                      lat=fence_coordinates[idx][0],
-                                                      lng=fence_coordinates[idx][1])
-        master.mav.send(message)
-
-        message = dialect.MAVLink_fence_fetch_point_message(target_system=master.target_system,
-                                                            target_component=master.target_component,
-                                                            idx=idx)
-        master.mav.send(message)
-        message = master.recv_match(type=dialect.MAVLink_fence_point_message.msgname,
-                                    blocking=True)
-        message = message.to_dict()
-
-        latitude = message["lat"]
-        longitude = message["lng"]
-
-        if latitude != 0.0 and longitude != 0:
-            idx += 1
+            print(f"Fence point {idx} echoed as ({message.lat}, {message.lng}), sending it again")
+        else:
+            raise RuntimeError(f"Fence point {idx} was not stored by the vehicle")
 
     print("All the fence items uploaded successfully")
 
     # Reset FENCE_ACTION to the original value
-    while True:
-        message = dialect.MAVLink_param_set_message(target_system=master.target_system,
-                                                    target_component=master.target_component,
-                                                    param_id=FENCE_ACTION,
-                                                    param_value=fence_action_original,
-                                                    param_type=dialect.MAV_PARAM_TYPE_REAL32)
-        master.mav.send(message)
-        message = master.recv_match(type=dialect.MAVLink_param_value_message.msgname,
-                                    blocking=True)
-        message = message.to_dict()
-
-        if message["param_id"] == "FENCE_ACTION":
-            if int(message["param_value"]) == fence_action_original:
-                print(f"FENCE_ACTION set to original value {fence_action_original} successfully")
-                break
-            else:
-                print(f"Failed to set FENCE_ACTION to original value {fence_action_original}")
+    await params.set_params({"FENCE_ACTION": fence_action_original})
+    print(f"FENCE_ACTION set to original value {fence_action_original} successfully")
 
 @app.post("/set_fence/{drone_id}")
-async def set_fence_endpoint(drone_id: str, config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+async def set_fence_endpoint(drone_id: str, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
     try:
         # Get the drone connection from the dependency
-        master = drone_connections.get(drone_id)
-        if not master:
+        link = drone_connections.get(drone_id)
+        if not link:
             raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
         
         # Load the fence coordinates from the config file
-        if "fence" not in config or "coordinates" not in config["fence"]:
+        if config.fence is None:
             raise HTTPException(status_code=404, detail="Fence coordinates not found in config file")
         
-        fence_coordinates = config["fence"]["coordinates"]
+        # Set the fence using the compiled fence items
+        protocol = await set_fence(link, config)
         
-        # Set the fence using the loaded coordinates
-        await set_fence(master, fence_coordinates)
-        
-        return {"status": f"Geofence set successfully for drone '{drone_id}'"}
+        return {"status": f"Geofence set successfully for drone '{drone_id}'", "protocol": protocol}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to set geofence: {str(e)}")
 
 @app.post("/set_fence_all_drones")
-async def set_fence_all_drones_endpoint(config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
-    successful_drones = []
-    failed_drones = []
-
-    if "fence" not in config or "coordinates" not in config["fence"]:
+async def set_fence_all_drones_endpoint(config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+    if config.fence is None:
         raise HTTPException(status_code=404, detail="Fence coordinates not found in config file")
     
-    fence_coordinates = config["fence"]["coordinates"]
+    async def set_fence_for_drone(drone_id: str, link: DroneLink):
+        return await set_fence(link, config)
 
-    for drone_id, master in drone_connections.items():
-        try:
-            await set_fence(master, fence_coordinates)
-            successful_drones.append(drone_id)
-            await asyncio.sleep(1)
-        except Exception as e:
-            failed_drones.append({"drone_id": drone_id, "error": str(e)})
+    fan_out_results = await fan_out(drone_connections, set_fence_for_drone, **fan_out_settings(config))
+    results = summarize(fan_out_results)
+    results["protocols"] = {drone_id: result.result for drone_id, result in fan_out_results.items() if result.ok}
 
-    if failed_drones:
-        return {
-            "status": "Some drones failed to set the fence",
-            "successful_drones": successful_drones,
-            "failed_drones": failed_drones
-        }
+    if results["failed_drones"]:
+        return {"status": "Some drones failed to set the fence", **results}
     else:
-        return {"status": "Fence set successfully for all drones", "successful_drones": successful_drones}
+        return {"status": "Fence set successfully for all drones", **results}
 
-@app.post("/enable_fence/{drone_id}")
-async def enable_fence_endpoint(drone_id: str, request: FenceEnableRequest, drone_connections: Dict = Depends(get_drone_connections)):
+fence_enable_definition = {
+    "DISABLE": 0,
+    "ENABLE": 1,
+    "DISABLE_FLOOR_ONLY": 2
+}
 
-    fence_enable_definition = {
-        "DISABLE": 0,
-        "ENABLE": 1,
-        "DISABLE_FLOOR_ONLY": 2
-    }
+def send_fence_enable(link: DroneLink, fence_enable: str):
+    message = dialect.MAVLink_command_long_message(
+        target_system=link.target_system,
+        target_component=link.target_component,
+        command=dialect.MAV_CMD_DO_FENCE_ENABLE,
+        confirmation=0,
+        param1=fence_enable_definition[fence_enable],
+        param2=0,
+        param3=0,
+        param4=0,
+        param5=0,
+        param6=0,
+        param7=0
+    )
+    link.mav.send(message)
+
+@app.get("/geofence/status")
+async def geofence_status_endpoint():
+    """Latest server-side fence check of every drone: ok, near_breach or breach, with the closest zone."""
+    return geofence_monitor.status()
 
+@app.get("/separation/status")
+async def separation_status_endpoint():
+    """Drone pairs currently closer than separation_distance, or predicted to be within separation_horizon."""
+    return separation_monitor.status()
+
+@app.post("/enable_fence/{drone_id}")
+async def enable_fence_endpoint(drone_id: str, request: FenceEnableRequest, drone_connections: Dict = Depends(get_drone_connections)):
     fence_enable = request.fence_enable.upper()
 
     if fence_enable not in fence_enable_definition:
         raise HTTPException(status_code=400, detail="Unsupported fence enable mode")
     
-    master = drone_connections.get(drone_id)
-    if not master:
+    link = drone_connections.get(drone_id)
+    if not link:
         raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
     try:
-        message = dialect.MAVLink_command_long_message(
-            target_system=master.target_system,
-            target_component=master.target_component,
-            command=dialect.MAV_CMD_DO_FENCE_ENABLE,
-            confirmation=0,
-            param1=fence_enable_definition[fence_enable],
-            param2=0,
-            param3=0,
-            param4=0,
-            param5=0,
-            param6=0,
-            param7=0
-        )
-        master.mav.send(message)
+        send_fence_enable(link, fence_enable)
         return {"status": f"Fence {fence_enable} command sent to the drone '{drone_id}' successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send fence command: {str(e)}")
 
 @app.post("/enable_fence_all_drones")
-async def enable_fence_all_drones_endpoint(request: FenceEnableRequest, drone_connections: Dict = Depends(get_drone_connections)):
+async def enable_fence_all_drones_endpoint(request: FenceEnableRequest, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
     """
     Enable the fence for all drones with the specified mode (ENABLE, DISABLE, DISABLE_FLOOR_ONLY).
     """
-    fence_enable_definition = {
-        "DISABLE": 0,
-        "ENABLE": 1,
-        "DISABLE_FLOOR_ONLY": 2
-    }
-
     fence_enable = request.fence_enable.upper()
 
     if fence_enable not in fence_enable_definition:
         raise HTTPException(status_code=400, detail="Unsupported fence enable mode")
 
-    successful_drones = []
-    failed_drones = []
+    async def enable_fence_for_drone(drone_id: str, link: DroneLink):
+        send_fence_enable(link, fence_enable)
 
-    for drone_id, master in drone_connections.items():
-        try:
-            message = dialect.MAVLink_command_long_message(
-                target_system=master.target_system,
-                target_component=master.target_component,
-                command=dialect.MAV_CMD_DO_FENCE_ENABLE,
-                confirmation=0,
-                param1=fence_enable_definition[fence_enable],
-                param2=0,
-                param3=0,
-                param4=0,
-                param5=0,
-                param6=0,
-                param7=0
-            )
-            master.mav.send(message)
-            successful_drones.append(drone_id)
-            await asyncio.sleep(1)
+    results = summarize(await fan_out(drone_connections, enable_fence_for_drone, **fan_out_settings(config)))
 
-        except Exception as e:
-            failed_drones.append({"drone_id": drone_id, "error": str(e)})
-
-    if failed_drones:
-        return {
-            "status": "Some drones failed to enable the fence",
-            "successful_drones": successful_drones,
-            "failed_drones": failed_drones
-        }
+    if results["failed_drones"]:
+        return {"status": "Some drones failed to enable the fence", **results}
     else:
-        return {"status": "Fence enabled successfully for all drones", "successful_drones": successful_drones}
-
-async def set_rally(master, rally_coordinates: List[List[float]]):
-    # introduce RALLY_TOTAL as byte array and do not use parameter index
-    RALLY_TOTAL = "RALLY_TOTAL".encode(encoding="utf-8")
-    PARAM_INDEX = -1
-
-    # run until parameter set successfully
-    while True:
-
-        # create parameter set message
-        message = dialect.MAVLink_param_set_message(target_system=master.target_system,
-                                                    target_component=master.target_component,
-                                                    param_id=RALLY_TOTAL,
-                                                    param_value=len(rally_coordinates),
-                                                    param_type=dialect.MAV_PARAM_TYPE_REAL32)
+        return {"status": "Fence enabled successfully for all drones", **results}
 
-        # send parameter set message to the vehicle
-        master.mav.send(message)
+async def set_rally(link: DroneLink, rally: CompiledPlan):
+    # Rally parameters and points must not be interleaved with another rally upload
+    async with link.lock("rally"):
+        await upload_rally(link, rally)
 
-        # wait for PARAM_VALUE message
-        message = master.recv_match(type=dialect.MAVLink_param_value_message.msgname,
-                                    blocking=True)
-
-        # convert the message to dictionary
-        message = message.to_dict()
-
-        # make sure this parameter value message is for RALLY_TOTAL
-        if message["param_id"] == "RALLY_TOTAL":
-
-            # make sure that parameter value set successfully
-            if int(message["param_value"]) == len(rally_coordinates):
-                print("RALLY_TOTAL set to {0} successfully".format(len(rally_coordinates)))
-
-                # break the loop
-                break
-
-            # should send param set message again
-            else:
-                print("Failed to set RALLY_TOTAL to {0}".format(len(rally_coordinates)))
+async def upload_rally(link: DroneLink, rally: CompiledPlan):
+    # set RALLY_TOTAL and wait for the vehicle to confirm it
+    await param_manager.table(link).set_params({"RALLY_TOTAL": rally.count})
+    print("RALLY_TOTAL set to {0} successfully".format(rally.count))
 
     # initialize rally point item index counter
     idx = 0
 
     # run until all the rally point items uploaded successfully
-    while idx < len(rally_coordinates):
-
-        # create RALLY_POINT message
-        message = dialect.MAVLink_rally_point_message(target_system=master.target_system,
-                                                    target_component=master.target_component,
-                                                    idx=idx,
-                                                    count=len(rally_coordinates),
-                                                    lat=int(rally_coordinates[idx][0] * 1e7),
-                                                    lng=int(rally_coordinates[idx][1] * 1e7),
-                                                    alt=int(rally_coordinates[idx][2]),
-                                                    break_alt=0,
-                                                    land_dir=0,
-                                                    flags=0)
-
-        # send RALLY_POINT message to the vehicle
-        master.mav.send(message)
-
-        # create RALLY_FETCH_POINT message
-        message = dialect.MAVLink_rally_fetch_point_message(target_system=master.target_system,
-                                                            target_component=master.target_component,
-                                                            idx=idx)
-
-        # send this message to vehicle
-        master.mav.send(message)
-
-        # wait for RALLY_POINT message
-        message = master.recv_match(type=dialect.MAVLink_rally_point_message.msgname,
-                                    blocking=True)
-
-        # convert the message to dictionary
-        message = message.to_dict()
-
-        # make sure this RALLY_POINT message is for the same rally point item
-        if message["idx"] == idx and \
-                message["count"] == len(rally_coordinates) and \
-                message["lat"] == int(rally_coordinates[idx][0] * 1e7) and \
-                message["lng"] == int(rally_coordinates[idx][1] * 1e7) and \
-                message["alt"] == int(rally_coordinates[idx][2]):
+    while idx < rally.count:
+
+        # send the compiled RALLY_POINT frame to the vehicle
+        link.write(rally.frames[idx])
+
+        # send the RALLY_FETCH_POINT frame and wait for the RALLY_POINT message for this item
+        message = await link.request(rally.fetch_frames[idx], dialect.MAVLink_rally_point_message.msgname, idx=idx)
+
+        # make sure this RALLY_POINT message matches the rally point item we sent
+        latitude, longitude, altitude = rally.points[idx]
+        if message.count == rally.count and \
+                message.lat == latitude and \
+                message.lng == longitude and \
+                message.alt == altitude:
 
             # increment rally point item index counter
             idx += 1
@@ -775,132 +665,271 @@ async def set_rally(master, rally_coordinates: List[List[float]]):
     print("All the rally point items uploaded successfully")
 
 @app.post("/set_rally/{drone_id}")
-async def set_rally_endpoint(drone_id: str, config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+async def set_rally_endpoint(drone_id: str, config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
     try:
         # Get the drone connection from the global dictionary
-        master = drone_connections.get(drone_id)
-        if not master:
+        link = drone_connections.get(drone_id)
+        if not link:
             raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
         
         # Load the rally coordinates from the config file
-        if "rally" not in config or "coordinates" not in config["rally"]:
+        if config.rally is None:
             raise HTTPException(status_code=404, detail="Rally coordinates not found in config file")
         
-        rally_coordinates = config["rally"]["coordinates"]
-        
-        # Set the rally points using the loaded coordinates
-        await set_rally(master, rally_coordinates)
+        # Set the rally points using the compiled coordinates
+        await set_rally(link, plan_cache.rally(config, link))
         
         return {"status": f"Rally points set successfully for drone '{drone_id}'"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to set rally points: {str(e)}")
 
 @app.post("/set_rally_all_drones")
-async def set_rally_all_drones(config: Dict = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
-    successful_drones = []
-    failed_drones = []
-
-    if "rally" not in config or "coordinates" not in config["rally"]:
+async def set_rally_all_drones(config: AppConfig = Depends(get_config), drone_connections: Dict = Depends(get_drone_connections)):
+    if config.rally is None:
         raise HTTPException(status_code=404, detail="Rally coordinates not found in config file")
     
-    rally_coordinates = config["rally"]["coordinates"]
+    async def set_rally_for_drone(drone_id: str, link: DroneLink):
+        await set_rally(link, plan_cache.rally(config, link))
+
+    results = summarize(await fan_out(drone_connections, set_rally_for_drone, **fan_out_settings(config)))
 
-    for drone_id, master in drone_connections.items():
+    if results["failed_drones"]:
+        return {"status": "Some drones failed to set the rally points", **results}
+    else:
+        return {"status": "Rally points set successfully for all drones", **results}
+
+def batch_link(drone_id: str) -> DroneLink:
+    link = drone_connections.get(drone_id)
+    if not link:
+        raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not connected")
+    return link
+
+def batch_targets(step: BatchStep, config: AppConfig) -> List[str]:
+    drones = list(dict.fromkeys(step.drones)) if step.drones is not None else list(config.drones)
+    for drone_id in drones:
+        if drone_id not in config.drones:
+            raise HTTPException(status_code=404, detail=f"Drone ID {drone_id} in step '{step.id}' not found in config")
+    return drones
+
+def batch_operation(step: BatchStep, config: AppConfig, limits: Limits) -> Callable[[str], Awaitable]:
+    """Check a batch step's parameters and return the operation that runs it on one drone."""
+    params = step.params
+
+    if step.op == "connect":
+        async def operation(drone_id: str):
+            await connect_drone_by_id(drone_id, config, drone_connections)
+            return "connected"
+
+    elif step.op == "set_mode":
+        flight_mode = str(params.get("flight_mode", "")).upper()
+        if not flight_mode:
+            raise HTTPException(status_code=400, detail=f"Step '{step.id}' needs params.flight_mode")
+
+        async def operation(drone_id: str):
+            result = await set_mode(batch_link(drone_id), flight_mode)
+            if result != "accepted":
+                raise RuntimeError(f"Mode change to {flight_mode} {result}")
+            return result
+
+    elif step.op == "set_mission":
+        mission_name = params.get("mission_name")
+        if mission_name not in config.waypoints:
+            raise HTTPException(status_code=404, detail=f"Mission '{mission_name}' in step '{step.id}' not found in config")
+        launch_stagger = mission_launch_stagger(config)
+
+        @runs_own_steps
+        async def operation(drone_id: str):
+            link = batch_link(drone_id)
+            report = await set_mission_staggered(link, plan_cache.mission(config, mission_name, link), launch_stagger, limits)
+            return report.as_dict()
+
+    elif step.op == "set_fence":
+        if config.fence is None:
+            raise HTTPException(status_code=404, detail="Fence coordinates not found in config file")
+
+        async def operation(drone_id: str):
+            return await set_fence(batch_link(drone_id), config)
+
+    elif step.op == "enable_fence":
+        fence_enable = str(params.get("fence_enable", "ENABLE")).upper()
+        if fence_enable not in fence_enable_definition:
+            raise HTTPException(status_code=400, detail=f"Unsupported fence enable mode in step '{step.id}'")
+
+        async def operation(drone_id: str):
+            send_fence_enable(batch_link(drone_id), fence_enable)
+
+    elif step.op == "set_rally":
+        if config.rally is None:
+            raise HTTPException(status_code=404, detail="Rally coordinates not found in config file")
+
+        async def operation(drone_id: str):
+            link = batch_link(drone_id)
+            await set_rally(link, plan_cache.rally(config, link))
+
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported operation '{step.op}' in step '{step.id}'")
+
+    return operation
+
+@app.post("/batch")
+async def batch_endpoint(request: BatchRequest, stream: bool = True, config: AppConfig = Depends(get_config)):
+    """
+    Run a list of steps (connect, set_mode, set_fence, enable_fence, set_rally, set_mission), each on
+    its own drones and after the steps it depends on. Steps that do not depend on each other run at
+    the same time. Progress is streamed as newline-delimited JSON ending with a per-step timing report;
+    with ``stream=false`` only the report is returned.
+    """
+    order = execution_order(request.steps)
+    targets = {step.id: batch_targets(step, config) for step in request.steps}
+    limits = Limits(**fan_out_settings(config))
+    operations = {step.id: batch_operation(step, config, limits) for step in request.steps}
+    run = BatchRun(request.steps, order, targets, operations, limits)
+
+    if not stream:
+        return await run.wait()
+
+    async def progress():
+        async for event in run.events():
+            yield json.dumps(event, default=str) + "\n"
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def get_telemetry(link: DroneLink) -> Telemetry:
+    """Build telemetry from the latest messages cached by the link's reader."""
+    msg_global_position_int = link.latest(dialect.MAVLink_global_position_int_message.msgname)
+    msg_sys_status = link.latest(dialect.MAVLink_battery_status_message.msgname)
+    msg_gps = link.latest(dialect.MAVLink_gps_raw_int_message.msgname)
+
+    if msg_global_position_int is None:
+        raise ValueError("No global position telemetry message received")
+    if msg_sys_status is None:
+        raise ValueError("No system status telemetry message received")
+    if msg_gps is None:
+        raise ValueError("No raw GPS telemetry message received")
+
+    # Age of the stalest of the three messages the telemetry is built from
+    last_update = max(link.age(dialect.MAVLink_global_position_int_message.msgname),
+                      link.age(dialect.MAVLink_battery_status_message.msgname),
+                      link.age(dialect.MAVLink_gps_raw_int_message.msgname))
+
+    return Telemetry(
+        latitude=msg_global_position_int.lat / 1e7,
+        longitude=msg_global_position_int.lon / 1e7,
+        altitude=msg_global_position_int.alt / 1000.0,
+        velocity=msg_gps.vel / 100.0,
+        relative_altitude=msg_global_position_int.relative_alt / 1000.0,
+        heading=msg_global_position_int.hdg / 100.0,
+        battery_remaining=msg_sys_status.battery_remaining,
+        gps_fix=msg_gps.fix_type,
+        last_update=last_update
+    )
+
+def compact_telemetry_response(entries: List[Dict]) -> Response:
+    """Encode DroneTelemetryResponse-shaped entries as a single compact key frame."""
+    return Response(content=CompactEncoder(keyframes_only=True).encode(entries, time.time()),
+                    media_type=COMPACT_MEDIA_TYPE,
+                    headers={
+                        "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+                        "Pragma": "no-cache",
+                        "Expires": "0",
+                        "Vary": "Accept"
+                    })
+
+@app.get("/params/{drone_id}")
+async def get_params_endpoint(drone_id: str, refresh: bool = False, drone_connections: Dict = Depends(get_drone_connections)):
+    """Cached parameter table of a drone; ``refresh=true`` pulls the full table from the vehicle again."""
+    link = drone_connections.get(drone_id)
+    if not link:
+        raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
+
+    params = param_manager.table(link)
+    if refresh:
         try:
-            await set_rally(master, rally_coordinates)
-            successful_drones.append(drone_id)
-            await asyncio.sleep(1)
+            await params.sync()
         except Exception as e:
-            failed_drones.append({"drone_id": drone_id, "error": str(e)})
+            raise HTTPException(status_code=504, detail=str(e))
 
-    if failed_drones:
-        return {
-            "status": "Some drones failed to set the rally points",
-            "successful_drones": successful_drones,
-            "failed_drones": failed_drones
-        }
-    else:
-        return {"status": "Rally points set successfully for all drones", "successful_drones": successful_drones}
+    return {"drone_id": drone_id, **params.status(), "params": dict(sorted(params.values.items()))}
 
-async def get_telemetry(master: mavutil.mavlink_connection) -> Telemetry:
-    try:
-        # create request data stream message
-        request = dialect.MAVLink_request_data_stream_message(target_system=master.target_system,
-                                                                target_component=master.target_component,
-                                                                req_stream_id=0,
-                                                                req_message_rate=1,
-                                                                start_stop=1)
-
-        # send request data stream message to the vehicle
-        master.mav.send(request)
-        
-        while True:
-            
-            msg_global_position_int = master.recv_match(type=dialect.MAVLink_global_position_int_message.msgname)
-            msg_sys_status = master.recv_match(type=dialect.MAVLink_battery_status_message.msgname)
-            msg_gps = master.recv_match(type=dialect.MAVLink_gps_raw_int_message.msgname)
-
-            if msg_global_position_int is None:
-                raise ValueError("No global position telemetry message received")
-            if msg_sys_status is None:
-                raise ValueError("No system status telemetry message received")
-            if msg_gps is None:
-                raise ValueError("No raw GPS telemetry message received")
-
-            latitude = msg_global_position_int.lat / 1e7
-            longitude = msg_global_position_int.lon / 1e7
-            altitude = msg_global_position_int.alt / 1000.0
-            relative_altitude = msg_global_position_int.relative_alt / 1000.0
-            heading = msg_global_position_int.hdg / 100.0
-            velocity = msg_gps.vel / 100.0
-            battery_remaining = msg_sys_status.battery_remaining
-            gps_fix = msg_gps.fix_type
-            
-            # Return telemetry data
-            telemetry_data = Telemetry(
-                latitude=latitude if latitude is not None else 0.0,
-                longitude=longitude if longitude is not None else 0.0,
-                altitude=altitude if altitude is not None else 0.0,
-                velocity=velocity if velocity is not None else 0.0,
-                relative_altitude=relative_altitude,
-                heading=heading,
-                battery_remaining=battery_remaining,
-                gps_fix = gps_fix
-            )
-            return telemetry_data
+@app.post("/params/{drone_id}")
+async def set_params_endpoint(drone_id: str, values: Dict[str, float], drone_connections: Dict = Depends(get_drone_connections)):
+    """Set several parameters at once, e.g. {"FENCE_ACTION": 1, "FENCE_ALT_MAX": 120}."""
+    link = drone_connections.get(drone_id)
+    if not link:
+        raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
 
+    try:
+        confirmed = await param_manager.table(link).set_params(values)
     except Exception as e:
-        print(f"Error retrieving telemetry data: {e}")
-        raise
+        raise HTTPException(status_code=500, detail=f"Failed to set parameters: {str(e)}")
+
+    return {"status": f"Parameters set successfully for drone '{drone_id}'", "params": confirmed}
+
+def shared_telemetry(drone_id: Optional[str] = None):
+    """Entries (or one drone's entry) from the owner worker's shared table, in a non-owner worker."""
+    try:
+        return telemetry_replica.entries() if drone_id is None else telemetry_replica.entry(drone_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 @app.get("/get_telemetry/{drone_id}", response_model=Telemetry)
-async def get_telemetry_endpoint(response: Response, drone_id: str, drone_connections: Dict = Depends(get_drone_connections)):
-    master = drone_connections.get(drone_id)
-    if not master:
+async def get_telemetry_endpoint(request: Request, response: Response, drone_id: str, drone_connections: Dict = Depends(get_drone_connections)):
+    link = drone_connections.get(drone_id)
+    entry = shared_telemetry(drone_id) if telemetry_replica is not None else None
+    if not link and not entry:
         raise HTTPException(status_code=404, detail=f"Drone with ID {drone_id} not found")
     
     # Add cache-control headers to prevent caching
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
+    response.headers["Vary"] = "Accept"
     
     try:
-        telemetry = await get_telemetry(master)
-        return telemetry
+        if entry is not None:
+            if "telemetry" not in entry:
+                raise ValueError(entry["error"])
+            telemetry = Telemetry(**entry["telemetry"])
+        else:
+            telemetry = get_telemetry(link)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    # Clients that accept the compact binary format get it instead of JSON
+    if wants_compact(request.headers.get("accept")):
+        return compact_telemetry_response([{"drone_id": drone_id, "telemetry": telemetry}])
+    return telemetry
     
 @app.get("/get_all_telemetry", response_model=List[DroneTelemetryResponse])
-async def get_all_telemetry(response: Response, drone_connections: Dict = Depends(get_drone_connections)):
+async def get_all_telemetry(request: Request, response: Response, drone_connections: Dict = Depends(get_drone_connections)):
+    if telemetry_replica is not None:
+        entries = shared_telemetry()
+        if wants_compact(request.headers.get("accept")):
+            return compact_telemetry_response(entries)
+        # Already plain values from the shared table, so skip FastAPI's per-item response validation
+        return JSONResponse([{"drone_id": entry["drone_id"], "telemetry": entry.get("telemetry"), "error": entry.get("error")}
+                             for entry in entries],
+                            headers={
+                                "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+                                "Pragma": "no-cache",
+                                "Expires": "0",
+                                "Vary": "Accept"
+                            })
+
+    if wants_compact(request.headers.get("accept")):
+        return compact_telemetry_response(list(telemetry_snapshot().values()))
+
     # Add cache-control headers to prevent caching
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
+    response.headers["Vary"] = "Accept"
     
     all_telemetry = []
-    for drone_id, master in drone_connections.items():
+    for drone_id, link in drone_connections.items():
         try:
-            telemetry = await get_telemetry(master)
+            telemetry = get_telemetry(link)
             all_telemetry.append({
                 "drone_id": drone_id,
                 "telemetry": telemetry
@@ -913,6 +942,225 @@ async def get_all_telemetry(response: Response, drone_connections: Dict = Depend
     
     return all_telemetry
 
+@app.get("/telemetry_history/{drone_id}")
+async def telemetry_history_endpoint(drone_id: str, since: Optional[float] = None, until: Optional[float] = None, downsample: int = 1):
+    """
+    Recorded telemetry of a drone between ``since`` and ``until`` (Unix timestamps; negative values
+    are seconds before now, e.g. since=-600 for the last 10 minutes), keeping every ``downsample``-th sample.
+    """
+    if drone_id not in telemetry_history.rings:
+        raise HTTPException(status_code=404, detail=f"No telemetry history for drone {drone_id}")
+    if downsample < 1:
+        raise HTTPException(status_code=400, detail="downsample must be at least 1")
+
+    now = time.time()
+    if since is not None and since < 0:
+        since = now + since
+    if until is not None and until < 0:
+        until = now + until
+
+    samples = telemetry_history.query(drone_id, since, until, downsample)
+
+    # Columns are plain lists already, so skip FastAPI's per-item response encoding
+    return JSONResponse({"drone_id": drone_id, "count": len(samples["timestamp"]), "samples": samples})
+
+def telemetry_snapshot() -> Dict[str, Dict]:
+    """DroneTelemetryResponse-shaped entry for every connected drone, for the telemetry streams."""
+    if telemetry_replica is not None:
+        try:
+            return {entry["drone_id"]: entry for entry in telemetry_replica.entries()}
+        except RuntimeError:
+            return {}
+    snapshot = {}
+    for drone_id, link in drone_connections.items():
+        try:
+            snapshot[drone_id] = {"drone_id": drone_id, "telemetry": get_telemetry(link).dict()}
+        except Exception as e:
+            snapshot[drone_id] = {"drone_id": drone_id, "error": str(e)}
+    return snapshot
+
+# One shared producer feeds every WebSocket and SSE client
+telemetry_broadcaster = TelemetryBroadcaster(telemetry_snapshot)
+
+@app.websocket("/ws/telemetry")
+async def telemetry_websocket(websocket: WebSocket, drones: Optional[str] = None, rate: float = 1.0):
+    """Push telemetry for the selected drones (comma-separated, default all) at ``rate`` Hz.
+
+    The client may send {"drones": [...], "rate": n} at any time to change its selection.
+    Clients whose handshake Accept header lists the compact media type get binary
+    delta-encoded frames instead of JSON text.
+    """
+    # Delta state is per client, so every compact client has its own encoder
+    encoder = CompactEncoder() if wants_compact(websocket.headers.get("accept")) else None
+    await websocket.accept()
+    try:
+        client = telemetry_broadcaster.register(parse_csv(drones), rate)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
+    async def receive_updates():
+        while True:
+            try:
+                update = await websocket.receive_json()
+                if "drones" in update:
+                    client.drones = set(update["drones"]) if update["drones"] else None
+                if "rate" in update and 0 < float(update["rate"]) <= telemetry_broadcaster.max_rate:
+                    client.rate = float(update["rate"])
+            except (ValueError, TypeError, AttributeError) as e:
+                print(f"Ignoring invalid telemetry stream update: {e}")
+
+    receiver = asyncio.create_task(receive_updates())
+    try:
+        while True:
+            frame = await client.next()
+            if receiver.done():
+                break  # Client disconnected while we waited for the frame
+            if encoder is not None:
+                await websocket.send_bytes(encoder.encode(frame.select(client.drones), frame.timestamp))
+            else:
+                await websocket.send_text(frame.encode(client.drones))
+    except (WebSocketDisconnect, RuntimeError):
+        # Client disconnected during the send
+        pass
+    finally:
+        receiver.cancel()
+        telemetry_broadcaster.unregister(client)
+
+@app.get("/stream/telemetry")
+async def telemetry_event_stream(request: Request, drones: Optional[str] = None, rate: float = 1.0):
+    """Server-Sent Events version of /ws/telemetry."""
+    try:
+        client = telemetry_broadcaster.register(parse_csv(drones), rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                frame = await client.next()
+                yield f"data: {frame.encode(client.drones)}\n\n"
+        finally:
+            telemetry_broadcaster.unregister(client)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/events")
+async def events_endpoint(since: int = 0, type: Optional[str] = None):
+    """Safety events newer than the event id ``since``, optionally filtered by comma-separated types."""
+    return event_bus.since(since, parse_csv(type))
+
+@app.get("/stream/events")
+async def event_stream(request: Request, type: Optional[str] = None):
+    """Server-Sent Events stream of new safety events."""
+    types = parse_csv(type)
+    queue = event_bus.subscribe()
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                event = await queue.get()
+                if types is None or event["type"] in types:
+                    yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            event_bus.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/stream/clients")
+async def telemetry_stream_clients():
+    """Rate and sent/dropped frame counts of every connected telemetry stream client."""
+    return telemetry_broadcaster.status()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Server and per-drone link metrics in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/profiles")
+async def list_profiles(limit: int = 10, route: Optional[str] = None):
+    """Profiler settings and counts, and the slowest profiled requests (optionally for one route template)."""
+    return {**request_profiler.status(), "traces": request_profiler.slowest(limit, route)}
+
+def get_trace(trace_id: int):
+    trace = request_profiler.traces.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Profile {trace_id} not found")
+    return trace
+
+@app.get("/admin/profiles/{trace_id}")
+async def get_profile(trace_id: int, limit: int = 25):
+    """A profiled request with its most expensive functions by cumulative time."""
+    trace = get_trace(trace_id)
+    return {**trace.summary(), "functions": trace.functions(limit)}
+
+@app.get("/admin/profiles/{trace_id}/collapsed")
+async def get_profile_collapsed(trace_id: int):
+    """Sampled stacks of a profiled request in collapsed format, for flamegraph.pl or speedscope."""
+    return Response(content=get_trace(trace_id).collapsed(), media_type="text/plain")
+
+@app.get("/admin/profiles/{trace_id}/speedscope")
+async def get_profile_speedscope(trace_id: int):
+    """Sampled stacks of a profiled request as a speedscope file."""
+    return get_trace(trace_id).speedscope()
+
+@app.get("/recorder/status")
+async def recorder_status():
+    """Whether frames are being recorded, queue depth, frames written and each drone's current file."""
+    return flight_recorder.status()
+
+@app.get("/recordings")
+async def list_recordings(drone_id: Optional[str] = None):
+    """Recorded .tlog files, oldest first, optionally for one drone."""
+    return flight_recorder.recordings(drone_id)
+
+@app.get("/recordings/{name}")
+async def download_recording(name: str):
+    """Download a recording; it opens in any tool that reads .tlog files (MAVProxy, Mission Planner, pymavlink)."""
+    path = flight_recorder.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No recording named {name}")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+@app.get("/recordings/{name}/summary")
+async def recording_summary(name: str):
+    """Frame count, time span and message counts of a recording."""
+    path = flight_recorder.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No recording named {name}")
+
+    def summarize_recording():
+        with TlogReader(path) as reader:
+            return reader.summary()
+
+    return await asyncio.get_running_loop().run_in_executor(None, summarize_recording)
+
+@app.post("/recordings/export")
+async def export_recordings_endpoint(request: ExportRecordingsRequest):
+    """
+    Convert recordings to one Parquet (or Arrow) table per message type under exports/<MESSAGE_TYPE>/,
+    one worker process per recording.
+    """
+    if request.format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {request.format}, expected one of {', '.join(FORMATS)}")
+    names = request.names or [recording["name"] for recording in flight_recorder.recordings(request.drone_id)]
+    paths = []
+    for name in names:
+        path = flight_recorder.path(name)
+        if path is None:
+            raise HTTPException(status_code=404, detail=f"No recording named {name}")
+        paths.append(path)
+    if not paths:
+        raise HTTPException(status_code=404, detail="No recordings to export")
+
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(None, export_recordings, paths, "exports", request.format)
+    except ExportError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"output": os.path.abspath("exports"), "recordings": results}
+
 # # METHOD 1: 
 
 # # Scalable command dictionary with exact drone names and mission names like mission_1, mission_2
@@ -969,7 +1217,7 @@ async def get_all_telemetry(response: Response, drone_connections: Dict = Depend
 
 #     return command
 
-# async def trigger_action(command: str, drone_connections: Dict = Depends(get_drone_connections), config: Dict = Depends(get_config)):
+# async def trigger_action(command: str, drone_connections: Dict = Depends(get_drone_connections), config: AppConfig = Depends(get_config)):
 #     # Preprocess the command to handle voice quirks
 #     command = preprocess_command(command)
 
@@ -1002,7 +1250,7 @@ async def get_all_telemetry(response: Response, drone_connections: Dict = Depend
 #     return {"status": "error", "message": "Command not found"}
 
 # @app.post("/trigger_command")
-# async def trigger_command(command: ChatCommand, drone_connections: Dict = Depends(get_drone_connections), config: Dict = Depends(get_config)):
+# async def trigger_command(command: ChatCommand, drone_connections: Dict = Depends(get_drone_connections), config: AppConfig = Depends(get_config)):
 #     # Preprocess and trigger the action
 #     response = await trigger_action(command.command.lower(), drone_connections=drone_connections, config=config)
 #     return response
@@ -1014,63 +1262,29 @@ async def get_chatbot():
 
 # METHOD 2: 
 
-# OpenAI API Key
-openai.api_key = ""
-
-# Predefined API command templates (curl commands)
-api_commands = {
-    "connect_all_drones": "curl -X POST 'http://localhost:8000/connect_all_drones'",
-    "connect_drone": "curl -X POST 'http://localhost:8000/connect_drone' -H 'Content-Type: application/json' -d '{{\"drone_id\": \"{drone_id}\"}}'",
-    "get_all_telemetry": "curl -X GET 'http://localhost:8000/get_all_telemetry'",
-    "get_telemetry": "curl -X GET 'http://localhost:8000/get_telemetry/{drone_id}'",
-    "update_drone_mode": "curl -X POST 'http://localhost:8000/update_drone_mode/{drone_id}/{mode}' -H 'Content-Type: application/json'",
-    "set_mission": "curl -X POST 'http://localhost:8000/set_mission/{drone_id}?mission_name={mission_id}'"
-}
 class ChatCommand(BaseModel):
     command: str
 
-def get_gpt4_response(user_command: str):
-    """Use GPT-4 to process the user command and return an appropriate API command."""
-    
-    prompt = f"""
-    You are a drone assistant. Based on the user command, output the appropriate API command.
-    
-    Command: {user_command}
-    
-    API Commands: {json.dumps(api_commands, indent=2)}
-    
-    Your task is to determine which API command is the closest match and fill in any necessary parameters such as drone_id or mode.
-    
-    Respond with the exact curl command or an error message if you can't interpret the command.
+@app.post("/trigger_command")
+async def trigger_command(command: ChatCommand, config: AppConfig = Depends(get_config)):
+    """API endpoint to turn a chat or voice command into a drone API command.
 
-    Make it a concise user-friendly response.
+    Known phrasings are matched directly and earlier LLM answers are cached;
+    only new commands go to the LLM (settings.llm_base_url and llm_model).
     """
-    
-    # Call GPT-4 with the user command using OpenAI ChatCompletion endpoint
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a drone assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=100,
-        temperature=0.2,
-    )
-    
-    # Extract the response text
-    gpt_output = response['choices'][0]['message']['content'].strip()
-    
-    return gpt_output
+    try:
+        resolution = await intent_engine.resolve(command.command, config.settings)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"The assistant did not answer within {config.settings.llm_timeout} seconds")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to interpret the command: {str(e)}")
 
-@app.post("/trigger_command")
-async def trigger_command(command: ChatCommand):
-    """API endpoint to trigger a drone command via GPT-4."""
-    user_command = command.command.lower()
-    
-    # Get the response from GPT-4
-    gpt4_response = get_gpt4_response(user_command)
-    
-    return {"gpt4_response": gpt4_response}
+    return {"gpt4_response": resolution["api_call"], **resolution}
+
+@app.get("/trigger_command/status")
+async def trigger_command_status():
+    """How many commands were resolved by pattern, from the cache and by the LLM, and the cache size."""
+    return intent_engine.status()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,275 @@
+import asyncio
+import bisect
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pymavlink.dialects.v20.all as dialect
+
+# Upper bounds (seconds) of the latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RECV_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Cumulative-on-export histogram with fixed bucket bounds.
+
+    ``observe`` does one bisect and two in-place additions on slots allocated
+    up front, so it is cheap enough for per-message use. Each histogram must
+    only be written from one thread.
+    """
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last slot counts values above every bound (+Inf)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def add(self, other: "Histogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+
+
+class LinkStats:
+    """Counters for one drone link, updated by its reader thread.
+
+    Message counts are keyed by MAVLink message id and only gain a key the
+    first time a type is seen, so counting a message allocates nothing.
+    """
+
+    __slots__ = ("received", "bad_data", "lost_before", "recv_wait", "rtt", "rtt_histogram", "timesync_sent")
+
+    def __init__(self):
+        self.received: Dict[int, int] = {}
+        self.bad_data = 0
+        # Sequence gaps counted by connections this link has since replaced
+        self.lost_before = 0
+        self.recv_wait = Histogram(RECV_WAIT_BUCKETS)
+        self.rtt: Optional[float] = None
+        self.rtt_histogram = Histogram(RTT_BUCKETS)
+        self.timesync_sent: Optional[int] = None
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def labels(**values) -> str:
+    return "{" + ",".join(f'{name}="{escape(str(value))}"' for name, value in values.items()) + "}"
+
+
+def render_histogram(lines: List[str], name: str, histogram: Histogram, **label_values):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f"{name}_bucket{labels(**label_values, le=le)} {cumulative}")
+    suffix = labels(**label_values) if label_values else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {cumulative}")
+
+
+class Metrics:
+    """Collects server and drone link metrics and renders them in the Prometheus text format.
+
+    Per-link counters live on each link (``link.stats``) and are only read
+    when ``/metrics`` is scraped. Round-trip time is measured by sending each
+    connected drone a TIMESYNC request every ``timesync_interval`` seconds;
+    the vehicle echoes ``ts1`` back. Event-loop lag is how late a sleep of
+    ``lag_interval`` seconds wakes up.
+    """
+
+    def __init__(self, links: Dict, lag_interval: float = 0.1, timesync_interval: float = 5.0):
+        self.links = links
+        self.lag_interval = lag_interval
+        self.timesync_interval = timesync_interval
+        self.http_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.http_requests: Dict[Tuple[str, str, int], int] = {}
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self._tracked = set()
+        self._tasks: List[asyncio.Task] = []
+
+    def track(self, link):
+        """Measure this link's round-trip time (call once per link)."""
+        if link.drone_id in self._tracked:
+            return
+        self._tracked.add(link.drone_id)
+        link.add_listener(dialect.MAVLink_timesync_message.msgname, lambda message: self._on_timesync(link, message))
+
+    def _on_timesync(self, link, message: dialect.MAVLink_timesync_message):
+        stats = link.stats
+        # Only our own requests come back with tc1 set and our ts1 echoed
+        if message.tc1 == 0 or message.ts1 != stats.timesync_sent:
+            return
+        rtt = (time.monotonic_ns() - message.ts1) / 1e9
+        stats.timesync_sent = None
+        stats.rtt = rtt
+        stats.rtt_histogram.observe(rtt)
+
+    def start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._sample_loop_lag()), loop.create_task(self._send_timesync())]
+
+    async def _sample_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, loop.time() - expected))
+
+    async def _send_timesync(self):
+        while True:
+            await asyncio.sleep(self.timesync_interval)
+            for link in list(self.links.values()):
+                if not link.reader_alive:
+                    continue
+                sent = time.monotonic_ns()
+                try:
+                    link.mav.send(dialect.MAVLink_timesync_message(tc1=0, ts1=sent))
+                    link.stats.timesync_sent = sent
+                except Exception as e:
+                    print(f"Failed to send TIMESYNC to {link.drone_id}: {e}")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def observe_request(self, method: str, route: str, status: int, elapsed: float):
+        key = (method, route)
+        histogram = self.http_latency.get(key)
+        if histogram is None:
+            histogram = self.http_latency[key] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(elapsed)
+        counter = (method, route, status)
+        self.http_requests[counter] = self.http_requests.get(counter, 0) + 1
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        lines += ["# HELP http_requests_total HTTP requests by route and status.", "# TYPE http_requests_total counter"]
+        for (method, route, status), count in sorted(self.http_requests.items()):
+            lines.append(f"http_requests_total{labels(method=method, route=route, status=status)} {count}")
+        lines += ["# HELP http_request_duration_seconds Time until the response was fully sent, by route.",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), histogram in sorted(self.http_latency.items()):
+            render_histogram(lines, "http_request_duration_seconds", histogram, method=method, route=route)
+
+        lines += ["# HELP event_loop_lag_seconds How late timed wake-ups on the event loop run.",
+                  "# TYPE event_loop_lag_seconds histogram"]
+        render_histogram(lines, "event_loop_lag_seconds", self.loop_lag)
+
+        # Queue of the default executor used by asyncio.to_thread and run_in_executor
+        executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+        queue = getattr(executor, "_work_queue", None)
+        lines += ["# HELP threadpool_queue_depth Calls waiting for a thread in the default executor.",
+                  "# TYPE threadpool_queue_depth gauge",
+                  f"threadpool_queue_depth {queue.qsize() if queue is not None else 0}",
+                  "# HELP threadpool_threads Threads started by the default executor.",
+                  "# TYPE threadpool_threads gauge",
+                  f"threadpool_threads {len(getattr(executor, '_threads', ()))}",
+                  "# HELP threadpool_max_threads Size limit of the default executor.",
+                  "# TYPE threadpool_max_threads gauge",
+                  f"threadpool_max_threads {getattr(executor, '_max_workers', 0)}"]
+
+        self._render_links(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+    def _render_links(self, lines: List[str]):
+        links = sorted(self.links.items())
+        names = {}
+        received, up, heartbeat, lost, bad, rtt, in_flight, wait_sum, wait_count = ([] for _ in range(9))
+        recv_wait = Histogram(RECV_WAIT_BUCKETS)
+        rtts = Histogram(RTT_BUCKETS)
+
+        for drone_id, link in links:
+            stats = link.stats
+            for msg_id, count in sorted(dict(stats.received).items()):
+                name = names.get(msg_id)
+                if name is None:
+                    cls = dialect.mavlink_map.get(msg_id)
+                    name = names[msg_id] = cls.msgname if cls is not None else f"UNKNOWN_{msg_id}"
+                received.append(f"drone_messages_received_total{labels(drone_id=drone_id, type=name)} {count}")
+            up.append(f"drone_link_up{labels(drone_id=drone_id)} {int(bool(link.reader_alive))}")
+            age = link.age(dialect.MAVLink_heartbeat_message.msgname)
+            if age is not None:
+                heartbeat.append(f"drone_heartbeat_age_seconds{labels(drone_id=drone_id)} {age:.3f}")
+            lost.append(f"drone_packets_lost_total{labels(drone_id=drone_id)} "
+                        f"{stats.lost_before + getattr(link.master, 'mav_loss', 0)}")
+            bad.append(f"drone_bad_data_total{labels(drone_id=drone_id)} {stats.bad_data}")
+            if stats.rtt is not None:
+                rtt.append(f"drone_link_rtt_seconds{labels(drone_id=drone_id)} {stats.rtt:.6f}")
+            in_flight.append(f"mavlink_transactions_in_flight{labels(drone_id=drone_id)} {link.in_flight}")
+            wait_sum.append(f"drone_recv_wait_seconds_sum{labels(drone_id=drone_id)} {stats.recv_wait.sum}")
+            wait_count.append(f"drone_recv_wait_seconds_count{labels(drone_id=drone_id)} {stats.recv_wait.count}")
+            recv_wait.add(stats.recv_wait)
+            rtts.add(stats.rtt_histogram)
+
+        lines += ["# HELP drone_messages_received_total MAVLink messages received, by drone and type.",
+                  "# TYPE drone_messages_received_total counter", *received,
+                  "# HELP drone_link_up Whether the drone's reader is running.", "# TYPE drone_link_up gauge", *up,
+                  "# HELP drone_heartbeat_age_seconds Seconds since the last HEARTBEAT.",
+                  "# TYPE drone_heartbeat_age_seconds gauge", *heartbeat,
+                  "# HELP drone_packets_lost_total Packets missing from the MAVLink sequence numbers.",
+                  "# TYPE drone_packets_lost_total counter", *lost,
+                  "# HELP drone_bad_data_total Bytes or frames the parser could not decode.",
+                  "# TYPE drone_bad_data_total counter", *bad,
+                  "# HELP drone_link_rtt_seconds Latest TIMESYNC round-trip time.",
+                  "# TYPE drone_link_rtt_seconds gauge", *rtt,
+                  "# HELP mavlink_transactions_in_flight Requests and protocol exchanges waiting for replies.",
+                  "# TYPE mavlink_transactions_in_flight gauge", *in_flight,
+                  "# HELP drone_recv_wait_seconds Time a reader thread waits in recv_match for each message (mavutil links).",
+                  "# TYPE drone_recv_wait_seconds summary", *wait_sum, *wait_count,
+                  "# HELP mavlink_recv_wait_seconds Time reader threads wait in recv_match for each message, all drones.",
+                  "# TYPE mavlink_recv_wait_seconds histogram"]
+        render_histogram(lines, "mavlink_recv_wait_seconds", recv_wait)
+        lines += ["# HELP mavlink_rtt_seconds TIMESYNC round-trip times, all drones.",
+                  "# TYPE mavlink_rtt_seconds histogram"]
+        render_histogram(lines, "mavlink_rtt_seconds", rtts)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by its route template.
+
+    Plain ASGI rather than ``BaseHTTPMiddleware`` so it adds no task or
+    stream per request; streaming responses are timed until they finish.
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            self.metrics.observe_request(scope["method"], getattr(route, "path", "unmatched"), status,
+                                         time.perf_counter() - start)
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence
+
+import pymavlink.dialects.v20.all as dialect
+
+from config import FenceConfig, Waypoint
+from link import DroneLink
+
+
+def clamp_int32(value: float) -> int:
+    return max(min(round(value), 2147483647), -2147483648)
+
+
+def mission_item(target_system: int, target_component: int, seq: int, frame: int, command: int,
+                 x: int = 0, y: int = 0, z: float = 0.0, param1: float = 0,
+                 mission_type: int = dialect.MAV_MISSION_TYPE_MISSION) -> dialect.MAVLink_mission_item_int_message:
+    return dialect.MAVLink_mission_item_int_message(target_system=target_system,
+                                                    target_component=target_component,
+                                                    seq=seq,
+                                                    frame=frame,
+                                                    command=command,
+                                                    current=0,
+                                                    autocontinue=0,
+                                                    param1=param1,
+                                                    param2=0,
+                                                    param3=0,
+                                                    param4=0,
+                                                    x=x,
+                                                    y=y,
+                                                    z=z,
+                                                    mission_type=mission_type)
+
+
+def build_mission_items(target_system: int, target_component: int, waypoints: Sequence[Waypoint]) -> List[dialect.MAVLink_mission_item_int_message]:
+    """Mission as uploaded by the API: home placeholder, takeoff, then the waypoints."""
+    def item(seq, frame, command, x=0, y=0, z=0.0):
+        return mission_item(target_system, target_component, seq, frame, command, x, y, z)
+
+    items = [
+        item(0, dialect.MAV_FRAME_GLOBAL, dialect.MAV_CMD_NAV_WAYPOINT),
+        item(1, dialect.MAV_FRAME_GLOBAL_RELATIVE_ALT, dialect.MAV_CMD_NAV_TAKEOFF, z=waypoints[0].altitude)
+    ]
+    for seq, waypoint in enumerate(waypoints, start=2):
+        items.append(item(seq, dialect.MAV_FRAME_GLOBAL_RELATIVE_ALT, waypoint.command,
+                          x=clamp_int32(waypoint.latitude * 1e7),
+                          y=clamp_int32(waypoint.longitude * 1e7),
+                          z=waypoint.altitude))
+    return items
+
+
+def build_fence_items(target_system: int, target_component: int, fence: FenceConfig) -> List[dialect.MAVLink_mission_item_int_message]:
+    """Fence as MAV_MISSION_TYPE_FENCE items: polygon vertices (param1 = vertex count), then circles (param1 = radius)."""
+    items = []
+
+    def item(command, latitude, longitude, param1):
+        items.append(mission_item(target_system, target_component, len(items), dialect.MAV_FRAME_GLOBAL, command,
+                                  x=clamp_int32(latitude * 1e7),
+                                  y=clamp_int32(longitude * 1e7),
+                                  param1=param1,
+                                  mission_type=dialect.MAV_MISSION_TYPE_FENCE))
+
+    if fence.return_point is not None:
+        item(dialect.MAV_CMD_NAV_FENCE_RETURN_POINT, *fence.return_point, 0)
+
+    for polygon in fence.all_polygons():
+        command = dialect.MAV_CMD_NAV_FENCE_POLYGON_VERTEX_INCLUSION if polygon.inclusion \
+            else dialect.MAV_CMD_NAV_FENCE_POLYGON_VERTEX_EXCLUSION
+        for latitude, longitude in polygon.coordinates:
+            item(command, latitude, longitude, len(polygon.coordinates))
+
+    for circle in fence.circles:
+        command = dialect.MAV_CMD_NAV_FENCE_CIRCLE_INCLUSION if circle.inclusion \
+            else dialect.MAV_CMD_NAV_FENCE_CIRCLE_EXCLUSION
+        item(command, circle.latitude, circle.longitude, circle.radius)
+
+    return items
+
+
+class UploadReport:
+    """Timing of one mission-protocol upload."""
+
+    def __init__(self, mission_type: int, count: int):
+        self.mission_type = mission_type
+        self.count = count
+        self.elapsed = 0.0
+        self.bytes_sent = 0
+        self.retransmits = 0
+        self.rtts: List[float] = []
+
+    def as_dict(self) -> Dict:
+        rtts = sorted(self.rtts)
+        return {
+            "items": self.count,
+            "elapsed": round(self.elapsed, 3),
+            "items_per_second": round(self.count / self.elapsed, 1) if self.elapsed > 0 else None,
+            "bytes_per_second": round(self.bytes_sent / self.elapsed) if self.elapsed > 0 else None,
+            "retransmits": self.retransmits,
+            "rtt_min_ms": round(rtts[0] * 1000, 2) if rtts else None,
+            "rtt_median_ms": round(rtts[len(rtts) // 2] * 1000, 2) if rtts else None,
+            "rtt_max_ms": round(rtts[-1] * 1000, 2) if rtts else None
+        }
+
+
+class MissionUploadError(RuntimeError):
+    pass
+
+
+class MissionTypeUnsupportedError(MissionUploadError):
+    """The vehicle does not implement the mission protocol for this mission type."""
+
+
+async def upload_items(link: DroneLink, items: Sequence[dialect.MAVLink_message],
+                       mission_type: int = dialect.MAV_MISSION_TYPE_MISSION,
+                       timeout: float = 1.5, retries: int = 5) -> UploadReport:
+    """Encode ``items`` once and upload them with ``upload_frames``."""
+    return await upload_frames(link, [item.pack(link.mav) for item in items], mission_type, timeout, retries)
+
+
+async def upload_frames(link: DroneLink, encoded: Sequence[bytes],
+                        mission_type: int = dialect.MAV_MISSION_TYPE_MISSION,
+                        timeout: float = 1.5, retries: int = 5) -> UploadReport:
+    """Upload pre-encoded mission items with the MAVLink mission protocol.
+
+    ``encoded[seq]`` is the packed MISSION_ITEM_INT frame for ``seq``, so a
+    MISSION_REQUEST_INT (or legacy MISSION_REQUEST) is answered with a single
+    socket write. If the vehicle goes quiet for ``timeout`` seconds the last
+    frame is retransmitted, and the upload fails after ``retries``
+    consecutive timeouts instead of hanging. Callers must hold the link's
+    lock for this mission type.
+    """
+    count_message = dialect.MAVLink_mission_count_message(target_system=link.target_system,
+                                                          target_component=link.target_component,
+                                                          count=len(encoded),
+                                                          mission_type=mission_type)
+    report = UploadReport(mission_type, len(encoded))
+    sent_at: Dict[int, float] = {}
+    start = time.perf_counter()
+
+    with link.subscribe([dialect.MAVLink_mission_request_int_message.msgname,
+                         dialect.MAVLink_mission_request_message.msgname,
+                         dialect.MAVLink_mission_ack_message.msgname],
+                        mission_type=mission_type) as subscription:
+        link.mav.send(count_message)
+        last_sent: Optional[int] = None  # seq of the last item sent, None while only the count is out
+        timeouts = 0
+
+        while True:
+            try:
+                message = await subscription.get(timeout)
+            except asyncio.TimeoutError:
+                timeouts += 1
+                if timeouts > retries:
+                    if last_sent is None and mission_type != dialect.MAV_MISSION_TYPE_MISSION:
+                        # Firmware without this mission type silently ignores the MISSION_COUNT
+                        raise MissionTypeUnsupportedError(f"No reply to MISSION_COUNT for mission type {mission_type}")
+                    raise MissionUploadError(f"Mission upload to {link.drone_id} timed out "
+                                             f"after {retries} retransmits (last item sent: {last_sent})")
+                report.retransmits += 1
+                if last_sent is None:
+                    link.mav.send(count_message)
+                else:
+                    link.write(encoded[last_sent])
+                    report.bytes_sent += len(encoded[last_sent])
+                    sent_at[last_sent] = time.perf_counter()
+                continue
+
+            timeouts = 0
+            now = time.perf_counter()
+
+            if message.get_type() == dialect.MAVLink_mission_ack_message.msgname:
+                if last_sent is not None and last_sent in sent_at:
+                    report.rtts.append(now - sent_at.pop(last_sent))
+                if message.type == dialect.MAV_MISSION_UNSUPPORTED:
+                    raise MissionTypeUnsupportedError(f"Vehicle does not support mission type {mission_type}")
+                if message.type != dialect.MAV_MISSION_ACCEPTED:
+                    result = dialect.enums["MAV_MISSION_RESULT"][message.type].name \
+                        if message.type in dialect.enums["MAV_MISSION_RESULT"] else message.type
+                    raise MissionUploadError(f"Vehicle rejected upload: {result}")
+                report.elapsed = now - start
+                return report
+
+            seq = message.seq
+            if seq >= len(encoded):
+                raise MissionUploadError(f"Vehicle requested item {seq} of {len(encoded)}")
+            if seq - 1 in sent_at:
+                report.rtts.append(now - sent_at.pop(seq - 1))
+
+            link.write(encoded[seq])
+            report.bytes_sent += len(encoded[seq])
+            sent_at[seq] = now
+            last_sent = seq
@@ -0,0 +1,195 @@
+import asyncio
+import struct
+import time
+from typing import Dict, List, Optional
+
+import pymavlink.dialects.v20.all as dialect
+
+from link import DroneLink
+
+PARAM_VALUE = dialect.MAVLink_param_value_message.msgname
+
+
+def as_float32(value: float) -> float:
+    """``value`` as the vehicle will store and echo it (PARAM_VALUE carries a float32)."""
+    return struct.unpack("<f", struct.pack("<f", value))[0]
+
+
+class ParamError(RuntimeError):
+    pass
+
+
+class ParamTable:
+    """In-memory copy of one vehicle's parameter table.
+
+    Every PARAM_VALUE the link receives updates the table, whether it answers
+    our own request or was sent unsolicited (e.g. a ground station changing a
+    parameter), so reads are served from memory. ``sync`` pulls the whole
+    table with PARAM_REQUEST_LIST and then requests any indices that were lost
+    on the way by index.
+    """
+
+    def __init__(self, link: DroneLink):
+        self.link = link
+        self.values: Dict[str, float] = {}
+        self.types: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}   # param_index -> param_id
+        self.count: Optional[int] = None
+        self.synced_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        link.add_listener(PARAM_VALUE, self._on_param_value)
+
+    def _on_param_value(self, message: dialect.MAVLink_param_value_message):
+        self.values[message.param_id] = message.param_value
+        self.types[message.param_id] = message.param_type
+        self.count = message.param_count
+        if 0 <= message.param_index < message.param_count:
+            self.names[message.param_index] = message.param_id
+
+    def missing(self) -> List[int]:
+        """Indices of the vehicle's table we have not received yet."""
+        if self.count is None:
+            return []
+        return [index for index in range(self.count) if index not in self.names]
+
+    @property
+    def complete(self) -> bool:
+        return self.count is not None and len(self.names) >= self.count
+
+    async def _drain(self, subscription, quiet: float):
+        """Consume PARAM_VALUE messages until none arrive for ``quiet`` seconds or the table is complete."""
+        while not self.complete:
+            try:
+                await subscription.get(quiet)
+            except asyncio.TimeoutError:
+                return
+
+    async def sync(self, quiet: float = 1.0, retries: int = 3, batch: int = 50):
+        """Fetch the full parameter table, then fill gaps by index.
+
+        The list request is repeated only if nothing at all came back;
+        afterwards at most ``batch`` missing indices are requested at a time.
+        Raises ParamError if the table is still incomplete after ``retries``
+        rounds.
+        """
+        # Pull the whole table again, e.g. after a reconnect; cached values stay readable meanwhile
+        self.names.clear()
+        self.count = None
+
+        request_list = dialect.MAVLink_param_request_list_message(target_system=self.link.target_system,
+                                                                  target_component=self.link.target_component)
+        with self.link.subscribe(PARAM_VALUE) as subscription:
+            for attempt in range(retries + 1):
+                if self.count is None:
+                    self.link.mav.send(request_list)
+                else:
+                    for index in self.missing()[:batch]:
+                        self.link.mav.send(dialect.MAVLink_param_request_read_message(target_system=self.link.target_system,
+                                                                                      target_component=self.link.target_component,
+                                                                                      param_id=b"",
+                                                                                      param_index=index))
+                await self._drain(subscription, quiet)
+                if self.complete:
+                    self.synced_at = time.time()
+                    self.last_error = None
+                    return
+
+        self.last_error = f"{len(self.missing()) if self.count is not None else 'all'} parameters missing after sync"
+        raise ParamError(f"Parameter sync with {self.link.drone_id} incomplete: {self.last_error}")
+
+    def start_sync(self):
+        """Run ``sync`` in the background unless one is already running."""
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.get_running_loop().create_task(self._background_sync())
+
+    async def _background_sync(self):
+        try:
+            await self.sync()
+            print(f"Synced {len(self.values)} parameters from {self.link.drone_id}")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Parameter sync failed for {self.link.drone_id}: {e}")
+
+    async def read(self, name: str, refresh: bool = False, timeout: float = 3.0, retries: int = 3) -> float:
+        """Parameter value from memory, fetched from the vehicle if unknown or ``refresh``."""
+        if not refresh and name in self.values:
+            return self.values[name]
+        message = dialect.MAVLink_param_request_read_message(target_system=self.link.target_system,
+                                                             target_component=self.link.target_component,
+                                                             param_id=name.encode("utf-8"),
+                                                             param_index=-1)
+        reply = await self.link.request(message, PARAM_VALUE, timeout=timeout, retries=retries, param_id=name)
+        return reply.param_value
+
+    async def set_params(self, values: Dict[str, float], timeout: float = 1.5, retries: int = 3) -> Dict[str, float]:
+        """Set several parameters at once and wait for all confirmations together.
+
+        Every PARAM_SET is sent back to back; PARAM_VALUE echoes are matched by
+        name and value, and only unconfirmed parameters are resent after each
+        ``timeout``. Raises ParamError naming the parameters that were not
+        confirmed (or were echoed with a different value) after ``retries``.
+        """
+        pending = {name: as_float32(value) for name, value in values.items()}
+        echoed: Dict[str, float] = {}
+
+        def send(names):
+            for name in names:
+                self.link.mav.send(dialect.MAVLink_param_set_message(target_system=self.link.target_system,
+                                                                     target_component=self.link.target_component,
+                                                                     param_id=name.encode("utf-8"),
+                                                                     param_value=pending[name],
+                                                                     param_type=self.types.get(name, dialect.MAV_PARAM_TYPE_REAL32)))
+
+        with self.link.subscribe(PARAM_VALUE) as subscription:
+            send(list(pending))
+            attempt = 0
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while pending:
+                try:
+                    message = await subscription.get(max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    attempt += 1
+                    if attempt > retries:
+                        break
+                    send(list(pending))
+                    deadline = loop.time() + timeout
+                    continue
+
+                name = message.param_id
+                if name in pending:
+                    echoed[name] = message.param_value
+                    if message.param_value == pending[name]:
+                        del pending[name]
+
+        if pending:
+            details = ", ".join(f"{name} (vehicle reports {echoed[name]})" if name in echoed else name for name in pending)
+            raise ParamError(f"Parameters not confirmed by {self.link.drone_id}: {details}")
+        return {name: echoed[name] for name in values}
+
+    def status(self) -> Dict:
+        return {
+            "count": self.count,
+            "received": len(self.names),
+            "complete": self.complete,
+            "synced_at": self.synced_at,
+            "syncing": self._sync_task is not None and not self._sync_task.done(),
+            "last_error": self.last_error
+        }
+
+
+class ParamManager:
+    """One ParamTable per drone, resynced every time its link (re)connects."""
+
+    def __init__(self):
+        self.tables: Dict[str, ParamTable] = {}
+
+    def table(self, link: DroneLink) -> ParamTable:
+        table = self.tables.get(link.drone_id)
+        if table is None:
+            table = self.tables[link.drone_id] = ParamTable(link)
+        return table
+
+    def on_connect(self, link: DroneLink):
+        self.table(link).start_sync()
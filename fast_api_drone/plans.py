@@ -0,0 +1,127 @@
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+import pymavlink.dialects.v20.all as dialect
+
+from config import AppConfig
+from link import DroneLink
+from mission import build_fence_items, build_mission_items
+
+
+class CompiledPlan:
+    """A mission, fence or rally set encoded into ready-to-write MAVLink frames.
+
+    ``frames[i]`` is the item/point message for index ``i``; for the legacy
+    fence and rally protocols ``fetch_frames[i]`` is the matching read-back
+    request. ``points`` keeps the scaled values the vehicle should echo back.
+    """
+
+    def __init__(self, kind: str, name: str, version: int, frames: List[bytes],
+                 fetch_frames: List[bytes] = (), points: List[Tuple] = ()):
+        self.kind = kind
+        self.name = name
+        self.version = version
+        self.frames = tuple(frames)
+        self.fetch_frames = tuple(fetch_frames)
+        self.points = tuple(points)
+
+    @property
+    def count(self) -> int:
+        return len(self.frames)
+
+
+class PlanCache:
+    """Compiles named plans once per config version and target vehicle.
+
+    The key is (kind, name, config version, target system, target component,
+    sender ids), so every drone in a swarm-wide upload after the first reuses
+    the frames compiled for its system ID, and an edited config.yaml gets a
+    new version and is recompiled. Entries from older versions are evicted as
+    soon as a newer version is compiled.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._plans: "OrderedDict[Tuple, CompiledPlan]" = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, kind: str, name: str, config: AppConfig, link: DroneLink,
+             build: Callable[[dialect.MAVLink], CompiledPlan]) -> CompiledPlan:
+        mav = link.mav
+        if mav.signing.sign_outgoing:
+            # Signed frames carry a timestamp and cannot be replayed from a cache
+            return build(mav)
+
+        if config.version > self._version:
+            self._version = config.version
+            for key in [key for key in self._plans if key[2] < config.version]:
+                del self._plans[key]
+
+        key = (kind, name, config.version, link.target_system, link.target_component, mav.srcSystem, mav.srcComponent)
+        plan = self._plans.get(key)
+        if plan is not None:
+            self.hits += 1
+            self._plans.move_to_end(key)
+            return plan
+
+        self.misses += 1
+        # A private encoder so compiling never touches the link's sequence numbers
+        plan = build(dialect.MAVLink(None, srcSystem=mav.srcSystem, srcComponent=mav.srcComponent))
+        self._plans[key] = plan
+        while len(self._plans) > self.max_entries:
+            self._plans.popitem(last=False)
+        return plan
+
+    def mission(self, config: AppConfig, mission_name: str, link: DroneLink) -> CompiledPlan:
+        def build(encoder: dialect.MAVLink) -> CompiledPlan:
+            items = build_mission_items(link.target_system, link.target_component, config.waypoints[mission_name])
+            return CompiledPlan("mission", mission_name, config.version, [item.pack(encoder) for item in items])
+        return self._get("mission", mission_name, config, link, build)
+
+    def fence_mission(self, config: AppConfig, link: DroneLink) -> CompiledPlan:
+        def build(encoder: dialect.MAVLink) -> CompiledPlan:
+            items = build_fence_items(link.target_system, link.target_component, config.fence)
+            return CompiledPlan("fence_mission", "fence", config.version, [item.pack(encoder) for item in items])
+        return self._get("fence_mission", "fence", config, link, build)
+
+    def fence(self, config: AppConfig, link: DroneLink) -> CompiledPlan:
+        def build(encoder: dialect.MAVLink) -> CompiledPlan:
+            coordinates = config.fence.coordinates
+            frames, fetch_frames = [], []
+            for idx, (latitude, longitude) in enumerate(coordinates):
+                frames.append(dialect.MAVLink_fence_point_message(target_system=link.target_system,
+                                                                  target_component=link.target_component,
+                                                                  idx=idx,
+                                                                  count=len(coordinates),
+                                                                  lat=latitude,
+                                                                  lng=longitude).pack(encoder))
+                fetch_frames.append(dialect.MAVLink_fence_fetch_point_message(target_system=link.target_system,
+                                                                              target_component=link.target_component,
+                                                                              idx=idx).pack(encoder))
+            return CompiledPlan("fence", "fence", config.version, frames, fetch_frames, coordinates)
+        return self._get("fence", "fence", config, link, build)
+
+    def rally(self, config: AppConfig, link: DroneLink) -> CompiledPlan:
+        def build(encoder: dialect.MAVLink) -> CompiledPlan:
+            coordinates = config.rally.coordinates
+            frames, fetch_frames, points = [], [], []
+            for idx, (latitude, longitude, altitude) in enumerate(coordinates):
+                point = (int(latitude * 1e7), int(longitude * 1e7), int(altitude))
+                points.append(point)
+                frames.append(dialect.MAVLink_rally_point_message(target_system=link.target_system,
+                                                                  target_component=link.target_component,
+                                                                  idx=idx,
+                                                                  count=len(coordinates),
+                                                                  lat=point[0],
+                                                                  lng=point[1],
+                                                                  alt=point[2],
+                                                                  break_alt=0,
+                                                                  land_dir=0,
+                                                                  flags=0).pack(encoder))
+                fetch_frames.append(dialect.MAVLink_rally_fetch_point_message(target_system=link.target_system,
+                                                                              target_component=link.target_component,
+                                                                              idx=idx).pack(encoder))
+            return CompiledPlan("rally", "rally", config.version, frames, fetch_frames, points)
+        return self._get("rally", "rally", config, link, build)
@@ -0,0 +1,184 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from pymavlink import mavutil
+
+from link import DroneLink
+from transport import MavlinkConnection, open_connection, parse_connection_string
+
+
+class PoolEntry:
+    """Connection state the pool keeps for one configured drone."""
+
+    def __init__(self, drone_id: str, connection_string: str, system_id: Optional[int]):
+        self.drone_id = drone_id
+        self.connection_string = connection_string
+        self.system_id = system_id
+        self.status = "disconnected"  # connecting, connected, lost, reconnecting, failed
+        self.last_error: Optional[str] = None
+        self.connected_at: Optional[float] = None
+        self.reconnects = 0
+        self.next_retry: Optional[float] = None
+        self.reconnect_task: Optional[asyncio.Task] = None
+
+
+class ConnectionPool:
+    """Opens drone links without blocking the event loop and keeps them alive.
+
+    TCP, UDP and (with pyserial-asyncio) serial links are opened as asyncio
+    connections, so connecting uses no threads and a whole swarm connects in
+    parallel; other connection strings are opened by mavutil in a worker
+    thread. Either way the connect waits for a heartbeat with a timeout. A monitor
+    task marks links whose heartbeat has gone stale as lost and reconnects TCP
+    links in the background with exponential backoff. The ``DroneLink`` object
+    survives a reconnect, so code holding it keeps working once the link is back.
+    """
+
+    def __init__(self, heartbeat_timeout: float = 10.0, link_timeout: float = 5.0,
+                 backoff_initial: float = 1.0, backoff_max: float = 30.0):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.link_timeout = link_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+
+        self.links: Dict[str, DroneLink] = {}
+        self.entries: Dict[str, PoolEntry] = {}
+        # Called with the link after every connect and reconnect
+        self.connect_hooks: List[Callable[[DroneLink], None]] = []
+        self._monitor: Optional[asyncio.Task] = None
+
+    def _open(self, connection_string: str) -> mavutil.mavfile:
+        """Blocking connect + heartbeat wait; runs in a worker thread."""
+        # Fail fast on TCP connect; the pool does its own retrying with backoff
+        master = mavutil.mavlink_connection(connection_string, retries=1)
+        if master.wait_heartbeat(timeout=self.heartbeat_timeout) is None:
+            master.close()
+            raise TimeoutError(f"No heartbeat from {connection_string} within {self.heartbeat_timeout} seconds")
+        return master
+
+    async def _open_checked(self, entry: PoolEntry) -> Union[MavlinkConnection, mavutil.mavfile]:
+        if parse_connection_string(entry.connection_string) is not None:
+            master = await open_connection(entry.connection_string, self.heartbeat_timeout)
+        else:
+            master = await asyncio.wait_for(asyncio.to_thread(self._open, entry.connection_string),
+                                            self.heartbeat_timeout + 10.0)
+        if entry.system_id is not None and master.target_system != entry.system_id:
+            master.close()
+            raise PermissionError("Unauthorized system ID for this drone")
+        return master
+
+    async def connect(self, drone_id: str, connection_string: str, system_id: Optional[int] = None) -> DroneLink:
+        """Connect one drone, or return its link if it is already connected."""
+        if drone_id in self.links:
+            return self.links[drone_id]
+
+        entry = self.entries.get(drone_id)
+        if entry is None or entry.connection_string != connection_string:
+            entry = self.entries[drone_id] = PoolEntry(drone_id, connection_string, system_id)
+        entry.status = "connecting"
+
+        try:
+            master = await self._open_checked(entry)
+        except Exception as e:
+            entry.status = "failed"
+            entry.last_error = str(e) or type(e).__name__
+            raise
+
+        # Another request may have connected the same drone while we waited
+        if drone_id in self.links:
+            master.close()
+            return self.links[drone_id]
+
+        link = DroneLink(drone_id, master)
+        link.start()
+        self.links[drone_id] = link
+        entry.status = "connected"
+        entry.last_error = None
+        entry.connected_at = time.time()
+        self._run_connect_hooks(link)
+        return link
+
+    def _run_connect_hooks(self, link: DroneLink):
+        for hook in self.connect_hooks:
+            try:
+                hook(link)
+            except Exception as e:
+                print(f"Connect hook failed for {link.drone_id}: {e}")
+
+    def start(self, interval: float = 1.0):
+        """Start the link health monitor (call from a running event loop)."""
+        if self._monitor is None:
+            self._monitor = asyncio.get_running_loop().create_task(self._monitor_loop(interval))
+
+    async def _monitor_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            for drone_id, link in list(self.links.items()):
+                entry = self.entries[drone_id]
+                if entry.status not in ("connected", "lost"):
+                    continue
+                heartbeat_age = link.age("HEARTBEAT")
+                if link.reader_alive and heartbeat_age is not None and heartbeat_age <= self.link_timeout:
+                    entry.status = "connected"
+                    continue
+
+                entry.status = "lost"
+                if entry.connection_string.startswith("tcp:") and entry.reconnect_task is None:
+                    entry.reconnect_task = asyncio.get_running_loop().create_task(self._reconnect(entry, link))
+
+    async def _reconnect(self, entry: PoolEntry, link: DroneLink):
+        delay = self.backoff_initial
+        entry.status = "reconnecting"
+        await link.close()
+        try:
+            while True:
+                try:
+                    master = await self._open_checked(entry)
+                except Exception as e:
+                    entry.last_error = str(e) or type(e).__name__
+                    entry.next_retry = time.time() + delay
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.backoff_max)
+                    continue
+
+                link.attach(master)
+                link.start()
+                entry.status = "connected"
+                entry.reconnects += 1
+                entry.connected_at = time.time()
+                entry.next_retry = None
+                entry.last_error = None
+                print(f"Reconnected {entry.drone_id} after link loss")
+                self._run_connect_hooks(link)
+                return
+        finally:
+            entry.reconnect_task = None
+
+    def status(self) -> Dict[str, Dict]:
+        """Snapshot of every drone the pool knows about."""
+        now = time.time()
+        snapshot = {}
+        for drone_id, entry in self.entries.items():
+            link = self.links.get(drone_id)
+            heartbeat_age = link.age("HEARTBEAT") if link else None
+            snapshot[drone_id] = {
+                "status": entry.status,
+                "connection_string": entry.connection_string,
+                "heartbeat_age": round(heartbeat_age, 3) if heartbeat_age is not None else None,
+                "connected_for": round(now - entry.connected_at, 1) if entry.connected_at and entry.status == "connected" else None,
+                "reconnects": entry.reconnects,
+                "next_retry_in": round(max(0.0, entry.next_retry - now), 1) if entry.next_retry else None,
+                "last_error": entry.last_error
+            }
+        return snapshot
+
+    async def close(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for entry in self.entries.values():
+            if entry.reconnect_task is not None:
+                entry.reconnect_task.cancel()
+        await asyncio.gather(*(link.close() for link in self.links.values()))
+        self.links.clear()
@@ -0,0 +1,337 @@
+import asyncio
+import cProfile
+import functools
+import heapq
+import itertools
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from config import AppConfig
+
+PROFILE_HEADER = "x-profile"
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_stack(frame) -> List[str]:
+    """Function labels of a thread's stack, outermost first."""
+    stack = []
+    while frame is not None:
+        stack.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def await_stack(coro) -> List[str]:
+    """Function labels of a suspended coroutine and the coroutines it is awaiting, outermost first."""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(frame_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+def releasing_tasks(loop: asyncio.AbstractEventLoop) -> Dict[int, asyncio.Task]:
+    """Tasks that complete another future when they finish (``asyncio.wait_for``), by that future's id."""
+    tasks = {}
+    for task in asyncio.all_tasks(loop):
+        for callback, _ in getattr(task, "_callbacks", None) or ():
+            if isinstance(callback, functools.partial) and callback.args and asyncio.isfuture(callback.args[0]):
+                tasks[id(callback.args[0])] = task
+    return tasks
+
+
+def task_stacks(task: asyncio.Task, loop_frame, releasing: Callable[[], Dict[int, asyncio.Task]],
+                depth: int = 0) -> List[List[str]]:
+    """Where a task is: one stack, or one per child task it is waiting on.
+
+    A running task's stack is the event-loop thread's stack from the task's
+    own coroutine down. A suspended task's stack is its await chain ending
+    in the future it waits on. When that future is an ``asyncio.gather``
+    (e.g. fan_out) or the waiter of an ``asyncio.wait_for``, the stacks of
+    the tasks doing the work are followed instead.
+    """
+    coro = task.get_coro()
+    if coro.cr_running:
+        stack = thread_stack(loop_frame)
+        label = frame_label(coro.cr_code)
+        return [stack[stack.index(label):] if label in stack else stack]
+
+    stack = await_stack(coro)
+    waiter = getattr(task, "_fut_waiter", None)
+    children = [child for child in getattr(waiter, "_children", None) or ()
+                if isinstance(child, asyncio.Task) and not child.done()]
+    if not children and waiter is not None and id(waiter) in releasing():
+        children = [releasing()[id(waiter)]]
+    if children and depth < 8:
+        return [stack + child_stack for child in children
+                for child_stack in task_stacks(child, loop_frame, releasing, depth + 1)]
+    if waiter is not None:
+        stack.append(f"<awaiting {type(waiter).__name__}>")
+    return [stack]
+
+
+class StackSampler:
+    """Samples where one request task is, every ``interval`` seconds, from a background thread.
+
+    Each sample is the task's stack (see ``task_stacks``); a task gathering
+    several children contributes one sample per child. Counts of identical
+    stacks are the collapsed-stack (flamegraph) format and cover wall time,
+    including sleeps and waits for vehicle replies that cProfile does not see.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float = 0.005):
+        self.task = task
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            cache = []
+
+            def releasing():
+                # Built at most once per sample, and only if a wait_for is reached
+                if not cache:
+                    cache.append(releasing_tasks(self._loop))
+                return cache[0]
+
+            try:
+                stacks = task_stacks(self.task, sys._current_frames().get(self._loop_thread), releasing)
+            except Exception:
+                continue  # A task changed state while being walked; skip this sample
+            for stack in stacks:
+                if stack:
+                    key = ";".join(stack)
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+class Trace:
+    """One profiled request."""
+
+    def __init__(self, trace_id: int, method: str, route: str, status: int, started: float, duration: float,
+                 stacks: Dict[str, int], interval: float, stats: Optional[pstats.Stats]):
+        self.trace_id = trace_id
+        self.method = method
+        self.route = route
+        self.status = status
+        self.started = started
+        self.duration = duration
+        self.stacks = stacks
+        self.interval = interval
+        self.stats = stats
+        self.files: List[str] = []
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed-stack format, one ``frame;frame;... count`` line per stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def speedscope(self) -> Dict:
+        """The samples as a speedscope "sampled" profile (https://www.speedscope.app)."""
+        frames: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            samples.append([frames.setdefault(name, len(frames)) for name in stack.split(";")])
+            weights.append(round(count * self.interval, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.method} {self.route}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": samples,
+                "weights": weights
+            }],
+            "name": f"{self.method} {self.route} ({self.duration * 1000:.0f} ms)",
+            "exporter": "fast_api_drone"
+        }
+
+    def functions(self, limit: int = 25) -> List[Dict]:
+        """cProfile's most expensive functions by cumulative time."""
+        if self.stats is None:
+            return []
+        rows = []
+        for (filename, line, name), (_, calls, own, cumulative, _) in self.stats.stats.items():
+            rows.append({"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+                         "own_ms": round(own * 1000, 3), "cumulative_ms": round(cumulative * 1000, 3)})
+        rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+        return rows[:limit]
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.trace_id,
+            "method": self.method,
+            "route": self.route,
+            "status": self.status,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 2),
+            "samples": sum(self.stacks.values()),
+            "files": self.files
+        }
+
+
+class RequestProfiler:
+    """Opt-in profiling of sampled requests, kept only for the slowest.
+
+    With ``profiling_enabled`` set in the config, a ``profiling_sample_rate``
+    fraction of requests, and every request sent with an ``X-Profile: 1``
+    header, is profiled two ways at once: a stack sampler for wall time (see
+    ``StackSampler``) and cProfile for per-function call counts and CPU time.
+    cProfile sees everything the event-loop thread runs while the request is
+    in progress, including other requests' work, so only one request is
+    profiled at a time; requests that arrive meanwhile run unprofiled. The
+    slowest ``max_traces`` are kept and written to
+    ``<directory>/<route>/<id>.collapsed`` and ``.prof`` (pstats, for snakeviz).
+    """
+
+    def __init__(self, get_config: Callable[[], AppConfig], directory: str = "profiles", max_traces: int = 50,
+                 interval: float = 0.005):
+        self.get_config = get_config
+        self.directory = directory
+        self.max_traces = max_traces
+        self.interval = interval
+        self.traces: Dict[int, Trace] = {}
+        self.profiled = 0
+        self.skipped = 0
+        self._slowest: List = []  # Heap of (duration, id), fastest kept trace first
+        self._ids = itertools.count(1)
+        self._active = False
+
+    def wanted(self, scope) -> bool:
+        settings = self.get_config().settings
+        if not settings.profiling_enabled or scope["path"].startswith("/admin/"):
+            return False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER.encode() and value.strip() in (b"1", b"true"):
+                return True
+        return settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate
+
+    async def profile(self, app, scope, receive, send):
+        """Run the request under the profilers, or unprofiled if another request is being profiled."""
+        if self._active:
+            self.skipped += 1
+            await app(scope, receive, send)
+            return
+
+        self._active = True
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sampler = StackSampler(asyncio.current_task(), self.interval)
+        profile = cProfile.Profile()
+        started = time.time()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None  # Another profiler is active on this thread
+        try:
+            await app(scope, receive, send_with_status)
+        finally:
+            if profile is not None:
+                profile.disable()
+            duration = time.perf_counter() - start
+            stacks = sampler.stop()
+            self._active = False
+
+        route = getattr(scope.get("route"), "path", "unmatched")
+        stats = pstats.Stats(profile) if profile is not None and profile.getstats() else None
+        trace = Trace(next(self._ids), scope["method"], route, status, started, duration, stacks, self.interval, stats)
+        self.profiled += 1
+        if self._keep(trace):
+            await asyncio.to_thread(self._write, trace, profile)
+
+    def _keep(self, trace: Trace) -> bool:
+        if len(self._slowest) < self.max_traces:
+            heapq.heappush(self._slowest, (trace.duration, trace.trace_id))
+        elif trace.duration > self._slowest[0][0]:
+            _, evicted = heapq.heapreplace(self._slowest, (trace.duration, trace.trace_id))
+            self._remove(self.traces.pop(evicted))
+        else:
+            return False
+        self.traces[trace.trace_id] = trace
+        return True
+
+    def _write(self, trace: Trace, profile: Optional[cProfile.Profile]):
+        route = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{trace.method}{trace.route}").strip("_")
+        directory = os.path.join(self.directory, route)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{trace.trace_id}.collapsed")
+            with open(path, "w") as collapsed:
+                collapsed.write(trace.collapsed())
+            trace.files.append(path)
+            if profile is not None:
+                profile.dump_stats(os.path.join(directory, f"{trace.trace_id}.prof"))
+                trace.files.append(os.path.join(directory, f"{trace.trace_id}.prof"))
+        except OSError as e:
+            print(f"Failed to write profile {trace.trace_id}: {e}")
+
+    def _remove(self, trace: Trace):
+        for path in trace.files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def slowest(self, limit: int = 10, route: Optional[str] = None) -> List[Dict]:
+        traces = [trace for trace in self.traces.values() if route is None or trace.route == route]
+        traces.sort(key=lambda trace: trace.duration, reverse=True)
+        return [trace.summary() for trace in traces[:limit]]
+
+    def status(self) -> Dict:
+        settings = self.get_config().settings
+        return {
+            "enabled": settings.profiling_enabled,
+            "sample_rate": settings.profiling_sample_rate,
+            "profiled": self.profiled,
+            "skipped": self.skipped,
+            "kept": len(self.traces),
+            "directory": os.path.abspath(self.directory)
+        }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware handing the requests the profiler wants to it; others pass straight through."""
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        await self.profiler.profile(self.app, scope, receive, send)
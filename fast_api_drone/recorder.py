@@ -0,0 +1,338 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+from link import DroneLink
+
+# Every tlog record is the receive time in microseconds since the epoch, big-endian, then the raw frame
+TIMESTAMP = struct.Struct(">Q")
+
+
+def frame_length(buffer, offset: int) -> int:
+    """Length of the MAVLink frame starting at ``offset``, or 0 if no frame starts there."""
+    magic = buffer[offset]
+    if magic == dialect.PROTOCOL_MARKER_V2:
+        # 10 byte header, payload, 2 byte checksum, optional signature
+        length = 12 + buffer[offset + 1]
+        if buffer[offset + 2] & dialect.MAVLINK_IFLAG_SIGNED:
+            length += dialect.MAVLINK_SIGNATURE_BLOCK_LEN
+        return length
+    if magic == dialect.PROTOCOL_MARKER_V1:
+        return 8 + buffer[offset + 1]
+    return 0
+
+
+def frame_msgid(buffer, offset: int) -> int:
+    """Message id from the header of the frame starting at ``offset``."""
+    if buffer[offset] == dialect.PROTOCOL_MARKER_V2:
+        return buffer[offset + 7] | buffer[offset + 8] << 8 | buffer[offset + 9] << 16
+    return buffer[offset + 5]
+
+
+def recording_drone_id(name: str) -> str:
+    """Drone id from a recording's file name, ``<drone_id>-<date>-<time>.tlog``."""
+    parts = name.rsplit("-", 2)
+    return parts[0] if len(parts) == 3 else name[:-len(".tlog")] if name.endswith(".tlog") else name
+
+
+class TlogFile:
+    """The tlog a drone is currently being recorded to."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = open(path, "ab")
+        self.size = self.handle.tell()
+
+    def write(self, data: bytes):
+        self.handle.write(data)
+        self.handle.flush()
+        self.size += len(data)
+
+    def close(self):
+        self.handle.close()
+
+
+class FlightRecorder:
+    """Records every MAVLink frame received from every drone to rotating .tlog files.
+
+    The reader threads only append (drone_id, timestamp, frame) to a queue; a
+    single writer thread drains it every ``flush_interval`` seconds and writes
+    each drone's frames with one call per file, so recording never blocks the
+    event loop or a reader on disk I/O. Files are the standard telemetry log
+    format (8-byte big-endian microsecond timestamp before each raw frame), one
+    per drone, named ``<drone_id>-<start time>.tlog``. A file is rotated once
+    it would exceed ``max_bytes`` and only the newest ``max_files`` are kept
+    per drone. If the disk falls behind by more than ``max_pending`` frames,
+    new frames are dropped and counted rather than queued without bound.
+    """
+
+    def __init__(self, directory: str = "recordings", max_bytes: int = 64 * 1024 * 1024, max_files: int = 20,
+                 flush_interval: float = 0.5, max_pending: int = 200000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self._pending: deque = deque()
+        self._files: Dict[str, TlogFile] = {}
+        self._tracked = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def track(self, link: DroneLink):
+        """Record every frame received on this link (call once per link)."""
+        if link.drone_id in self._tracked:
+            return
+        self._tracked.add(link.drone_id)
+        drone_id = link.drone_id
+        link.add_frame_listener(lambda received, message: self.record(drone_id, received, message.get_msgbuf()))
+
+    def record(self, drone_id: str, received: float, frame: bytes):
+        if self._thread is None:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((drone_id, int(received * 1e6), frame))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="flight-recorder", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+        for tlog in self._files.values():
+            tlog.close()
+        self._files.clear()
+
+    def _flush(self):
+        pending = self._pending
+        batches: Dict[str, List[bytes]] = {}
+        # Only drain what is queued now; readers keep appending concurrently
+        for _ in range(len(pending)):
+            drone_id, timestamp, frame = pending.popleft()
+            parts = batches.get(drone_id)
+            if parts is None:
+                parts = batches[drone_id] = []
+            parts.append(TIMESTAMP.pack(timestamp))
+            parts.append(frame)
+
+        for drone_id, parts in batches.items():
+            data = b"".join(parts)
+            try:
+                self._file_for(drone_id, len(data)).write(data)
+                self.frames_written += len(parts) // 2
+                self.bytes_written += len(data)
+            except OSError as e:
+                self.last_error = f"{drone_id}: {e}"
+                print(f"Failed to write recording for {drone_id}: {e}")
+
+    def _file_for(self, drone_id: str, incoming: int) -> TlogFile:
+        tlog = self._files.get(drone_id)
+        if tlog is not None and 0 < tlog.size and tlog.size + incoming > self.max_bytes:
+            tlog.close()
+            tlog = None
+        if tlog is None:
+            now = time.time()
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}"
+            path = os.path.join(self.directory, f"{drone_id}-{stamp}.tlog")
+            tlog = self._files[drone_id] = TlogFile(path)
+            self._prune(drone_id)
+        return tlog
+
+    def _prune(self, drone_id: str):
+        names = [recording["name"] for recording in self.recordings(drone_id)]
+        for name in names[:-self.max_files] if len(names) > self.max_files else ():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                print(f"Failed to remove old recording {name}: {e}")
+
+    def recordings(self, drone_id: Optional[str] = None) -> List[Dict]:
+        """Recorded files, oldest first, optionally for one drone."""
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(".tlog"))
+        except FileNotFoundError:
+            return []
+        result = []
+        for name in names:
+            owner = recording_drone_id(name)
+            if drone_id is not None and owner != drone_id:
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            result.append({"name": name, "drone_id": owner, "size": stat.st_size, "modified": stat.st_mtime})
+        return result
+
+    def path(self, name: str) -> Optional[str]:
+        """Full path of a recording by file name, or None if there is no such recording."""
+        if os.path.basename(name) != name or not name.endswith(".tlog"):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def status(self) -> Dict:
+        return {
+            "recording": self.running,
+            "directory": os.path.abspath(self.directory),
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "frames_written": self.frames_written,
+            "bytes_written": self.bytes_written,
+            "last_error": self.last_error,
+            "files": {drone_id: {"name": os.path.basename(tlog.path), "size": tlog.size}
+                      for drone_id, tlog in list(self._files.items())}
+        }
+
+    def close(self):
+        """Write out everything queued and close the files."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+        self._thread = None
+
+
+class TlogReader:
+    """Memory-mapped reader for .tlog files.
+
+    ``frames()`` yields each record's timestamp and a memoryview of its raw
+    frame straight from the map, so iterating a large log copies nothing and
+    only touches the pages it reads. The views are only valid until the
+    reader is closed; use it as a context manager and copy (``bytes(frame)``)
+    anything that must outlive it. A record cut short at the end of the file
+    (e.g. by a crash while writing) ends iteration.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b"")
+        self.truncated_at: Optional[int] = None
+
+    def raw_frames(self) -> Iterator[Tuple[int, memoryview]]:
+        """(receive time in microseconds since the epoch, raw frame) for every record."""
+        view = self._view
+        size = len(view)
+        offset = 0
+        self.truncated_at = None
+        while offset < size:
+            start = offset + TIMESTAMP.size
+            # Timestamp plus magic, length and flags bytes are needed to size the frame
+            length = frame_length(view, start) if start + 3 <= size else 0
+            if length == 0 or start + length > size:
+                self.truncated_at = offset
+                return
+            yield TIMESTAMP.unpack_from(view, offset)[0], view[start:start + length]
+            offset = start + length
+
+    def frame_offsets(self, chunk: int = 65536) -> Iterator[np.ndarray]:
+        """File offsets of the frames (each just after its timestamp), ``chunk`` at a time.
+
+        Together with ``as_array()`` this lets callers decode whole batches of
+        frames with NumPy instead of one at a time.
+        """
+        view = self._view
+        size = len(view)
+        offset = 0
+        offsets = array("q")
+        self.truncated_at = None
+        while offset < size:
+            start = offset + TIMESTAMP.size
+            length = frame_length(view, start) if start + 3 <= size else 0
+            if length == 0 or start + length > size:
+                self.truncated_at = offset
+                break
+            offsets.append(start)
+            if len(offsets) == chunk:
+                yield np.frombuffer(offsets, dtype=np.int64)
+                offsets = array("q")
+            offset = start + length
+        if offsets:
+            yield np.frombuffer(offsets, dtype=np.int64)
+
+    def as_array(self) -> np.ndarray:
+        """The whole file as a uint8 array over the map (no copy)."""
+        return np.frombuffer(self._view, dtype=np.uint8)
+
+    def frames(self, msg_ids: Optional[set] = None) -> Iterator[Tuple[float, memoryview]]:
+        """(receive time in seconds, raw frame) for every record, optionally only the given message ids."""
+        for timestamp, frame in self.raw_frames():
+            if msg_ids is None or frame_msgid(frame, 0) in msg_ids:
+                yield timestamp / 1e6, frame
+
+    def messages(self, types: Optional[List[str]] = None) -> Iterator[Tuple[float, dialect.MAVLink_message]]:
+        """Decoded messages, optionally only of the given types.
+
+        Filtering happens on the frame header, so unwanted messages are never decoded.
+        """
+        msg_ids = None
+        if types:
+            msg_ids = {msg_id for msg_id, cls in dialect.mavlink_map.items() if cls.msgname in types}
+        parser = dialect.MAVLink(None)
+        parser.robust_parsing = True
+        for timestamp, frame in self.frames(msg_ids):
+            try:
+                yield timestamp, parser.decode(bytearray(frame))
+            except dialect.MAVError:
+                continue
+
+    def summary(self) -> Dict:
+        """Record count, time span and message counts by type."""
+        counts: Dict[int, int] = {}
+        first = last = None
+        for timestamp, frame in self.frames():
+            msg_id = frame_msgid(frame, 0)
+            counts[msg_id] = counts.get(msg_id, 0) + 1
+            if first is None:
+                first = timestamp
+            last = timestamp
+        names = {msg_id: dialect.mavlink_map[msg_id].msgname if msg_id in dialect.mavlink_map else f"UNKNOWN_{msg_id}"
+                 for msg_id in counts}
+        return {
+            "frames": sum(counts.values()),
+            "start": first,
+            "end": last,
+            "duration": round(last - first, 3) if first is not None else 0.0,
+            "truncated": self.truncated_at is not None,
+            "messages": {names[msg_id]: count for msg_id, count in sorted(counts.items(), key=lambda item: -item[1])}
+        }
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # Frames still referenced by the caller; the map is freed with the last of them
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
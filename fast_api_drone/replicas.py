@@ -0,0 +1,247 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import pymavlink.dialects.v20.all as dialect
+import uvicorn
+
+from link import DroneLink
+from snapshot import TelemetryTable
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds without an owner heartbeat before readers report the table as stale
+OWNER_TIMEOUT = 5.0
+
+# Hop-by-hop headers, which apply to one connection and are not forwarded
+HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade", b"te", b"trailer",
+               b"proxy-authorization", b"proxy-authenticate"}
+
+
+class Ownership:
+    """Which of several uvicorn workers sharing one config owns the drone links.
+
+    Every worker tries to take an exclusive lock on ``<tmp>/<name>.lock``
+    when it imports the app; the one that gets it is the owner and keeps
+    the lock for its lifetime. The owner also serves the app on the Unix
+    socket ``<tmp>/<name>.sock`` so the other workers can forward requests
+    to it. Without ``fcntl`` (Windows) every process is an owner.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        directory = tempfile.gettempdir()
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self.socket_path = os.path.join(directory, f"{name}.sock")
+        self._lock_file = None
+        self.owner = self._acquire()
+
+    def _acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+
+class TelemetryPublisher:
+    """Owner side: keeps the shared ``TelemetryTable`` current and serves the app to the other workers.
+
+    Rows are written from link listeners as position, battery and GPS
+    messages arrive, so the table is as fresh as the owner's own
+    ``latest()``. A heartbeat in the table header tells readers the owner
+    is alive.
+    """
+
+    def __init__(self, ownership: Ownership, capacity: int = 1024, heartbeat_interval: float = 1.0):
+        self.ownership = ownership
+        self.capacity = capacity
+        self.heartbeat_interval = heartbeat_interval
+        self.table: Optional[TelemetryTable] = None
+        self._slots: Dict[str, int] = {}
+        self._server: Optional[uvicorn.Server] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def open(self):
+        if self.table is None:
+            self.table = TelemetryTable.create(self.ownership.name, self.capacity)
+
+    def track(self, link: DroneLink):
+        """Publish this link's telemetry (call once per link)."""
+        if link.drone_id in self._slots:
+            return
+        self.open()
+        table = self.table
+        slot = self._slots[link.drone_id] = table.assign(link.drone_id)
+        updates = {
+            dialect.MAVLink_global_position_int_message.msgname: table.update_position,
+            dialect.MAVLink_battery_status_message.msgname: table.update_battery,
+            dialect.MAVLink_gps_raw_int_message.msgname: table.update_gps,
+        }
+        for msg_type, update in updates.items():
+            link.add_listener(msg_type, lambda message, update=update: update(slot, message, time.monotonic()))
+            # Messages that arrived before the listener was added
+            if link.latest(msg_type) is not None:
+                update(slot, link.latest(msg_type), time.monotonic() - link.age(msg_type))
+
+    async def start(self, app):
+        self.open()
+        loop = asyncio.get_running_loop()
+        config = uvicorn.Config(app, uds=self.ownership.socket_path, lifespan="off", log_level="warning")
+        self._server = uvicorn.Server(config)
+        # The worker's own server already handles signals; this one is stopped in close()
+        self._server.install_signal_handlers = lambda: None
+        self._tasks = [loop.create_task(self._server.serve()), loop.create_task(self._heartbeat())]
+        print(f"Owning the drone links; other workers forward to {self.ownership.socket_path}")
+
+    async def _heartbeat(self):
+        while True:
+            self.table.heartbeat(time.time())
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.should_exit = True
+        if self._tasks:
+            self._tasks[1].cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+        if self.table is not None:
+            self.table.close()
+            self.table = None
+
+
+class TelemetryReplica:
+    """Reader side: serves telemetry from the owner's table and forwards everything else to the owner.
+
+    The table is attached once the owner has created it, and re-attached if
+    the owner's heartbeat stops (a restarted owner creates a new segment
+    under the same name). Forwarded requests go over the owner's Unix
+    socket and the response is streamed back as it arrives.
+    """
+
+    def __init__(self, ownership: Ownership, request_timeout: float = 300.0):
+        self.ownership = ownership
+        self.table: Optional[TelemetryTable] = None
+        self._next_attach = 0.0
+        self._client = httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(uds=ownership.socket_path),
+                                         base_url="http://owner", timeout=request_timeout)
+
+    def _attached(self) -> TelemetryTable:
+        table = self.table
+        now = time.time()
+        if table is not None and now - table.published <= OWNER_TIMEOUT:
+            return table
+        if now >= self._next_attach:
+            self._next_attach = now + 1.0
+            try:
+                fresh = TelemetryTable.attach(self.ownership.name)
+            except (FileNotFoundError, ValueError):
+                fresh = None
+            if fresh is not None and now - fresh.published <= OWNER_TIMEOUT:
+                if table is not None:
+                    table.close()
+                table = self.table = fresh
+            elif fresh is not None:
+                fresh.close()
+        if table is None or now - table.published > OWNER_TIMEOUT:
+            raise RuntimeError("The link owner is not publishing telemetry")
+        return table
+
+    def entries(self) -> List[Dict]:
+        """Every drone's telemetry as ``telemetry_snapshot`` entries; raises RuntimeError without an owner."""
+        return self._attached().entries(time.monotonic())
+
+    def entry(self, drone_id: str) -> Optional[Dict]:
+        """One drone's entry, or None if the owner has not published it."""
+        return self._attached().entry(drone_id, time.monotonic())
+
+    async def forward(self, scope, receive, send):
+        """Send an HTTP request to the owner worker and stream its response back."""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        path = scope["raw_path"].decode() if scope.get("raw_path") else scope["path"]
+        if scope["query_string"]:
+            path += "?" + scope["query_string"].decode()
+        headers = [(name, value) for name, value in scope["headers"] if name.lower() not in HOP_HEADERS]
+        request = self._client.build_request(scope["method"], path, headers=headers, content=bytes(body))
+        try:
+            response = await self._client.send(request, stream=True)
+        except httpx.TransportError as e:
+            await send_error(send, 503, f"The link owner is not reachable: {e}")
+            return
+
+        async def relay():
+            await send({"type": "http.response.start", "status": response.status_code,
+                        "headers": [(name, value) for name, value in response.headers.raw
+                                    if name.lower() not in HOP_HEADERS]})
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        # Streams such as /stream/events never end on their own; stop relaying when the client goes
+        relaying = asyncio.ensure_future(relay())
+        watching = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait([relaying, watching], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watching.cancel()
+            relaying.cancel()
+            await response.aclose()
+        if relaying.done() and not relaying.cancelled() and relaying.exception() is not None:
+            print(f"Forwarding {scope['method']} {path} to the link owner failed: {relaying.exception()}")
+
+    async def close(self):
+        await self._client.aclose()
+        if self.table is not None:
+            self.table.close()
+            self.table = None
+
+
+async def send_error(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class OwnerProxyMiddleware:
+    """ASGI middleware for non-owner workers: requests for ``local_paths`` are served here, the rest by the owner.
+
+    A path ending in ``/`` matches every path under it.
+    """
+
+    def __init__(self, app, replica: TelemetryReplica, local_paths: Tuple[str, ...]):
+        self.app = app
+        self.replica = replica
+        self.exact = {path for path in local_paths if not path.endswith("/")}
+        self.prefixes = tuple(path for path in local_paths if path.endswith("/"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exact or scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        await self.replica.forward(scope, receive, send)
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+from config import AppConfig
+from events import EventBus
+from geo import local_xy
+from link import DroneLink
+
+# Cells checked around each cell; only "forward" neighbours, so every pair of cells is visited once
+NEIGHBOUR_OFFSETS = ((0, 0), (1, 0), (1, 1), (0, 1), (-1, 1))
+
+
+def candidate_pairs(x: np.ndarray, y: np.ndarray, cell_size: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Index pairs (i < j) of points in the same or adjacent grid cells.
+
+    Any two points closer than ``cell_size`` are always in adjacent cells, so
+    this finds every such pair while only comparing points that are near
+    each other: O(n + pairs) instead of O(n^2).
+    """
+    cells: Dict[Tuple[int, int], List[int]] = {}
+    for index, cell in enumerate(zip(np.floor(x / cell_size).astype(np.int64).tolist(),
+                                     np.floor(y / cell_size).astype(np.int64).tolist())):
+        cells.setdefault(cell, []).append(index)
+    members = {cell: np.array(indices, dtype=np.intp) for cell, indices in cells.items()}
+
+    first, second = [], []
+    for (cx, cy), here in members.items():
+        if len(here) > 1:
+            a, b = np.triu_indices(len(here), 1)
+            first.append(here[a])
+            second.append(here[b])
+        for dx, dy in NEIGHBOUR_OFFSETS[1:]:
+            there = members.get((cx + dx, cy + dy))
+            if there is not None:
+                first.append(np.repeat(here, len(there)))
+                second.append(np.tile(there, len(here)))
+
+    if not first:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    return np.minimum(first, second), np.maximum(first, second)
+
+
+class SeparationMonitor:
+    """Finds drone pairs that are, or are about to be, too close to each other.
+
+    Every ``interval`` the latest GLOBAL_POSITION_INT of each drone is
+    projected to local east/north/up metres and bucketed into a spatial hash
+    whose cells are as large as the distance two drones could close within
+    the look-ahead horizon. Only pairs in neighbouring cells are evaluated,
+    vectorised: their current distance and their closest point of approach
+    (CPA) assuming constant velocity. Pairs closer than ``separation_distance``
+    are conflicts; pairs whose CPA within ``separation_horizon`` seconds is
+    closer than that are predicted conflicts. Changes are published as
+    separation_conflict, separation_predicted and separation_clear events.
+    """
+
+    def __init__(self, links: Dict[str, DroneLink], get_config: Callable[[], AppConfig], events: EventBus,
+                 interval: float = 0.25, max_age: float = 5.0):
+        self.links = links
+        self.get_config = get_config
+        self.events = events
+        self.interval = interval
+        self.max_age = max_age
+        self.pairs: Dict[Tuple[str, str], Dict] = {}
+        self.drones_checked = 0
+        self.candidates_checked = 0
+        self.last_check: Optional[float] = None
+        self.last_elapsed = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Separation check failed: {e}")
+
+    def _positions(self):
+        drone_ids, rows = [], []
+        for drone_id, link in list(self.links.items()):
+            position = link.latest(dialect.MAVLink_global_position_int_message.msgname)
+            age = link.age(dialect.MAVLink_global_position_int_message.msgname)
+            if position is None or age is None or age > self.max_age or (position.lat == 0 and position.lon == 0):
+                continue
+            drone_ids.append(drone_id)
+            # lat, lon, alt (m), then velocity east/north/up (m/s)
+            rows.append((position.lat / 1e7, position.lon / 1e7, position.alt / 1000.0,
+                         position.vy / 100.0, position.vx / 100.0, -position.vz / 100.0))
+        return drone_ids, np.array(rows, dtype=float).reshape(-1, 6)
+
+    def check(self):
+        start = time.perf_counter()
+        settings = self.get_config().settings
+        distance_limit = settings.separation_distance
+        horizon = settings.separation_horizon
+
+        drone_ids, rows = self._positions()
+        self.drones_checked = len(drone_ids)
+        current: Dict[Tuple[str, str], Dict] = {}
+
+        if len(drone_ids) > 1:
+            x, y = local_xy(rows[:, 0], rows[:, 1], float(rows[:, 0].mean()), float(rows[:, 1].mean()))
+            positions = np.column_stack((x, y, rows[:, 2]))
+            velocities = rows[:, 3:6]
+
+            # Two drones can close at most twice the top speed times the horizon
+            top_speed = float(np.linalg.norm(velocities, axis=1).max())
+            i, j = candidate_pairs(x, y, max(distance_limit + 2 * top_speed * horizon, 1.0))
+            self.candidates_checked = len(i)
+
+            if len(i):
+                relative_position = positions[j] - positions[i]
+                relative_velocity = velocities[j] - velocities[i]
+                distance = np.linalg.norm(relative_position, axis=1)
+
+                speed_squared = np.einsum("ij,ij->i", relative_velocity, relative_velocity)
+                closing = -np.einsum("ij,ij->i", relative_position, relative_velocity)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    time_to_cpa = np.where(speed_squared > 1e-9, closing / speed_squared, 0.0)
+                time_to_cpa = np.clip(time_to_cpa, 0.0, horizon)
+                cpa_distance = np.linalg.norm(relative_position + relative_velocity * time_to_cpa[:, None], axis=1)
+
+                conflict = distance < distance_limit
+                predicted = ~conflict & (cpa_distance < distance_limit) & (time_to_cpa > 0)
+
+                for k in np.flatnonzero(conflict | predicted).tolist():
+                    pair = tuple(sorted((drone_ids[i[k]], drone_ids[j[k]])))
+                    current[pair] = {
+                        "drones": list(pair),
+                        "state": "conflict" if conflict[k] else "predicted",
+                        "distance": round(float(distance[k]), 1),
+                        "cpa_distance": round(float(cpa_distance[k]), 1),
+                        "time_to_cpa": round(float(time_to_cpa[k]), 1)
+                    }
+        else:
+            self.candidates_checked = 0
+
+        for pair, info in current.items():
+            previous = self.pairs.get(pair)
+            if previous is None or previous["state"] != info["state"]:
+                event_type = "separation_conflict" if info["state"] == "conflict" else "separation_predicted"
+                self.events.publish(event_type, **{key: value for key, value in info.items() if key != "state"})
+        for pair in self.pairs.keys() - current.keys():
+            self.events.publish("separation_clear", drones=list(pair))
+
+        self.pairs = current
+        self.last_check = time.time()
+        self.last_elapsed = time.perf_counter() - start
+
+    def status(self) -> Dict:
+        return {
+            "checked_at": self.last_check,
+            "elapsed_ms": round(self.last_elapsed * 1000, 2),
+            "drones_checked": self.drones_checked,
+            "pairs_checked": self.candidates_checked,
+            "conflicts": [info for info in self.pairs.values() if info["state"] == "conflict"],
+            "predicted": [info for info in self.pairs.values() if info["state"] == "predicted"]
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
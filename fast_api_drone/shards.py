@@ -0,0 +1,482 @@
+import asyncio
+import itertools
+import multiprocessing
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+from link import DroneLink
+from pool import ConnectionPool, PoolEntry
+from recorder import FlightRecorder
+from snapshot import SNAPSHOT_INDEX, SnapshotTable
+from transport import MavlinkConnection
+
+# Connect failures re-raised as the same type in the API process; anything else becomes a ConnectionError
+CONNECT_ERRORS = {"PermissionError": PermissionError, "TimeoutError": TimeoutError}
+
+
+def heartbeat_frame(link: DroneLink) -> Optional[bytes]:
+    heartbeat = link.master.messages.get(dialect.MAVLink_heartbeat_message.msgname)
+    return heartbeat.get_msgbuf() if heartbeat is not None else None
+
+
+class ShardWorker:
+    """Owns the links of one shard of the swarm, in a worker process.
+
+    A plain ``ConnectionPool`` connects, monitors and reconnects the links,
+    so each worker parses its own drones' streams on its own core. Every
+    message of a ``SNAPSHOT_TYPES`` type from the vehicle goes into the
+    drone's shared-memory slot; messages of types the API process has asked
+    for (``want``) are sent back as raw frames over the events queue. Frames
+    the API process writes arrive over the commands queue and go out on the
+    real connection. With recording enabled the worker records its own drones.
+    """
+
+    def __init__(self, index: int, table: SnapshotTable, commands, events, recording_directory: Optional[str],
+                 status_interval: float = 1.0):
+        self.index = index
+        self.table = table
+        self.commands = commands
+        self.events = events
+        self.status_interval = status_interval
+        self.pool = ConnectionPool()
+        self.pool.connect_hooks.append(self._track)
+        self.recorder = FlightRecorder(recording_directory) if recording_directory else None
+        if self.recorder is not None:
+            self.pool.connect_hooks.append(self.recorder.track)
+
+        self.slots: Dict[str, int] = {}
+        # Message types forwarded to the API process, per drone
+        self.wanted: Dict[str, set] = {}
+        self._tracked = set()
+        self._outbox: List = []
+        self._outbox_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self.pool.start()
+        if self.recorder is not None:
+            self.recorder.start()
+        threading.Thread(target=self._read_commands, name=f"link-worker-{self.index}-commands", daemon=True).start()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), self.status_interval)
+                except asyncio.TimeoutError:
+                    self.emit(("status", self.index, self.status()))
+        finally:
+            await self.pool.close()
+            if self.recorder is not None:
+                await asyncio.to_thread(self.recorder.close)
+
+    def emit(self, event):
+        """Queue an event for the API process; events emitted in one loop iteration go as one batch.
+
+        Thread-safe, since frame listeners on mavutil links run on reader threads.
+        """
+        with self._outbox_lock:
+            self._outbox.append(event)
+            if len(self._outbox) > 1:
+                return
+        self._loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        with self._outbox_lock:
+            batch, self._outbox = self._outbox, []
+        if batch:
+            self.events.put(batch)
+
+    def _read_commands(self):
+        while True:
+            command = self.commands.get()
+            try:
+                self._loop.call_soon_threadsafe(self._handle, command)
+            except RuntimeError:
+                return  # Loop closed
+            if command[0] == "stop":
+                return
+
+    def _handle(self, command):
+        kind = command[0]
+        if kind == "write":
+            link = self.pool.links.get(command[1])
+            if link is not None:
+                try:
+                    link.write(command[2])
+                except Exception:
+                    pass  # Link down; the pool is already reconnecting it
+        elif kind == "want":
+            self.wanted.setdefault(command[1], set()).update(command[2])
+        elif kind == "connect":
+            _, request_id, drone_id, connection_string, system_id, slot = command
+            self.slots[drone_id] = slot
+            self._loop.create_task(self._connect(request_id, drone_id, connection_string, system_id))
+        elif kind == "stop":
+            self._stopped.set()
+
+    async def _connect(self, request_id: int, drone_id: str, connection_string: str, system_id: Optional[int]):
+        try:
+            link = await self.pool.connect(drone_id, connection_string, system_id)
+        except Exception as e:
+            self.emit(("failed", request_id, drone_id, type(e).__name__, str(e) or type(e).__name__))
+            return
+        self.emit(("connected", request_id, drone_id, link.target_system, link.target_component, heartbeat_frame(link)))
+
+    def _track(self, link: DroneLink):
+        """Connect hook: publish the link's messages (once per link), or announce a reconnect."""
+        drone_id = link.drone_id
+        if drone_id in self._tracked:
+            self.emit(("reconnected", drone_id, link.target_system, link.target_component, heartbeat_frame(link)))
+            return
+        self._tracked.add(drone_id)
+        slot = self.slots[drone_id]
+        self.table.assign(slot, drone_id, link.target_system, link.target_component)
+        table = self.table
+        wanted = self.wanted.setdefault(drone_id, set())
+        emit = self.emit
+
+        def publish(received: float, message: dialect.MAVLink_message):
+            index = SNAPSHOT_INDEX.get(message.get_msgId())
+            if index is not None and message.get_srcSystem() == link.target_system:
+                table.publish(slot, index, message.get_msgbuf(), received)
+            elif message.get_type() in wanted:
+                emit(("message", drone_id, message.get_msgbuf()))
+
+        link.add_frame_listener(publish)
+
+    def status(self) -> Dict[str, Dict]:
+        """The pool's status plus each link's counters, which the API process mirrors."""
+        status = self.pool.status()
+        for drone_id, link in self.pool.links.items():
+            stats = link.stats
+            status[drone_id].update(received=dict(stats.received), bad_data=stats.bad_data,
+                                    lost=stats.lost_before + getattr(link.master, "mav_loss", 0),
+                                    reader_alive=link.reader_alive)
+        return status
+
+
+def run_worker(index: int, table_name: str, commands, events, recording_directory: Optional[str],
+               status_interval: float):
+    """Worker process entry point."""
+    # Ctrl-C reaches the whole process group; the API process stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    table = SnapshotTable.attach(table_name)
+    try:
+        asyncio.run(ShardWorker(index, table, commands, events, recording_directory, status_interval).run())
+    finally:
+        table.close()
+
+
+class RemoteConnection(MavlinkConnection):
+    """Stand-in in the API process for a connection owned by a shard worker.
+
+    Frames written here, including everything ``mav`` encodes, are queued to
+    the worker, which sends them on the real connection. Messages come from
+    the ``ShardedPool``: snapshots polled from shared memory and the wanted
+    types the worker forwards. The ``DroneLink`` built on it works unchanged.
+    """
+
+    parses_stream = False
+
+    def __init__(self, pool: "ShardedPool", worker: int, drone_id: str, connection_string: str):
+        super().__init__(connection_string)
+        self.pool = pool
+        self.worker = worker
+        self.drone_id = drone_id
+        self._wanted = set()
+
+    def vehicle(self, target_system: int, target_component: int, heartbeat: Optional[dialect.MAVLink_message]):
+        """Identify the vehicle from the worker's connect or reconnect."""
+        self.target_system = target_system
+        self.target_component = target_component
+        if heartbeat is not None:
+            self.messages[heartbeat.get_type()] = heartbeat
+            self.mav_type = heartbeat.type
+            self.mav_autopilot = heartbeat.autopilot
+
+    def want(self, msg_types: List[str]):
+        # Sent on the same queue as writes, so the worker forwards replies to anything written afterwards
+        new = [name for name in msg_types if name not in self._wanted]
+        if new:
+            self._wanted.update(new)
+            self.pool.send(self.worker, ("want", self.drone_id, new))
+
+    def write(self, data: bytes):
+        if self.closed:
+            raise ConnectionError(f"{self.connection_string} is not connected")
+        self.pool.send(self.worker, ("write", self.drone_id, bytes(data)))
+
+    def deliver(self, message: dialect.MAVLink_message):
+        self.messages[message.get_type()] = message
+        if self.on_message is not None:
+            self.on_message(message)
+
+    def close(self):
+        self.closed = True
+
+
+class ShardedPool:
+    """Drop-in replacement for ``ConnectionPool`` that runs the links in worker processes.
+
+    Drones are assigned round-robin, in the order they are first connected,
+    to ``workers`` processes (``ShardWorker``), which open, parse, monitor and
+    reconnect them, so MAVLink parsing uses as many cores as there are
+    workers. The API process keeps a ``DroneLink`` per drone on a
+    ``RemoteConnection``: the latest ``SNAPSHOT_TYPES`` messages are read
+    from a shared-memory ``SnapshotTable`` every ``snapshot_interval``
+    seconds (only slots whose counts changed are decoded), and other types
+    are forwarded by the worker once a listener or subscription asks for
+    them, so latest(), listeners, subscriptions and requests behave as
+    before. Snapshot types reach listeners at most once per poll, which is
+    more often than vehicles stream telemetry. Link counters and connection
+    status are mirrored from the workers every ``status_interval`` seconds.
+    """
+
+    def __init__(self, workers: int, capacity: int = 1024, heartbeat_timeout: float = 10.0,
+                 snapshot_interval: float = 0.05, status_interval: float = 1.0,
+                 recording_directory: Optional[str] = None):
+        self.workers = workers
+        self.capacity = capacity
+        self.heartbeat_timeout = heartbeat_timeout
+        self.snapshot_interval = snapshot_interval
+        self.status_interval = status_interval
+        self.recording_directory = recording_directory
+
+        self.links: Dict[str, DroneLink] = {}
+        self.entries: Dict[str, PoolEntry] = {}
+        # Called with the link after every connect and reconnect
+        self.connect_hooks: List[Callable[[DroneLink], None]] = []
+        self.table: Optional[SnapshotTable] = None
+
+        self._slots: Dict[str, int] = {}
+        self._connections: Dict[int, RemoteConnection] = {}
+        self._requests: Dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count(1)
+        self._parser = dialect.MAVLink(None)
+        self._processes: List[multiprocessing.Process] = []
+        self._commands: List = []
+        self._events = None
+        self._seen: Optional[np.ndarray] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, interval: float = 1.0):
+        """Start the worker processes and the snapshot poller (call from a running event loop).
+
+        ``interval`` is accepted for ``ConnectionPool`` compatibility; the
+        workers monitor their own links.
+        """
+        if self._processes:
+            return
+        self._loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        self.table = SnapshotTable.create(self.capacity)
+        self._seen = np.zeros_like(self.table.counts)
+        self._events = context.Queue()
+        for index in range(self.workers):
+            commands = context.Queue()
+            process = context.Process(target=run_worker, name=f"link-worker-{index}", daemon=True,
+                                      args=(index, self.table.name, commands, self._events,
+                                            self.recording_directory, self.status_interval))
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+        threading.Thread(target=self._read_events, name="link-worker-events", daemon=True).start()
+        self._poller = self._loop.create_task(self._poll_snapshots())
+        print(f"Started {self.workers} link worker processes")
+
+    def send(self, worker: int, command):
+        self._commands[worker].put(command)
+
+    def _decode(self, frame: bytes) -> Optional[dialect.MAVLink_message]:
+        try:
+            return self._parser.decode(bytearray(frame))
+        except Exception:
+            return None
+
+    async def connect(self, drone_id: str, connection_string: str, system_id: Optional[int] = None) -> DroneLink:
+        """Connect one drone through its worker, or return its link if it is already connected."""
+        if drone_id in self.links:
+            return self.links[drone_id]
+        if self.table is None:
+            raise RuntimeError("Link workers are not running")
+
+        slot = self._slots.get(drone_id)
+        if slot is None:
+            if len(self._slots) >= self.capacity:
+                raise RuntimeError(f"No free snapshot slot; the table holds {self.capacity} drones")
+            slot = self._slots[drone_id] = len(self._slots)
+        worker = slot % self.workers
+
+        entry = self.entries.get(drone_id)
+        if entry is None or entry.connection_string != connection_string:
+            entry = self.entries[drone_id] = PoolEntry(drone_id, connection_string, system_id)
+        entry.status = "connecting"
+
+        request_id = next(self._request_ids)
+        reply = self._requests[request_id] = self._loop.create_future()
+        self.send(worker, ("connect", request_id, drone_id, connection_string, system_id, slot))
+        try:
+            _, _, _, target_system, target_component, heartbeat = await asyncio.wait_for(
+                reply, self.heartbeat_timeout + 10.0)
+        except Exception as e:
+            entry.status = "failed"
+            entry.last_error = str(e) or type(e).__name__
+            raise
+        finally:
+            self._requests.pop(request_id, None)
+
+        # Another request may have connected the same drone while we waited
+        if drone_id in self.links:
+            return self.links[drone_id]
+
+        connection = RemoteConnection(self, worker, drone_id, connection_string)
+        connection.vehicle(target_system, target_component, self._decode(heartbeat) if heartbeat else None)
+        link = DroneLink(drone_id, connection)
+        link.start()
+        self.links[drone_id] = link
+        self._connections[slot] = connection
+        entry.status = "connected"
+        entry.last_error = None
+        entry.connected_at = time.time()
+        self._run_connect_hooks(link)
+        return link
+
+    def _run_connect_hooks(self, link: DroneLink):
+        for hook in self.connect_hooks:
+            try:
+                hook(link)
+            except Exception as e:
+                print(f"Connect hook failed for {link.drone_id}: {e}")
+
+    def _read_events(self):
+        """Hand each batch of worker events to the event loop; runs on its own thread."""
+        while True:
+            batch = self._events.get()
+            if batch is None:
+                return
+            try:
+                self._loop.call_soon_threadsafe(self._handle_events, batch)
+            except RuntimeError:
+                return  # Loop closed
+
+    def _handle_events(self, batch: List):
+        for event in batch:
+            kind = event[0]
+            if kind == "message":
+                link = self.links.get(event[1])
+                message = self._decode(event[2])
+                if link is not None and message is not None:
+                    link.master.deliver(message)
+            elif kind in ("connected", "failed"):
+                reply = self._requests.get(event[1])
+                if reply is None or reply.done():
+                    continue
+                if kind == "connected":
+                    reply.set_result(event)
+                else:
+                    reply.set_exception(CONNECT_ERRORS.get(event[3], ConnectionError)(event[4]))
+            elif kind == "reconnected":
+                self._reconnected(*event[1:])
+            elif kind == "status":
+                self._mirror_status(event[2])
+
+    def _reconnected(self, drone_id: str, target_system: int, target_component: int, heartbeat: Optional[bytes]):
+        link = self.links.get(drone_id)
+        if link is None:
+            return
+        heartbeat = self._decode(heartbeat) if heartbeat else None
+        link.master.vehicle(target_system, target_component, heartbeat)
+        if heartbeat is not None:
+            link.master.deliver(heartbeat)
+        link.reader_alive = True
+        entry = self.entries[drone_id]
+        entry.status = "connected"
+        entry.reconnects += 1
+        entry.connected_at = time.time()
+        entry.next_retry = None
+        entry.last_error = None
+        self._run_connect_hooks(link)
+
+    def _mirror_status(self, status: Dict[str, Dict]):
+        now = time.time()
+        for drone_id, report in status.items():
+            entry = self.entries.get(drone_id)
+            link = self.links.get(drone_id)
+            if entry is None or link is None:
+                continue  # Not connected from here (yet); connect() keeps the entry current
+            entry.status = report["status"]
+            entry.last_error = report["last_error"]
+            entry.reconnects = report["reconnects"]
+            entry.next_retry = now + report["next_retry_in"] if report["next_retry_in"] is not None else None
+            if "received" in report:
+                link.reader_alive = report["reader_alive"]
+                link.stats.received = report["received"]
+                link.stats.bad_data = report["bad_data"]
+                link.stats.lost_before = report["lost"]
+            else:
+                link.reader_alive = False  # The worker's link is closed while it reconnects
+
+    async def _poll_snapshots(self):
+        table = self.table
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            for slot, index in table.changed(self._seen):
+                connection = self._connections.get(slot)
+                if connection is None:
+                    continue
+                frame = table.read(slot, index)
+                message = self._decode(frame) if frame else None
+                if message is not None:
+                    connection.deliver(message)
+
+    def status(self) -> Dict[str, Dict]:
+        """Snapshot of every drone the pool knows about, with the worker that owns its link."""
+        now = time.time()
+        snapshot = {}
+        for drone_id, entry in self.entries.items():
+            link = self.links.get(drone_id)
+            heartbeat_age = link.age("HEARTBEAT") if link else None
+            snapshot[drone_id] = {
+                "status": entry.status,
+                "connection_string": entry.connection_string,
+                "heartbeat_age": round(heartbeat_age, 3) if heartbeat_age is not None else None,
+                "connected_for": round(now - entry.connected_at, 1) if entry.connected_at and entry.status == "connected" else None,
+                "reconnects": entry.reconnects,
+                "next_retry_in": round(max(0.0, entry.next_retry - now), 1) if entry.next_retry else None,
+                "last_error": entry.last_error,
+                "worker": self._slots[drone_id] % self.workers
+            }
+        return snapshot
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        for commands in self._commands:
+            commands.put(("stop",))
+        await asyncio.gather(*(asyncio.to_thread(process.join, 10.0) for process in self._processes))
+        for process in self._processes:
+            if process.is_alive():
+                print(f"{process.name} did not stop, terminating it")
+                process.terminate()
+        self._processes.clear()
+        self._commands.clear()
+        if self._events is not None:
+            self._events.put(None)
+        for reply in self._requests.values():
+            if not reply.done():
+                reply.set_exception(ConnectionError("Link workers stopped"))
+        await asyncio.gather(*(link.close() for link in self.links.values()))
+        self.links.clear()
+        self._connections.clear()
+        if self.table is not None:
+            self.table.close()
+            self.table = None
@@ -0,0 +1,717 @@
+"""Lightweight simulated swarm of MAVLink vehicles for testing the API without SITL.
+
+Each vehicle listens on its own TCP port (like SITL's ``--count`` instances,
+5760, 5770, ...) or sends to a UDP port, and behaves enough like ArduCopter
+for every endpoint: heartbeats, mode/arm/fence/takeoff commands, the mission,
+fence and rally upload protocols, the legacy FENCE_POINT/RALLY_POINT
+protocol, parameters, TIMESYNC, and GLOBAL_POSITION_INT, GPS_RAW_INT and
+BATTERY_STATUS telemetry from a simple flight model that flies uploaded
+missions. Packets can be dropped and delayed on purpose.
+
+    cd fast_api_drone
+    python simulator.py --count 200 --print-config > drones.yaml
+    python simulator.py --count 200 --processes 4 --drop 0.02 --delay 0.05
+
+``--print-config`` writes the ``drones:`` section for config.yaml and exits.
+"""
+import argparse
+import asyncio
+import math
+import multiprocessing
+import random
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymavlink import mavutil
+import pymavlink.dialects.v20.all as dialect
+
+from params import as_float32
+
+# ArduPilot's SITL default location (CMAC, Canberra)
+HOME = (-35.363261, 149.165230, 584.0)
+METRES_PER_DEGREE = 111320.0
+
+COPTER_MODES = mavutil.mode_mapping_bynumber(dialect.MAV_TYPE_QUADROTOR)
+MISSION_TYPES = (dialect.MAV_MISSION_TYPE_MISSION, dialect.MAV_MISSION_TYPE_FENCE, dialect.MAV_MISSION_TYPE_RALLY)
+RELATIVE_FRAMES = (dialect.MAV_FRAME_GLOBAL_RELATIVE_ALT, dialect.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT)
+
+DEFAULT_PARAMS = {
+    "SYSID_THISMAV": 1.0,
+    "ARMING_CHECK": 1.0,
+    "FENCE_ENABLE": 0.0,
+    "FENCE_ACTION": 1.0,
+    "FENCE_TYPE": 7.0,
+    "FENCE_ALT_MAX": 100.0,
+    "FENCE_RADIUS": 300.0,
+    "FENCE_MARGIN": 2.0,
+    "FENCE_TOTAL": 0.0,
+    "RALLY_TOTAL": 0.0,
+    "RALLY_LIMIT_KM": 0.3,
+    "RTL_ALT": 1500.0,
+    "WPNAV_SPEED": 1000.0,
+    "WPNAV_SPEED_UP": 250.0,
+    "WPNAV_SPEED_DN": 150.0,
+    "LAND_SPEED": 50.0,
+    "BATT_CAPACITY": 5200.0,
+}
+
+
+class Impairment:
+    """Packet loss and latency applied to a vehicle's link."""
+
+    def __init__(self, drop: float = 0.0, delay: float = 0.0, jitter: float = 0.0, rng: Optional[random.Random] = None):
+        self.drop = drop
+        self.delay = delay
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def dropped(self) -> bool:
+        return self.drop > 0 and self.rng.random() < self.drop
+
+    def latency(self) -> float:
+        return self.delay + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+
+class TcpChannel(asyncio.Protocol):
+    """One GCS connection to a vehicle's TCP port."""
+
+    def __init__(self, vehicle: "SimulatedVehicle"):
+        self.vehicle = vehicle
+        self.parser = dialect.MAVLink(None)
+        self.parser.robust_parsing = True
+        self.transport: Optional[asyncio.Transport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.vehicle.channels.add(self)
+
+    def data_received(self, data: bytes):
+        for message in self.parser.parse_buffer(data) or ():
+            self.vehicle.receive(message)
+
+    def connection_lost(self, exc):
+        self.vehicle.channels.discard(self)
+
+    def send(self, data: bytes):
+        if not self.transport.is_closing():
+            self.transport.write(data)
+
+
+class UdpChannel(asyncio.DatagramProtocol):
+    """Sends to a fixed GCS address and answers whoever last sent to the vehicle."""
+
+    def __init__(self, vehicle: "SimulatedVehicle", target: Tuple[str, int]):
+        self.vehicle = vehicle
+        self.target = target
+        self.parser = dialect.MAVLink(None)
+        self.parser.robust_parsing = True
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.vehicle.channels.add(self)
+
+    def datagram_received(self, data: bytes, address):
+        self.target = address
+        for message in self.parser.parse_buffer(data) or ():
+            self.vehicle.receive(message)
+
+    def error_received(self, exc):
+        pass  # Nobody listening on the GCS port yet
+
+    def connection_lost(self, exc):
+        self.vehicle.channels.discard(self)
+
+    def send(self, data: bytes):
+        self.transport.sendto(data, self.target)
+
+
+class SimulatedVehicle:
+    """A MAVLink vehicle with a point-mass flight model, answering like ArduCopter.
+
+    Everything runs on the event loop: received messages are handled as they
+    are parsed, and one task advances the flight model and sends telemetry
+    at ``rate`` Hz plus a heartbeat every second. Replies and telemetry go to
+    every connected channel, after the link impairment decides whether each
+    packet is dropped or delayed.
+    """
+
+    def __init__(self, drone_id: str, system_id: int, home: Tuple[float, float, float], rate: float = 4.0,
+                 fixed_rate: bool = False, impairment: Optional[Impairment] = None, extra_params: int = 0):
+        self.drone_id = drone_id
+        self.system_id = system_id
+        self.home = home
+        self.rate = rate
+        self.fixed_rate = fixed_rate
+        self.impairment = impairment or Impairment()
+        self.channels: Set = set()
+        self.mav = dialect.MAVLink(self, srcSystem=system_id, srcComponent=1)
+        self.booted = time.monotonic()
+
+        self.params: Dict[str, float] = dict(DEFAULT_PARAMS, SYSID_THISMAV=float(system_id))
+        self.params.update({f"SIM_EXTRA_{i:04d}": float(i) for i in range(extra_params)})
+        self.param_names = list(self.params)
+
+        # Flight state: position, relative altitude (m), velocity north/east/down (m/s)
+        self.latitude, self.longitude = home[0], home[1]
+        self.altitude = 0.0
+        self.velocity = (0.0, 0.0, 0.0)
+        self.heading = 0.0
+        self.armed = False
+        self.mode = "STABILIZE"
+        self.battery = 100.0
+        self.takeoff_altitude: Optional[float] = None
+
+        self.plans: Dict[int, List[dialect.MAVLink_mission_item_int_message]] = {mission_type: [] for mission_type in MISSION_TYPES}
+        self.current_seq = 0
+        self.fence_points: Dict[int, dialect.MAVLink_fence_point_message] = {}
+        self.rally_points: Dict[int, dialect.MAVLink_rally_point_message] = {}
+        self.upload: Optional[Dict] = None
+        self.last_upload: Optional[Dict] = None
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+        self._upload_timer: Optional[asyncio.TimerHandle] = None
+
+    # The MAVLink encoder writes here; every packet then goes through the impairment
+    def write(self, data: bytes):
+        if self.impairment.dropped():
+            self.dropped += 1
+            return
+        self.sent += 1
+        latency = self.impairment.latency()
+        if latency > 0:
+            asyncio.get_running_loop().call_later(latency, self._transmit, bytes(data))
+        else:
+            self._transmit(data)
+
+    def _transmit(self, data: bytes):
+        for channel in list(self.channels):
+            channel.send(data)
+
+    def send(self, message: dialect.MAVLink_message):
+        self.mav.send(message)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        # Spread vehicles over the telemetry period instead of sending in lockstep
+        await asyncio.sleep(random.uniform(0, 1.0 / max(self.rate, 1.0)))
+        last = time.monotonic()
+        next_heartbeat = last
+        while True:
+            now = time.monotonic()
+            self.step(now - last)
+            last = now
+            if now >= next_heartbeat:
+                self.send_heartbeat()
+                next_heartbeat = now + 1.0
+            if self.rate > 0:
+                self.send_telemetry()
+            await asyncio.sleep(1.0 / self.rate if self.rate > 0 else 0.25)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for channel in list(self.channels):
+            channel.transport.close()
+
+    # Flight model
+
+    def _offset(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        """Metres north and east from the vehicle to a position."""
+        north = (latitude - self.latitude) * METRES_PER_DEGREE
+        east = (longitude - self.longitude) * METRES_PER_DEGREE * math.cos(math.radians(self.latitude))
+        return north, east
+
+    def _target(self) -> Optional[Tuple[float, float, float]]:
+        """Where the current mode wants to be: latitude, longitude, relative altitude."""
+        if self.mode == "AUTO":
+            mission = self.plans[dialect.MAV_MISSION_TYPE_MISSION]
+            if self.current_seq == 0:
+                self.current_seq = 1  # Item 0 is the home position
+            while self.current_seq < len(mission):
+                item = mission[self.current_seq]
+                if item.command == dialect.MAV_CMD_NAV_TAKEOFF:
+                    return self.latitude, self.longitude, item.z
+                if item.command == dialect.MAV_CMD_NAV_WAYPOINT:
+                    altitude = item.z if item.frame in RELATIVE_FRAMES else item.z - self.home[2]
+                    return item.x / 1e7, item.y / 1e7, altitude
+                if item.command == dialect.MAV_CMD_NAV_RETURN_TO_LAUNCH:
+                    self.mode = "RTL"
+                    return self._target()
+                if item.command == dialect.MAV_CMD_NAV_LAND:
+                    self.mode = "LAND"
+                    return self._target()
+                self._advance()  # Commands without a position
+            return None
+        if self.mode == "RTL":
+            rtl_altitude = self.params["RTL_ALT"] / 100.0
+            north, east = self._offset(self.home[0], self.home[1])
+            if math.hypot(north, east) < 1.0:
+                self.mode = "LAND"
+                return self._target()
+            return self.home[0], self.home[1], max(self.altitude, rtl_altitude)
+        if self.mode == "LAND":
+            return self.latitude, self.longitude, 0.0
+        if self.mode == "GUIDED" and self.takeoff_altitude is not None:
+            return self.latitude, self.longitude, self.takeoff_altitude
+        return None
+
+    def _advance(self):
+        self.send(dialect.MAVLink_mission_item_reached_message(self.current_seq))
+        self.current_seq += 1
+        mission = self.plans[dialect.MAV_MISSION_TYPE_MISSION]
+        self.send(dialect.MAVLink_mission_current_message(min(self.current_seq, len(mission) - 1), len(mission), 0, 0))
+
+    def step(self, dt: float):
+        if not self.armed:
+            self.velocity = (0.0, 0.0, 0.0)
+            return
+        self.battery = max(0.0, self.battery - 0.02 * dt)
+        target = self._target()
+        if target is None:
+            self.velocity = (0.0, 0.0, 0.0)
+            return
+
+        north, east = self._offset(target[0], target[1])
+        distance = math.hypot(north, east)
+        climb = target[2] - self.altitude
+        speed = self.params["WPNAV_SPEED"] / 100.0
+        # Climb before flying horizontally while still close to the ground
+        horizontal = min(speed, distance / dt) if distance > 0.01 and self.altitude > 2.0 else 0.0
+        vertical_limit = self.params["WPNAV_SPEED_UP"] / 100.0 if climb > 0 else \
+            self.params["LAND_SPEED"] / 100.0 if self.mode == "LAND" else self.params["WPNAV_SPEED_DN"] / 100.0
+        vertical = math.copysign(min(vertical_limit, abs(climb) / dt), climb)
+
+        velocity_north = horizontal * north / distance if distance > 0.01 else 0.0
+        velocity_east = horizontal * east / distance if distance > 0.01 else 0.0
+        self.velocity = (velocity_north, velocity_east, -vertical)
+        self.latitude += velocity_north * dt / METRES_PER_DEGREE
+        self.longitude += velocity_east * dt / (METRES_PER_DEGREE * math.cos(math.radians(self.latitude)))
+        self.altitude = max(0.0, self.altitude + vertical * dt)
+        if horizontal > 0.1:
+            self.heading = math.degrees(math.atan2(velocity_east, velocity_north)) % 360
+
+        if self.mode == "LAND" and self.altitude <= 0.0:
+            self.armed = False
+            self.takeoff_altitude = None
+        elif self.mode == "AUTO" and distance < 2.0 and abs(climb) < 1.0:
+            self._advance()
+
+    # Outgoing messages
+
+    def send_heartbeat(self):
+        base_mode = dialect.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED | dialect.MAV_MODE_FLAG_STABILIZE_ENABLED
+        if self.armed:
+            base_mode |= dialect.MAV_MODE_FLAG_SAFETY_ARMED
+        self.send(dialect.MAVLink_heartbeat_message(dialect.MAV_TYPE_QUADROTOR, dialect.MAV_AUTOPILOT_ARDUPILOTMEGA, base_mode,
+                                                    self._mode_number(self.mode),
+                                                    dialect.MAV_STATE_ACTIVE if self.armed else dialect.MAV_STATE_STANDBY, 3))
+
+    def send_telemetry(self):
+        time_boot_ms = int((time.monotonic() - self.booted) * 1000) & 0xFFFFFFFF
+        latitude, longitude = int(self.latitude * 1e7), int(self.longitude * 1e7)
+        altitude_mm = int((self.home[2] + self.altitude) * 1000)
+        north, east, down = self.velocity
+        ground_speed = math.hypot(north, east)
+        self.send(dialect.MAVLink_global_position_int_message(time_boot_ms, latitude, longitude, altitude_mm, int(self.altitude * 1000),
+                                                              int(north * 100), int(east * 100), int(down * 100),
+                                                              int(self.heading * 100)))
+        self.send(dialect.MAVLink_gps_raw_int_message(time_boot_ms * 1000, dialect.GPS_FIX_TYPE_3D_FIX, latitude, longitude, altitude_mm,
+                                                      120, 200, int(ground_speed * 100), int(self.heading * 100), 12))
+        voltage = int(10500 + 2100 * self.battery / 100.0)
+        self.send(dialect.MAVLink_battery_status_message(id=0, battery_function=dialect.MAV_BATTERY_FUNCTION_ALL,
+                                                         type=dialect.MAV_BATTERY_TYPE_LIPO, temperature=32767,
+                                                         voltages=[voltage] + [65535] * 9,
+                                                         current_battery=1500 if self.armed else 50,
+                                                         current_consumed=int(self.params["BATT_CAPACITY"] * (100 - self.battery) / 100),
+                                                         energy_consumed=-1, battery_remaining=int(self.battery)))
+
+    @staticmethod
+    def _mode_number(mode: str) -> int:
+        for number, name in COPTER_MODES.items():
+            if name == mode:
+                return number
+        return 0
+
+    def _param_value(self, name: str) -> dialect.MAVLink_param_value_message:
+        return dialect.MAVLink_param_value_message(name.encode(), self.params[name], dialect.MAV_PARAM_TYPE_REAL32,
+                                                   len(self.param_names), self.param_names.index(name))
+
+    # Incoming messages
+
+    def receive(self, message: dialect.MAVLink_message):
+        if self.impairment.dropped():
+            self.dropped += 1
+            return
+        self.received += 1
+        target = getattr(message, "target_system", 0)
+        if target not in (0, self.system_id):
+            return
+        handler = getattr(self, f"on_{message.get_type().lower()}", None)
+        if handler is not None:
+            handler(message)
+
+    def ack(self, command: int, result: int):
+        self.send(dialect.MAVLink_command_ack_message(command, result))
+
+    def on_command_long(self, message):
+        command = message.command
+        if command == dialect.MAV_CMD_DO_SET_MODE:
+            self.ack(command, self.set_mode(int(message.param2)))
+        elif command == dialect.MAV_CMD_COMPONENT_ARM_DISARM:
+            if message.param1 == 1:
+                accepted = self.battery > 0
+                self.armed = self.armed or accepted
+            else:
+                # Disarming in the air needs the force code, like ArduPilot
+                accepted = self.altitude <= 0.1 or int(message.param2) == 21196
+                self.armed = self.armed and not accepted
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED if accepted else dialect.MAV_RESULT_FAILED)
+        elif command == dialect.MAV_CMD_DO_FENCE_ENABLE:
+            self.params["FENCE_ENABLE"] = float(int(message.param1))
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED)
+        elif command == dialect.MAV_CMD_NAV_TAKEOFF:
+            accepted = self.armed and self.mode == "GUIDED"
+            if accepted:
+                self.takeoff_altitude = message.param7
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED if accepted else dialect.MAV_RESULT_FAILED)
+        elif command == dialect.MAV_CMD_MISSION_START:
+            accepted = self.armed and len(self.plans[dialect.MAV_MISSION_TYPE_MISSION]) > 1
+            if accepted:
+                self.mode = "AUTO"
+                self.current_seq = max(1, int(message.param1))
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED if accepted else dialect.MAV_RESULT_FAILED)
+        elif command == dialect.MAV_CMD_NAV_RETURN_TO_LAUNCH:
+            self.mode = "RTL"
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED)
+        elif command == dialect.MAV_CMD_NAV_LAND:
+            self.mode = "LAND"
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED)
+        elif command in (dialect.MAV_CMD_SET_MESSAGE_INTERVAL, dialect.MAV_CMD_REQUEST_MESSAGE):
+            if command == dialect.MAV_CMD_REQUEST_MESSAGE and int(message.param1) == dialect.MAVLINK_MSG_ID_HEARTBEAT:
+                self.send_heartbeat()
+            elif command == dialect.MAV_CMD_REQUEST_MESSAGE:
+                self.send_telemetry()
+            elif not self.fixed_rate and int(message.param1) == dialect.MAVLINK_MSG_ID_GLOBAL_POSITION_INT and message.param2 > 0:
+                self.rate = 1e6 / message.param2
+            self.ack(command, dialect.MAV_RESULT_ACCEPTED)
+        else:
+            self.ack(command, dialect.MAV_RESULT_UNSUPPORTED)
+
+    def set_mode(self, custom_mode: int) -> int:
+        mode = COPTER_MODES.get(custom_mode)
+        if mode is None:
+            return dialect.MAV_RESULT_FAILED
+        if mode == "AUTO" and self.current_seq >= len(self.plans[dialect.MAV_MISSION_TYPE_MISSION]):
+            self.current_seq = 0  # Restart a finished mission
+        self.mode = mode
+        return dialect.MAV_RESULT_ACCEPTED
+
+    def on_set_mode(self, message):
+        self.set_mode(message.custom_mode)
+
+    def on_request_data_stream(self, message):
+        if not self.fixed_rate and message.start_stop and message.req_message_rate > 0:
+            self.rate = float(message.req_message_rate)
+
+    def on_timesync(self, message):
+        if message.tc1 == 0:
+            self.send(dialect.MAVLink_timesync_message(time.time_ns(), message.ts1))
+
+    def on_param_request_list(self, message):
+        asyncio.get_running_loop().create_task(self._send_all_params())
+
+    async def _send_all_params(self):
+        for index, name in enumerate(self.param_names):
+            self.send(self._param_value(name))
+            if index % 50 == 49:
+                await asyncio.sleep(0.01)  # Paced like a real autopilot instead of one burst
+
+    def on_param_request_read(self, message):
+        if 0 <= message.param_index < len(self.param_names):
+            self.send(self._param_value(self.param_names[message.param_index]))
+        elif message.param_id in self.params:
+            self.send(self._param_value(message.param_id))
+
+    def on_param_set(self, message):
+        if message.param_id in self.params:
+            self.params[message.param_id] = as_float32(message.param_value)
+            self.send(self._param_value(message.param_id))
+
+    # Mission protocol (missions, fences and rally points)
+
+    def on_mission_count(self, message):
+        if message.mission_type not in MISSION_TYPES:
+            self.send(dialect.MAVLink_mission_ack_message(message.get_srcSystem(), message.get_srcComponent(),
+                                                          dialect.MAV_MISSION_UNSUPPORTED, message.mission_type))
+            return
+        self.upload = {"mission_type": message.mission_type, "count": message.count, "items": [], "retries": 0,
+                       "gcs": (message.get_srcSystem(), message.get_srcComponent())}
+        if message.count == 0:
+            self._finish_upload()
+        else:
+            self._request_next()
+
+    def _request_next(self):
+        upload = self.upload
+        self.send(dialect.MAVLink_mission_request_int_message(*upload["gcs"], len(upload["items"]), upload["mission_type"]))
+        if self._upload_timer is not None:
+            self._upload_timer.cancel()
+        self._upload_timer = asyncio.get_running_loop().call_later(1.0, self._upload_timeout)
+
+    def _upload_timeout(self):
+        if self.upload is None:
+            return
+        self.upload["retries"] += 1
+        if self.upload["retries"] > 5:
+            self.send(dialect.MAVLink_mission_ack_message(*self.upload["gcs"], dialect.MAV_MISSION_OPERATION_CANCELLED,
+                                                          self.upload["mission_type"]))
+            self.upload = None
+        else:
+            self._request_next()
+
+    def _finish_upload(self):
+        if self._upload_timer is not None:
+            self._upload_timer.cancel()
+            self._upload_timer = None
+        upload, self.upload = self.upload, None
+        self.last_upload = upload
+        self.plans[upload["mission_type"]] = upload["items"]
+        if upload["mission_type"] == dialect.MAV_MISSION_TYPE_MISSION:
+            self.current_seq = 0
+        self.send(dialect.MAVLink_mission_ack_message(*upload["gcs"], dialect.MAV_MISSION_ACCEPTED, upload["mission_type"]))
+
+    def on_mission_item_int(self, message):
+        upload = self.upload
+        if upload is None:
+            # The final item again means our ACK was lost; acknowledge it again like ArduPilot
+            last = self.last_upload
+            if last is not None and message.mission_type == last["mission_type"] and message.seq == last["count"] - 1:
+                self.send(dialect.MAVLink_mission_ack_message(*last["gcs"], dialect.MAV_MISSION_ACCEPTED, last["mission_type"]))
+            return
+        if message.mission_type != upload["mission_type"]:
+            return
+        if message.seq == len(upload["items"]):
+            upload["items"].append(message)
+            upload["retries"] = 0
+            if len(upload["items"]) == upload["count"]:
+                self._finish_upload()
+                return
+        self._request_next()
+
+    def on_mission_item(self, message):
+        # Legacy float item; keep every item in MISSION_ITEM_INT form
+        self.on_mission_item_int(dialect.MAVLink_mission_item_int_message(
+            message.target_system, message.target_component, message.seq, message.frame, message.command, message.current,
+            message.autocontinue, message.param1, message.param2, message.param3, message.param4,
+            int(message.x * 1e7), int(message.y * 1e7), message.z, message.mission_type))
+
+    def on_mission_request_list(self, message):
+        count = len(self.plans.get(message.mission_type, ()))
+        self.send(dialect.MAVLink_mission_count_message(message.get_srcSystem(), message.get_srcComponent(), count, message.mission_type))
+
+    def on_mission_request_int(self, message):
+        items = self.plans.get(message.mission_type, [])
+        if message.seq < len(items):
+            item = items[message.seq]
+            self.send(dialect.MAVLink_mission_item_int_message(
+                message.get_srcSystem(), message.get_srcComponent(), item.seq, item.frame, item.command, item.current,
+                item.autocontinue, item.param1, item.param2, item.param3, item.param4, item.x, item.y, item.z,
+                item.mission_type))
+
+    on_mission_request = on_mission_request_int
+
+    def on_mission_clear_all(self, message):
+        if message.mission_type in self.plans:
+            self.plans[message.mission_type] = []
+        self.send(dialect.MAVLink_mission_ack_message(message.get_srcSystem(), message.get_srcComponent(),
+                                                      dialect.MAV_MISSION_ACCEPTED, message.mission_type))
+
+    def on_mission_set_current(self, message):
+        self.current_seq = message.seq
+        mission = self.plans[dialect.MAV_MISSION_TYPE_MISSION]
+        self.send(dialect.MAVLink_mission_current_message(message.seq, len(mission), 0, 0))
+
+    # Legacy fence and rally point protocols
+
+    def on_fence_point(self, message):
+        self.fence_points[message.idx] = message
+
+    def on_fence_fetch_point(self, message):
+        point = self.fence_points.get(message.idx)
+        if point is not None:
+            self.send(dialect.MAVLink_fence_point_message(message.get_srcSystem(), message.get_srcComponent(),
+                                                          point.idx, point.count, point.lat, point.lng))
+
+    def on_rally_point(self, message):
+        self.rally_points[message.idx] = message
+
+    def on_rally_fetch_point(self, message):
+        point = self.rally_points.get(message.idx)
+        if point is not None:
+            self.send(dialect.MAVLink_rally_point_message(message.get_srcSystem(), message.get_srcComponent(),
+                                                          point.idx, point.count, point.lat, point.lng, point.alt,
+                                                          point.break_alt, point.land_dir, point.flags))
+
+    def status(self) -> Dict:
+        return {
+            "drone_id": self.drone_id,
+            "system_id": self.system_id,
+            "mode": self.mode,
+            "armed": self.armed,
+            "altitude": round(self.altitude, 1),
+            "connections": len(self.channels),
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped
+        }
+
+
+class SimulatedSwarm:
+    """``count`` simulated vehicles on consecutive ports, for use in-process or from the command line.
+
+    Vehicle ``i`` is ``drone_<i + 1>`` on port ``base_port + i * port_step``
+    with system id ``first_system_id + i`` (wrapping after 255). Homes are
+    laid out on a grid ``spacing`` metres apart, ``columns`` wide (square by
+    default), so vehicles start clear of each other.
+    """
+
+    def __init__(self, count: int, base_port: int = 5760, port_step: int = 10, host: str = "127.0.0.1",
+                 udp: bool = False, rate: Optional[float] = None, drop: float = 0.0, delay: float = 0.0,
+                 jitter: float = 0.0, extra_params: int = 0, spacing: float = 20.0, columns: Optional[int] = None,
+                 first_index: int = 0, first_system_id: int = 1, seed: Optional[int] = None):
+        self.host = host
+        self.udp = udp
+        self.vehicles: List[SimulatedVehicle] = []
+        self.ports: List[int] = []
+        self._servers = []
+        rng = random.Random(seed)
+        columns = columns or max(1, math.ceil(math.sqrt(first_index + count)))
+        for index in range(first_index, first_index + count):
+            north = (index // columns) * spacing
+            east = (index % columns) * spacing
+            home = (HOME[0] + north / METRES_PER_DEGREE,
+                    HOME[1] + east / (METRES_PER_DEGREE * math.cos(math.radians(HOME[0]))),
+                    HOME[2])
+            vehicle = SimulatedVehicle(f"drone_{index + 1}", (first_system_id + index - 1) % 255 + 1, home,
+                                       rate=rate if rate is not None else 4.0, fixed_rate=rate is not None,
+                                       impairment=Impairment(drop, delay, jitter, random.Random(rng.random())),
+                                       extra_params=extra_params)
+            self.vehicles.append(vehicle)
+            self.ports.append(base_port + index * port_step)
+
+    def connection_strings(self) -> Dict[str, Tuple[str, int]]:
+        """connection_string and system_id of every vehicle, as config.yaml expects them."""
+        scheme = "udpin" if self.udp else "tcp"
+        return {vehicle.drone_id: (f"{scheme}:{self.host}:{port}", vehicle.system_id)
+                for vehicle, port in zip(self.vehicles, self.ports)}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for vehicle, port in zip(self.vehicles, self.ports):
+            if self.udp:
+                await loop.create_datagram_endpoint(lambda vehicle=vehicle, port=port: UdpChannel(vehicle, (self.host, port)),
+                                                    local_addr=(self.host, 0))
+            else:
+                self._servers.append(await loop.create_server(lambda vehicle=vehicle: TcpChannel(vehicle), self.host, port))
+            vehicle.start()
+
+    def status(self) -> Dict:
+        return {
+            "vehicles": len(self.vehicles),
+            "connected": sum(1 for vehicle in self.vehicles if vehicle.channels),
+            "sent": sum(vehicle.sent for vehicle in self.vehicles),
+            "received": sum(vehicle.received for vehicle in self.vehicles),
+            "dropped": sum(vehicle.dropped for vehicle in self.vehicles)
+        }
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+        for vehicle in self.vehicles:
+            await vehicle.close()
+
+
+def config_section(swarm: SimulatedSwarm) -> str:
+    """The ``drones:`` section of config.yaml for a swarm."""
+    lines = ["drones:"]
+    for drone_id, (connection_string, system_id) in swarm.connection_strings().items():
+        lines += [f"  {drone_id}:", f'    connection_string: "{connection_string}"', f"    system_id: {system_id}"]
+    return "\n".join(lines)
+
+
+async def serve(options: Dict, first_index: int, count: int, status_interval: float):
+    swarm = SimulatedSwarm(count, first_index=first_index, **options)
+    await swarm.start()
+    first, last = swarm.ports[0], swarm.ports[-1]
+    print(f"Simulating {count} vehicles (drone_{first_index + 1}..drone_{first_index + count}) "
+          f"on {'UDP' if swarm.udp else 'TCP'} ports {first}-{last}")
+    try:
+        while True:
+            await asyncio.sleep(status_interval)
+            status = swarm.status()
+            print(f"drone_{first_index + 1}..drone_{first_index + count}: {status['connected']} connected, "
+                  f"{status['sent']} sent, {status['received']} received, {status['dropped']} dropped")
+    finally:
+        await swarm.close()
+
+
+def run_shard(options: Dict, first_index: int, count: int, status_interval: float):
+    try:
+        asyncio.run(serve(options, first_index, count, status_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated swarm of MAVLink vehicles")
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=5760)
+    parser.add_argument("--port-step", type=int, default=10)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--udp", action="store_true", help="send to udpin:<host>:<port> instead of listening on TCP")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="telemetry rate in Hz; fixed if given, otherwise set by REQUEST_DATA_STREAM (default 4)")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropping each packet, both directions")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every outgoing packet")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay of up to this many seconds")
+    parser.add_argument("--extra-params", type=int, default=0, help="padding parameters, for parameter sync load")
+    parser.add_argument("--spacing", type=float, default=20.0, help="metres between vehicle home positions")
+    parser.add_argument("--processes", type=int, default=1, help="split the vehicles over this many processes")
+    parser.add_argument("--status-interval", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--print-config", action="store_true", help="print the drones: section for config.yaml and exit")
+    args = parser.parse_args()
+
+    options = dict(base_port=args.base_port, port_step=args.port_step, host=args.host, udp=args.udp, rate=args.rate,
+                   drop=args.drop, delay=args.delay, jitter=args.jitter, extra_params=args.extra_params,
+                   spacing=args.spacing, columns=max(1, math.ceil(math.sqrt(args.count))), seed=args.seed)
+    if args.print_config:
+        print(config_section(SimulatedSwarm(args.count, **options)))
+        return
+
+    processes = max(1, min(args.processes, args.count))
+    shards = [(i * args.count // processes, (i + 1) * args.count // processes) for i in range(processes)]
+    if processes == 1:
+        run_shard(options, 0, args.count, args.status_interval)
+        return
+    workers = [multiprocessing.Process(target=run_shard, args=(options, start, end - start, args.status_interval))
+               for start, end in shards]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+import pymavlink.dialects.v20.all as dialect
+
+# Message types kept as latest-value snapshots rather than forwarded one by one
+SNAPSHOT_TYPES = [
+    dialect.MAVLink_heartbeat_message,
+    dialect.MAVLink_global_position_int_message,
+    dialect.MAVLink_gps_raw_int_message,
+    dialect.MAVLink_battery_status_message,
+    dialect.MAVLink_sys_status_message,
+    dialect.MAVLink_attitude_message,
+    dialect.MAVLink_vfr_hud_message,
+]
+SNAPSHOT_INDEX: Dict[int, int] = {cls.id: index for index, cls in enumerate(SNAPSHOT_TYPES)}
+
+# Longest MAVLink 2 frame: header, 255 payload bytes, CRC and signature
+MAX_FRAME = 280
+
+MAGIC = b"MAVSNAP1"
+HEADER = np.dtype([("magic", "S8"), ("capacity", "<u4"), ("types", "<u4")], align=True)
+HEADER_SIZE = 64
+
+SLOT = np.dtype([
+    ("seq", "<u4"),  # Seqlock: odd while the owner is writing the slot
+    ("system_id", "u1"),
+    ("component_id", "u1"),
+    ("drone_id", "S64"),
+    ("counts", "<u4", (len(SNAPSHOT_TYPES),)),  # Messages of each type published so far
+    ("received", "<f8", (len(SNAPSHOT_TYPES),)),  # Receive time (time.time) of the latest of each type
+    ("lengths", "<u2", (len(SNAPSHOT_TYPES),)),
+    ("frames", "u1", (len(SNAPSHOT_TYPES), MAX_FRAME)),  # Latest raw frame of each type
+], align=True)
+
+
+class SnapshotTable:
+    """Latest raw frame of each ``SNAPSHOT_TYPES`` message per drone, in shared memory.
+
+    One slot per drone, each written by exactly one process (the link owner)
+    and read by any number of others without locks: the owner increments
+    the slot's ``seq`` before and after every write, and a reader retries
+    whenever ``seq`` was odd or changed while it copied. ``counts`` lets a
+    reader find what changed since it last looked with one vectorised
+    comparison instead of touching every frame.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self.memory = memory
+        self.owner = owner
+        header = np.ndarray((), HEADER, memory.buf)
+        if header["magic"] != MAGIC or header["types"] != len(SNAPSHOT_TYPES):
+            raise ValueError(f"Shared memory {memory.name} is not a compatible snapshot table")
+        self.capacity = int(header["capacity"])
+        self.slots = np.ndarray((self.capacity,), SLOT, memory.buf, offset=HEADER_SIZE)
+        # Field views, so the hot paths skip the structured-array lookup
+        self.seq = self.slots["seq"]
+        self.counts = self.slots["counts"]
+        self.received = self.slots["received"]
+        self.lengths = self.slots["lengths"]
+        self.frames = self.slots["frames"]
+
+    @classmethod
+    def create(cls, capacity: int, name: Optional[str] = None) -> "SnapshotTable":
+        memory = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * SLOT.itemsize)
+        np.frombuffer(memory.buf, np.uint8)[:] = 0
+        header = np.ndarray((), HEADER, memory.buf)
+        header["magic"] = MAGIC
+        header["capacity"] = capacity
+        header["types"] = len(SNAPSHOT_TYPES)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SnapshotTable":
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def assign(self, slot: int, drone_id: str, system_id: int = 0, component_id: int = 0):
+        """Label a slot with the drone (and vehicle) it holds."""
+        self.seq[slot] += 1
+        record = self.slots[slot:slot + 1]
+        record["drone_id"] = drone_id.encode()
+        record["system_id"] = system_id
+        record["component_id"] = component_id
+        self.seq[slot] += 1
+
+    def publish(self, slot: int, index: int, frame: bytes, received: float):
+        """Store a new latest frame of ``SNAPSHOT_TYPES[index]`` (slot owner only)."""
+        length = len(frame)
+        if length > MAX_FRAME:
+            return
+        self.seq[slot] += 1
+        self.frames[slot, index, :length] = np.frombuffer(frame, np.uint8)
+        self.lengths[slot, index] = length
+        self.received[slot, index] = received
+        self.counts[slot, index] += 1
+        self.seq[slot] += 1
+
+    def read(self, slot: int, index: int, attempts: int = 1000) -> Optional[bytes]:
+        """A consistent copy of the latest frame of one type, or None if there is none yet."""
+        seq = self.seq
+        for _ in range(attempts):
+            before = int(seq[slot])
+            if before & 1:
+                continue
+            length = int(self.lengths[slot, index])
+            frame = self.frames[slot, index, :length].tobytes()
+            if int(seq[slot]) == before:
+                return frame if length else None
+        return None
+
+    def changed(self, seen: np.ndarray) -> List:
+        """``(slot, index)`` pairs published since ``seen`` (a copy of ``counts``), which is updated in place."""
+        counts = self.counts.copy()
+        slots, indexes = np.nonzero(counts != seen)
+        seen[:] = counts
+        return list(zip(slots.tolist(), indexes.tolist()))
+
+    def close(self):
+        # Views must go before the buffer can be released
+        self.slots = self.seq = self.counts = self.received = self.lengths = self.frames = None
+        self.memory.close()
+        if self.owner:
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+TELEMETRY_MAGIC = b"MAVTELE1"
+TELEMETRY_HEADER = np.dtype([
+    ("magic", "S8"),
+    ("capacity", "<u4"),
+    ("count", "<u4"),  # Slots assigned so far, in connect order
+    ("published", "<f8"),  # time.time() of the owner's last heartbeat
+], align=True)
+
+# Bits of ``fields``: which of the messages telemetry is built from have arrived
+POSITION, BATTERY, GPS = 1, 2, 4
+
+TELEMETRY_ROW = np.dtype([
+    ("seq", "<u4"),  # Seqlock: odd while the owner is writing the row
+    ("fields", "u1"),
+    ("gps_fix", "u1"),
+    ("drone_id", "S64"),
+    ("latitude", "<f8"),
+    ("longitude", "<f8"),
+    ("altitude", "<f8"),
+    ("relative_altitude", "<f8"),
+    ("heading", "<f8"),
+    ("velocity", "<f8"),
+    ("battery_remaining", "<f8"),
+    # time.monotonic() the owner received each message at; the clock is system-wide
+    ("position_time", "<f8"),
+    ("battery_time", "<f8"),
+    ("gps_time", "<f8"),
+], align=True)
+
+TELEMETRY_COLUMNS = ("fields", "gps_fix", "latitude", "longitude", "altitude", "relative_altitude", "heading",
+                     "velocity", "battery_remaining", "position_time", "battery_time", "gps_time")
+
+
+class TelemetryTable:
+    """Per-drone telemetry in shared memory, written by the link owner and served by any process.
+
+    A fixed-layout struct array with one row per drone holding exactly the
+    fields of the ``Telemetry`` response, already converted to its units,
+    and a seqlock per row like ``SnapshotTable``. Readers build responses
+    column by column straight from the shared buffer and re-read only the
+    rows that were being written meanwhile, so serving a fleet costs no
+    locks, no copies of the table and no MAVLink decoding.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self.memory = memory
+        self.owner = owner
+        self.header = np.ndarray((), TELEMETRY_HEADER, memory.buf)
+        if self.header["magic"] != TELEMETRY_MAGIC:
+            raise ValueError(f"Shared memory {memory.name} is not a telemetry table")
+        self.capacity = int(self.header["capacity"])
+        self.rows = np.ndarray((self.capacity,), TELEMETRY_ROW, memory.buf, offset=HEADER_SIZE)
+        self.seq = self.rows["seq"]
+        self.columns = {name: self.rows[name] for name in TELEMETRY_COLUMNS}
+        self._ids: List[str] = []
+
+    @classmethod
+    def create(cls, name: str, capacity: int) -> "TelemetryTable":
+        """Create the named table, replacing one left behind by an owner that did not shut down cleanly."""
+        size = HEADER_SIZE + capacity * TELEMETRY_ROW.itemsize
+        try:
+            memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        np.frombuffer(memory.buf, np.uint8)[:] = 0
+        header = np.ndarray((), TELEMETRY_HEADER, memory.buf)
+        header["magic"] = TELEMETRY_MAGIC
+        header["capacity"] = capacity
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "TelemetryTable":
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def count(self) -> int:
+        return int(self.header["count"])
+
+    @property
+    def published(self) -> float:
+        return float(self.header["published"])
+
+    # Owner side
+    def assign(self, drone_id: str) -> int:
+        slot = self.count
+        if slot >= self.capacity:
+            raise RuntimeError(f"No free telemetry row; the table holds {self.capacity} drones")
+        self.rows["drone_id"][slot] = drone_id.encode()
+        self.header["count"] = slot + 1
+        return slot
+
+    def heartbeat(self, now: float):
+        self.header["published"] = now
+
+    def update_position(self, slot: int, message: dialect.MAVLink_global_position_int_message, received: float):
+        columns = self.columns
+        self.seq[slot] += 1
+        columns["latitude"][slot] = message.lat / 1e7
+        columns["longitude"][slot] = message.lon / 1e7
+        columns["altitude"][slot] = message.alt / 1000.0
+        columns["relative_altitude"][slot] = message.relative_alt / 1000.0
+        columns["heading"][slot] = message.hdg / 100.0
+        columns["position_time"][slot] = received
+        columns["fields"][slot] |= POSITION
+        self.seq[slot] += 1
+
+    def update_battery(self, slot: int, message: dialect.MAVLink_battery_status_message, received: float):
+        columns = self.columns
+        self.seq[slot] += 1
+        columns["battery_remaining"][slot] = message.battery_remaining
+        columns["battery_time"][slot] = received
+        columns["fields"][slot] |= BATTERY
+        self.seq[slot] += 1
+
+    def update_gps(self, slot: int, message: dialect.MAVLink_gps_raw_int_message, received: float):
+        columns = self.columns
+        self.seq[slot] += 1
+        columns["velocity"][slot] = message.vel / 100.0
+        columns["gps_fix"][slot] = message.fix_type
+        columns["gps_time"][slot] = received
+        columns["fields"][slot] |= GPS
+        self.seq[slot] += 1
+
+    # Reader side
+    def drone_ids(self) -> List[str]:
+        count = self.count
+        if len(self._ids) != count:
+            self._ids = [name.decode() for name in self.rows["drone_id"][:count].tolist()]
+        return self._ids
+
+    def _read_columns(self, start: int, stop: int) -> Dict[str, list]:
+        return {name: column[start:stop].tolist() for name, column in self.columns.items()}
+
+    def _read_row(self, slot: int, attempts: int = 1000) -> Optional[Dict[str, list]]:
+        for _ in range(attempts):
+            before = int(self.seq[slot])
+            if before & 1:
+                continue
+            values = self._read_columns(slot, slot + 1)
+            if int(self.seq[slot]) == before:
+                return values
+        return None
+
+    def entries(self, now: float) -> List[Dict]:
+        """``DroneTelemetryResponse``-shaped entries (``telemetry`` or ``error``) for every drone, in connect order.
+
+        ``now`` is time.monotonic(), for ``last_update``.
+        """
+        ids = self.drone_ids()
+        count = len(ids)
+        before = self.seq[:count].copy()
+        columns = self._read_columns(0, count)
+        torn = np.nonzero((before & 1) | (before != self.seq[:count]))[0]
+        for slot in torn.tolist():
+            row = self._read_row(slot)
+            for name, column in columns.items():
+                column[slot] = row[name][0] if row is not None else 0
+
+        return [telemetry_entry(drone_id, columns, slot, now) for slot, drone_id in enumerate(ids)]
+
+    def entry(self, drone_id: str, now: float) -> Optional[Dict]:
+        """The entry of one drone, or None if the owner has not published it."""
+        ids = self.drone_ids()
+        if drone_id not in ids:
+            return None
+        slot = ids.index(drone_id)
+        row = self._read_row(slot)
+        if row is None:
+            return {"drone_id": drone_id, "error": "Telemetry is being updated too often to read"}
+        return telemetry_entry(drone_id, row, 0, now)
+
+    def close(self):
+        self.header = self.rows = self.seq = None
+        self.columns = {}
+        self.memory.close()
+        if self.owner:
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def telemetry_entry(drone_id: str, columns: Dict[str, list], index: int, now: float) -> Dict:
+    """A ``telemetry_snapshot``-style entry from row ``index`` of columns read from a ``TelemetryTable``."""
+    fields = columns["fields"][index]
+    if not fields & POSITION:
+        return {"drone_id": drone_id, "error": "No global position telemetry message received"}
+    if not fields & BATTERY:
+        return {"drone_id": drone_id, "error": "No system status telemetry message received"}
+    if not fields & GPS:
+        return {"drone_id": drone_id, "error": "No raw GPS telemetry message received"}
+    return {"drone_id": drone_id, "telemetry": {
+        "latitude": columns["latitude"][index],
+        "longitude": columns["longitude"][index],
+        "altitude": columns["altitude"][index],
+        "velocity": columns["velocity"][index],
+        "relative_altitude": columns["relative_altitude"][index],
+        "heading": columns["heading"][index],
+        "battery_remaining": columns["battery_remaining"][index],
+        "gps_fix": columns["gps_fix"][index],
+        # Age of the stalest of the three messages, as get_telemetry reports it
+        "last_update": now - min(columns["position_time"][index], columns["battery_time"][index],
+                                 columns["gps_time"][index])
+    }}
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+
+class TelemetryFrame:
+    """One tick of swarm telemetry, shared by every stream client.
+
+    ``drones`` maps drone IDs to ``DroneTelemetryResponse``-shaped dicts. The
+    JSON encoding of a selection is cached on the frame, so clients watching
+    the same drones share a single serialization per tick.
+    """
+
+    def __init__(self, timestamp: float, drones: Dict[str, Dict]):
+        self.timestamp = timestamp
+        self.drones = drones
+        self._encoded: Dict[Optional[frozenset], str] = {}
+
+    def select(self, drones: Optional[Set[str]] = None) -> List[Dict]:
+        if drones is None:
+            return list(self.drones.values())
+        return [entry for drone_id, entry in self.drones.items() if drone_id in drones]
+
+    def encode(self, drones: Optional[Set[str]] = None) -> str:
+        key = frozenset(drones) if drones is not None else None
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = self._encoded[key] = json.dumps({"timestamp": self.timestamp, "telemetry": self.select(drones)})
+        return encoded
+
+
+class StreamClient:
+    """A stream subscriber with a single latest-frame slot.
+
+    The broadcaster offers a frame whenever the client is due one. If the
+    client has not sent the previous frame by then, that frame is stale and is
+    replaced rather than queued, so a slow client falls behind by at most one
+    frame and never grows a backlog.
+    """
+
+    def __init__(self, drones: Optional[Set[str]], rate: float):
+        self.drones = drones
+        self.rate = rate
+        self.next_due = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self._frame: Optional[TelemetryFrame] = None
+        self._ready = asyncio.Event()
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.rate
+
+    def offer(self, frame: TelemetryFrame):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def next(self) -> TelemetryFrame:
+        """Wait for the newest frame not yet taken by this client."""
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        self.sent += 1
+        return frame
+
+
+class TelemetryBroadcaster:
+    """Builds swarm telemetry once per tick and hands it to every stream client.
+
+    ``snapshot`` returns the current ``DroneTelemetryResponse``-shaped entry of
+    every connected drone; it is called at most once per tick however many
+    clients are due a frame, and the broadcaster only runs while there are
+    clients. Each client is served at its own rate, up to ``max_rate``.
+    """
+
+    def __init__(self, snapshot: Callable[[], Dict[str, Dict]], max_rate: float = 20.0):
+        self.snapshot = snapshot
+        self.max_rate = max_rate
+        self.clients: List[StreamClient] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, drones: Optional[Set[str]] = None, rate: float = 1.0) -> StreamClient:
+        if not 0 < rate <= self.max_rate:
+            raise ValueError(f"rate must be between 0 and {self.max_rate} Hz")
+        client = StreamClient(drones, rate)
+        self.clients.append(client)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return client
+
+    def unregister(self, client: StreamClient):
+        if client in self.clients:
+            self.clients.remove(client)
+
+    async def _run(self):
+        while self.clients:
+            now = time.monotonic()
+            due = [client for client in self.clients if now >= client.next_due]
+            if due:
+                frame = TelemetryFrame(time.time(), self.snapshot())
+                for client in due:
+                    client.offer(frame)
+                    # Keep a steady cadence, but never burst to catch up after falling behind
+                    client.next_due += client.interval
+                    if client.next_due <= now:
+                        client.next_due = now + client.interval
+            if self.clients:
+                # Sleep until the next client is due, but wake up for newly registered clients soon
+                next_due = min(client.next_due for client in self.clients)
+                await asyncio.sleep(min(max(0.0, next_due - time.monotonic()), 1.0 / self.max_rate))
+
+    def status(self) -> List[Dict]:
+        return [{
+            "drones": sorted(client.drones) if client.drones is not None else None,
+            "rate": client.rate,
+            "sent": client.sent,
+            "dropped": client.dropped
+        } for client in self.clients]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.clients.clear()
+
+
+def parse_csv(value: Optional[str]) -> Optional[Set[str]]:
+    """Parse a comma-separated query parameter such as ``drones``; empty means no filter."""
+    if not value:
+        return None
+    return {item.strip() for item in value.split(",") if item.strip()}
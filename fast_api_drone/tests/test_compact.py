@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact import CompactDecoder, CompactEncoder  # noqa: E402
+
+
+def telemetry(**fields):
+    values = {
+        "latitude": -35.3632621,
+        "longitude": 149.1652374,
+        "altitude": 584.07,
+        "relative_altitude": 20.5,
+        "velocity": 3.25,
+        "heading": 90.5,
+        "battery_remaining": 87,
+        "gps_fix": 3,
+        "last_update": 0.25
+    }
+    values.update(fields)
+    return values
+
+
+def round_trip(*frames):
+    encoder, decoder = CompactEncoder(), CompactDecoder()
+    return [decoder.decode(encoder.encode([{"drone_id": "drone_1", "telemetry": frame}], 1.0))["telemetry"][0]["telemetry"]
+            for frame in frames]
+
+
+def test_zero_values_are_not_missing():
+    # Stationary on the ground at 0 m, on the equator and the prime meridian, with fresh telemetry
+    zero = telemetry(latitude=0.0, longitude=0.0, altitude=0.0, relative_altitude=0.0, velocity=0.0,
+                     heading=0.0, battery_remaining=0, gps_fix=0, last_update=0.0)
+    decoded, = round_trip(zero)
+    assert decoded == zero
+
+
+def test_saturated_values_are_not_missing():
+    decoded, = round_trip(telemetry(last_update=120.0, velocity=1000.0, heading=1000.0, gps_fix=300))
+    assert decoded["last_update"] == 65.534
+    assert decoded["velocity"] == 655.34
+    assert decoded["heading"] == 655.34
+    assert decoded["gps_fix"] == 0xFE
+
+
+def test_missing_values_round_trip_through_deltas():
+    missing = telemetry(relative_altitude=None, heading=None, battery_remaining=None, gps_fix=None, last_update=None)
+    zero = telemetry(relative_altitude=0.0, heading=0.0, battery_remaining=0, gps_fix=0, last_update=0.0)
+    first, second, third = round_trip(missing, zero, missing)
+    assert first == missing
+    assert second == zero
+    assert third == missing
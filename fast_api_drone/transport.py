@@ -0,0 +1,238 @@
+import asyncio
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymavlink import mavutil
+import pymavlink.dialects.v20.all as dialect
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+# Frames are dropped rather than queued once this much is waiting to be sent on one link
+MAX_WRITE_BUFFER = 1024 * 1024
+
+SERIAL_PATTERN = re.compile(r"^(?P<device>(/dev/|COM)[^,:]+)(?:[,:](?P<baud>\d+))?$")
+
+
+def parse_connection_string(connection_string: str) -> Optional[Tuple[str, str, int]]:
+    """``(kind, host or device, port or baud)`` for the connection strings the asyncio transport supports.
+
+    Supported are ``tcp:host:port``, ``udpin:host:port`` (also ``udp:``, as in
+    mavutil), ``udpout:host:port`` and serial devices (``/dev/ttyUSB0``,
+    ``COM3``, optionally ``,baud``) when pyserial-asyncio is installed.
+    Anything else returns None and is left to mavutil.
+    """
+    scheme, _, address = connection_string.partition(":")
+    if scheme in ("tcp", "udp", "udpin", "udpout"):
+        host, _, port = address.rpartition(":")
+        if not host or not port.isdigit():
+            return None
+        return ("udpin" if scheme == "udp" else scheme), host, int(port)
+    match = SERIAL_PATTERN.match(connection_string)
+    if match and serial_asyncio is not None:
+        return "serial", match.group("device"), int(match.group("baud") or 57600)
+    return None
+
+
+class MavlinkConnection:
+    """A MAVLink connection driven by the event loop instead of a reader thread.
+
+    Received bytes go straight from the asyncio transport into the pymavlink
+    parser and every decoded message is handed to ``on_message`` on the
+    loop, so a link costs no thread and no executor slot. Sends go through
+    the transport's non-blocking write buffer; if a peer stops reading and
+    more than ``MAX_WRITE_BUFFER`` bytes back up, further frames are dropped
+    and counted instead of blocking. Provides the parts of
+    ``mavutil.mavfile`` the rest of the app uses (``mav``, ``messages``,
+    ``target_system``, ``mode_mapping()``, ``write()``, ``close()``), and
+    like every asyncio object it must only be used from the loop's thread.
+    """
+
+    # False for stand-ins whose stream is parsed in another process (see shards.py)
+    parses_stream = True
+
+    def __init__(self, connection_string: str, source_system: int = 255, source_component: int = 0):
+        self.connection_string = connection_string
+        self.mav = dialect.MAVLink(self, srcSystem=source_system, srcComponent=source_component)
+        self.mav.robust_parsing = True
+        self.messages: Dict[str, dialect.MAVLink_message] = {}
+        self.target_system = 0
+        self.target_component = 0
+        self.mav_type: Optional[int] = None
+        self.mav_autopilot: Optional[int] = None
+        self.mav_count = 0
+        self.mav_loss = 0
+        self.write_dropped = 0
+        self.closed = False
+        self.on_message: Optional[Callable[[dialect.MAVLink_message], None]] = None
+        self.on_lost: Optional[Callable[[Optional[Exception]], None]] = None
+        self._transport: Optional[asyncio.BaseTransport] = None
+        self._datagram = False
+        self._remote: Optional[Tuple[str, int]] = None
+        self._fixed_remote = connection_string.startswith("udpout:")
+        self._last_seq: Dict[Tuple[int, int], int] = {}
+        self._heartbeat: Optional[asyncio.Future] = None
+
+    # Called by the protocols below
+    def _connected(self, transport: asyncio.BaseTransport, datagram: bool = False):
+        self._transport = transport
+        self._datagram = datagram
+
+    def _received(self, data: bytes):
+        try:
+            messages = self.mav.parse_buffer(data)
+        except dialect.MAVError:
+            messages = None  # Only raised without robust parsing; kept for safety
+        if messages:
+            for message in messages:
+                self._post(message)
+
+    def _lost(self, exc: Optional[Exception]):
+        if self.closed:
+            return
+        self.closed = True
+        if self._heartbeat is not None and not self._heartbeat.done():
+            self._heartbeat.set_exception(ConnectionError(f"{self.connection_string} closed while waiting for a heartbeat"))
+        if self.on_lost is not None:
+            self.on_lost(exc)
+
+    def _post(self, message: dialect.MAVLink_message):
+        msg_type = message.get_type()
+        if msg_type != "BAD_DATA":
+            # Sequence gaps per sender, as mavutil counts them
+            source = (message.get_srcSystem(), message.get_srcComponent())
+            last_seq = self._last_seq.get(source)
+            seq = message.get_seq()
+            if last_seq is not None and seq != (last_seq + 1) % 256:
+                self.mav_loss += (seq - last_seq - 1) % 256
+            self._last_seq[source] = seq
+            self.mav_count += 1
+            self.messages[msg_type] = message
+
+            if msg_type == "HEARTBEAT" and self._vehicle_heartbeat(message):
+                if self.target_system == 0:
+                    self.target_system = message.get_srcSystem()
+                    self.target_component = message.get_srcComponent()
+                if message.get_srcSystem() == self.target_system:
+                    self.mav_type = message.type
+                    self.mav_autopilot = message.autopilot
+                if self._heartbeat is not None and not self._heartbeat.done():
+                    self._heartbeat.set_result(message)
+
+        if self.on_message is not None:
+            self.on_message(message)
+
+    @staticmethod
+    def _vehicle_heartbeat(message: dialect.MAVLink_heartbeat_message) -> bool:
+        # Same test as mavutil: ignore GCSs, gimbals and other non-vehicle components
+        return (message.get_srcComponent() != dialect.MAV_COMP_ID_GIMBAL
+                and message.type not in (dialect.MAV_TYPE_GCS, dialect.MAV_TYPE_GIMBAL, dialect.MAV_TYPE_ADSB,
+                                         dialect.MAV_TYPE_ONBOARD_CONTROLLER)
+                and message.autopilot != dialect.MAV_AUTOPILOT_INVALID)
+
+    async def open(self, heartbeat_timeout: float):
+        """Connect and wait for the first vehicle heartbeat; closes the connection on failure."""
+        kind, host, port = parse_connection_string(self.connection_string)
+        loop = asyncio.get_running_loop()
+        self._heartbeat = loop.create_future()
+        try:
+            if kind == "tcp":
+                await asyncio.wait_for(loop.create_connection(lambda: StreamProtocol(self), host, port), heartbeat_timeout)
+            elif kind == "udpin":
+                await loop.create_datagram_endpoint(lambda: DatagramProtocol(self), local_addr=(host, port))
+            elif kind == "udpout":
+                self._remote = (host, port)
+                await loop.create_datagram_endpoint(lambda: DatagramProtocol(self), remote_addr=(host, port))
+                # Vehicles on udpout links only start sending once they hear from us
+                self.mav.heartbeat_send(dialect.MAV_TYPE_GCS, dialect.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+            else:
+                await serial_asyncio.create_serial_connection(loop, lambda: StreamProtocol(self), host, baudrate=port)
+            await asyncio.wait_for(asyncio.shield(self._heartbeat), heartbeat_timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            raise TimeoutError(f"No heartbeat from {self.connection_string} within {heartbeat_timeout} seconds")
+        except BaseException:
+            self.close()
+            raise
+
+    def mode_mapping(self) -> Optional[Dict[str, int]]:
+        if self.mav_autopilot == dialect.MAV_AUTOPILOT_PX4:
+            return mavutil.px4_map
+        if self.mav_type is None:
+            return None
+        return mavutil.mode_mapping_byname(self.mav_type)
+
+    def want(self, msg_types: List[str]):
+        """Declare message types a listener or subscription is waiting for.
+
+        Every message is delivered here anyway; stand-ins fed by another
+        process use this to ask for types that are not otherwise forwarded.
+        """
+
+    def write(self, data: bytes):
+        """Queue an encoded frame without blocking (also what ``mav.send`` calls)."""
+        transport = self._transport
+        if transport is None or self.closed or transport.is_closing():
+            raise ConnectionError(f"{self.connection_string} is not connected")
+        if transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            self.write_dropped += 1
+            return
+        if self._datagram:
+            if self._remote is None:
+                return  # udpin: nothing to reply to until the vehicle has sent something
+            transport.sendto(data, None if self._fixed_remote else self._remote)
+        else:
+            transport.write(data)
+
+    def close(self):
+        self.closed = True
+        if self._transport is not None:
+            self._transport.close()
+        if self._heartbeat is not None and not self._heartbeat.done():
+            self._heartbeat.cancel()
+
+
+class StreamProtocol(asyncio.Protocol):
+    """TCP or serial byte stream feeding a MavlinkConnection."""
+
+    def __init__(self, connection: MavlinkConnection):
+        self.connection = connection
+
+    def connection_made(self, transport):
+        self.connection._connected(transport)
+
+    def data_received(self, data: bytes):
+        self.connection._received(data)
+
+    def connection_lost(self, exc):
+        self.connection._lost(exc)
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    """UDP datagrams feeding a MavlinkConnection; replies go to whoever sent last (udpin)."""
+
+    def __init__(self, connection: MavlinkConnection):
+        self.connection = connection
+
+    def connection_made(self, transport):
+        self.connection._connected(transport, datagram=True)
+
+    def datagram_received(self, data: bytes, address):
+        if not self.connection._fixed_remote:
+            self.connection._remote = address
+        self.connection._received(data)
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable while the vehicle is down; the heartbeat monitor notices
+        pass
+
+    def connection_lost(self, exc):
+        self.connection._lost(exc)
+
+
+async def open_connection(connection_string: str, heartbeat_timeout: float) -> MavlinkConnection:
+    connection = MavlinkConnection(connection_string)
+    await connection.open(heartbeat_timeout)
+    return connection